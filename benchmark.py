@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+''' Reproducible benchmark of DANTE's own processing, LASTAL is replaced
+by replay of its recorded (or synthetic) MAF output '''
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import inspect
+import platform
+import resource
+import functools
+import statistics
+import subprocess
+import threading
+from tempfile import mkdtemp
+from collections import defaultdict
+import numpy as np
+import configuration
+import dante
+import dante_gff_output_filtering
+import dante_gff_to_dna
+
+AMINO_ACIDS = "ARNDCQEGHILKMFPSTWYV"
+DOMAIN_TYPES = ["GAG", "PROT", "RT", "RH", "aRH", "INT"]
+
+## (stage, object, function) timed during the benchmark, times of stages
+## calling other stages include the nested ones
+STAGES = [
+    ("characterize_fasta", dante, "characterize_fasta"),
+    ("query_windows", dante, "query_windows"),
+    ("write_windows", dante, "write_windows"),
+    ("parsing", dante, "read_lastal_hits"),
+    ("overlapping_regions", dante, "overlapping_regions"),
+    ("region_annotation", dante, "region_annotation"),
+    ("score_table", dante, "score_table"),
+    ("sweep_annotation", dante, "sweep_annotation"),
+    ("quality", dante, "filter_params_batch"),
+    ("translation_alignments", dante, "translation_alignments"),
+    ("consensus", dante, "get_full_translation"),
+    ("domain_record", dante, "domain_record"),
+    ("gff3_line", dante, "gff3_line"),
+    ("window_merge", dante.WindowMerger, "add"),
+]
+
+
+def generate_genome(genome, sequences, length, seed):
+    ''' Write random DNA sequences of the given length '''
+    ## RandomState keeps the same stream in all numpy versions
+    rnd = np.random.RandomState(seed)
+    nucleotides = np.frombuffer(b"ACGT", dtype=np.uint8)
+    with open(genome, "w") as fasta:
+        for seq_idx in range(sequences):
+            seq = nucleotides[rnd.randint(0, 4, length)].tobytes().decode(
+                "ascii")
+            fasta.write(">seq{}\n".format(seq_idx))
+            for start in range(0, length, configuration.FASTA_LINE):
+                fasta.write("{}\n".format(seq[start:start +
+                                              configuration.FASTA_LINE]))
+
+
+def synthetic_alignment(rnd):
+    ''' Random alignment of database protein and translated query
+	with gaps, frameshifts and stop codons '''
+    db_seq = []
+    query_seq = []
+    for _ in range(rnd.randint(30, 150)):
+        column = rnd.random()
+        if column < 0.05:
+            db_seq.append("-")
+            query_seq.append(rnd.choice(AMINO_ACIDS))
+        elif column < 0.1:
+            db_seq.append(rnd.choice(AMINO_ACIDS))
+            query_seq.append("-")
+        elif column < 0.12:
+            db_seq.append(rnd.choice(AMINO_ACIDS))
+            query_seq.append(rnd.choice("/\\*"))
+        else:
+            aa = rnd.choice(AMINO_ACIDS)
+            db_seq.append(aa)
+            query_seq.append(aa if rnd.random() < 0.6 else rnd.choice(
+                AMINO_ACIDS))
+    return "".join(db_seq), "".join(query_seq)
+
+
+def generate_hits(genome, recording, density, cluster, seed, WIN_DOM,
+                  OVERLAP_DOM, CLASSIFICATION):
+    ''' Write synthetic LASTAL MAF output for the windows of the genome,
+	hits (density per kb) are grouped to loci of overlapping hits. As in
+	LASTAL output, hits of a window on the plus strand come first and
+	the query starts of the minus strand are on the reverse strand.
+	Return number of hits '''
+    rnd = random.Random(seed)
+    with open(CLASSIFICATION, "r") as cl_tbl:
+        elements = [line.split("\t")[0] for line in cl_tbl]
+    records = dante.characterize_fasta(genome)
+    windows = dante.query_windows(records, WIN_DOM, WIN_DOM - OVERLAP_DOM)
+    index = {}
+    hits_count = 0
+    with open(recording, "wb") as maf:
+        for window in windows:
+            length = window.end - window.start
+            window_hits = int(density * length / 1000)
+            blocks = []
+            while len(blocks) < window_hits:
+                center = rnd.randint(0, length)
+                strand = rnd.choice("+-")
+                domain_type = rnd.choice(DOMAIN_TYPES)
+                element = rnd.choice(elements)
+                for _ in range(min(rnd.randint(1, 2 * cluster),
+                                   window_hits - len(blocks))):
+                    db_seq, query_seq = synthetic_alignment(rnd)
+                    query_len = len(dante.a2nnn(query_seq))
+                    if query_len > length:
+                        break
+                    query_start = min(max(0, center + rnd.randint(-200, 200)),
+                                      length - query_len)
+                    if strand == "-":
+                        query_start = length - query_start - query_len
+                    db_len = len(db_seq) - db_seq.count("-")
+                    db_size = db_len + rnd.randint(0, 60)
+                    db_name = "Ty{}-{}__{}".format(rnd.choice("13"),
+                                                   domain_type, element)
+                    blocks.append((
+                        strand,
+                        "a score={}\ns {} {} {} + {} {}\ns {} {} {} {} {} {}\n\n".format(
+                            rnd.randint(30, 900), db_name,
+                            rnd.randint(0, db_size - db_len), db_len, db_size,
+                            db_seq, window.name, query_start, query_len,
+                            strand, length, query_seq)))
+            if blocks:
+                ## stable sort keeps the order of the hits within a strand
+                blocks.sort(key=lambda block: block[0] == "-")
+                data = "".join(block for _, block in blocks).encode("ascii")
+                index[window.name] = [maf.tell(), len(data), len(blocks)]
+                maf.write(data)
+                hits_count += len(blocks)
+    with open("{}.json".format(recording), "w") as index_file:
+        json.dump(index, index_file)
+    return hits_count
+
+
+def record_lastal(genome, recording, LAST_DB, SCORING_MATRIX, WIN_DOM,
+                  OVERLAP_DOM):
+    ''' Run LASTAL on the windows of the genome and record its output
+	split to the individual windows, return number of hits '''
+    records = dante.characterize_fasta(genome)
+    windows = dante.query_windows(records, WIN_DOM, WIN_DOM - OVERLAP_DOM)
+    lastal = subprocess.Popen(configuration.LASTAL_COMMAND.format(
+        LAST_DB, SCORING_MATRIX),
+                              stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE,
+                              shell=True)
+    writer = threading.Thread(target=dante.write_windows,
+                              args=(genome, records, windows, lastal.stdin))
+    writer.daemon = True
+    writer.start()
+    index = {}
+    hits_count = 0
+    block = []
+    with open(recording, "wb") as maf:
+        for line in lastal.stdout:
+            if line.startswith(b"#"):
+                continue
+            if line.strip():
+                block.append(line)
+                continue
+            if not block:
+                continue
+            ## the second sequence of the block is the query window
+            name = block[2].split()[1].decode("utf-8")
+            data = b"".join(block) + b"\n"
+            if name not in index:
+                index[name] = [maf.tell(), 0, 0]
+            index[name][1] += len(data)
+            index[name][2] += 1
+            maf.write(data)
+            hits_count += 1
+            block = []
+    writer.join()
+    lastal.wait()
+    with open("{}.json".format(recording), "w") as index_file:
+        json.dump(index, index_file)
+    return hits_count
+
+
+def replay(recording):
+    ''' LASTAL stand-in: write the recorded output for the query sequences
+	read from standard input in their order '''
+    with open("{}.json".format(recording), "r") as index_file:
+        index = json.load(index_file)
+    output = sys.stdout.buffer
+    output.write(b"# LAST replay\n")
+    with open(recording, "rb") as maf:
+        for line in sys.stdin.buffer:
+            if not line.startswith(b">"):
+                continue
+            name = line[1:].split()[0].decode("utf-8")
+            if name in index:
+                maf.seek(index[name][0])
+                output.write(maf.read(index[name][1]))
+    output.flush()
+
+
+def install_replay(recording, bin_dir):
+    ''' Put the replay in the place of lastal to the PATH '''
+    lastal = os.path.join(bin_dir, "lastal")
+    with open(lastal, "w") as script:
+        script.write('#!/bin/sh\nexec "{}" "{}" replay "{}"\n'.format(
+            sys.executable, os.path.realpath(__file__),
+            os.path.realpath(recording)))
+    os.chmod(lastal, 0o755)
+    os.environ["PATH"] = "{}{}{}".format(bin_dir, os.pathsep,
+                                         os.environ["PATH"])
+
+
+def timed(function, stats):
+    ''' Wrap the function to add its time and number of calls to stats,
+	time of a generator is measured for every item '''
+    if inspect.isgeneratorfunction(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    stats[0] += time.perf_counter() - start
+                    stats[1] += 1
+                    return
+                stats[0] += time.perf_counter() - start
+                yield item
+
+        return wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats[0] += time.perf_counter() - start
+            stats[1] += 1
+
+    return wrapper
+
+
+def run_once(genome, recording, CLASSIFICATION, THRESHOLD_SCORE, WIN_DOM,
+             OVERLAP_DOM, SCORING_MATRIX, out_dir):
+    ''' Run the search, filtering and extraction with the stages timed,
+	return dictionary of stage: [seconds, calls] '''
+    stats = defaultdict(lambda: [0.0, 0])
+    originals = [(owner, name, getattr(owner, name))
+                 for _, owner, name in STAGES]
+    for stage, owner, name in STAGES:
+        setattr(owner, name, timed(getattr(owner, name), stats[stage]))
+    dom_gff = os.path.join(out_dir, configuration.DOMAINS_GFF)
+    extract_dir = os.path.join(out_dir, configuration.EXTRACT_OUT_DIR)
+    os.makedirs(extract_dir)
+    filt_gff = os.path.join(out_dir, configuration.FILT_DOM_GFF)
+    try:
+        timed(dante.domain_search, stats["domain_search"])(
+            genome, recording, CLASSIFICATION, dom_gff, THRESHOLD_SCORE,
+            WIN_DOM, OVERLAP_DOM, SCORING_MATRIX)
+    finally:
+        for owner, name, function in originals:
+            setattr(owner, name, function)
+    timed(dante_gff_output_filtering.filter_qual_dom, stats["filtering"])(
+        dom_gff, filt_gff, 0.35, 0.45, 0.8, 3, 1.2, "All", "", None,
+        os.path.join(out_dir, configuration.DOM_PROT_SEQ))
+    timed(dante_gff_to_dna.extract_nt_seqs, stats["extraction"])(
+        genome, filt_gff, extract_dir, CLASSIFICATION, True)
+    with open(dom_gff, "r") as gff:
+        stats["domains"] = sum(1 for line in gff if not line.startswith("#"))
+    return dict(stats)
+
+
+def git_commit(path):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       cwd=path,
+                                       stderr=subprocess.DEVNULL).decode(
+                                           "ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(bench_dir, CLASSIFICATION, THRESHOLD_SCORE, WIN_DOM,
+                  OVERLAP_DOM, SCORING_MATRIX, repeats):
+    ''' Repeat the timed run on the benchmark data, return the results
+	with median times of the stages, throughput and peak memory '''
+    genome = os.path.join(bench_dir, configuration.BENCH_GENOME)
+    recording = os.path.join(bench_dir, configuration.BENCH_RECORDING)
+    with open("{}.json".format(recording), "r") as index_file:
+        hits_count = sum(hits for _, _, hits in json.load(index_file).values())
+    bases = sum(record.length for record in dante.characterize_fasta(genome))
+    configuration.SC_MATRIX = configuration.SC_MATRIX_SKELETON.format(
+        SCORING_MATRIX)
+    tmp_dir = mkdtemp()
+    install_replay(recording, tmp_dir)
+    runs = []
+    try:
+        for repeat in range(repeats):
+            out_dir = os.path.join(tmp_dir, "run{}".format(repeat))
+            os.makedirs(out_dir)
+            runs.append(run_once(genome, recording, CLASSIFICATION,
+                                 THRESHOLD_SCORE, WIN_DOM, OVERLAP_DOM,
+                                 SCORING_MATRIX, out_dir))
+    finally:
+        shutil.rmtree(tmp_dir)
+    stages = {}
+    for stage in runs[0]:
+        if stage == "domains":
+            continue
+        stages[stage] = {
+            "seconds": statistics.median(run[stage][0] for run in runs),
+            "calls": runs[0][stage][1]
+        }
+    search_time = stages["domain_search"]["seconds"]
+    return {
+        "commit": git_commit(os.path.dirname(os.path.realpath(__file__))),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "parameters": {
+            "threshold_score": THRESHOLD_SCORE,
+            "win_dom": WIN_DOM,
+            "overlap_dom": OVERLAP_DOM,
+            "scoring_matrix": SCORING_MATRIX,
+            "repeats": repeats
+        },
+        "input": {
+            "sequences": len(dante.characterize_fasta(genome)),
+            "bases": bases,
+            "hits": hits_count,
+            "domains": runs[0]["domains"]
+        },
+        "stages": stages,
+        "throughput": {
+            "bases_per_second": bases / search_time,
+            "hits_per_second": hits_count / search_time
+        },
+        ## kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_rss_children_kb":
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    }
+
+
+def main(args):
+    CLASSIFICATION = args.classification
+    WIN_DOM = args.win_dom
+    OVERLAP_DOM = args.overlap_dom
+    if args.command == "replay":
+        replay(args.recording)
+        return
+    if not os.path.exists(args.bench_dir):
+        os.makedirs(args.bench_dir)
+    genome = os.path.join(args.bench_dir, configuration.BENCH_GENOME)
+    recording = os.path.join(args.bench_dir, configuration.BENCH_RECORDING)
+    if args.command == "generate":
+        generate_genome(genome, args.sequences, args.length, args.seed)
+        hits_count = generate_hits(genome, recording, args.density,
+                                   args.cluster, args.seed, WIN_DOM,
+                                   OVERLAP_DOM, CLASSIFICATION)
+        print("GENERATED_HITS = {}".format(hits_count))
+    elif args.command == "record":
+        if args.query:
+            shutil.copyfile(args.query, genome)
+        hits_count = record_lastal(genome, recording, args.protein_database,
+                                   args.scoring_matrix, WIN_DOM, OVERLAP_DOM)
+        print("RECORDED_HITS = {}".format(hits_count))
+    else:
+        results = run_benchmark(args.bench_dir, CLASSIFICATION,
+                                args.threshold_score, WIN_DOM, OVERLAP_DOM,
+                                args.scoring_matrix, args.repeats)
+        if args.output:
+            with open(args.output, "w") as output:
+                json.dump(results, output, indent=1)
+        else:
+            json.dump(results, sys.stdout, indent=1)
+            print()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=
+        '''Benchmark of DANTE's own processing without the aligner. Synthetic
+		genome and LASTAL hits are generated (or LASTAL output of a real genome
+		is recorded once) to a benchmark directory, the benchmark then runs
+		domains search, filtering and extraction with LASTAL replaced by replay
+		of the recording and reports times of the individual stages, throughput
+		and peak memory in JSON format.
+
+	EXAMPLE OF USAGE:
+
+		./benchmark.py generate bench -n 20 -l 500000 -den 2
+		./benchmark.py run bench -o results.json
+		''',
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    commands = {}
+    for command, help_text in [
+        ("generate", "generate synthetic genome and LASTAL hits"),
+        ("record", "record LASTAL output for a genome"),
+        ("run", "run the benchmark on the recorded data")
+    ]:
+        commands[command] = subparsers.add_parser(
+            command,
+            help=help_text,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        commands[command].add_argument("bench_dir",
+                                       help="benchmark data directory")
+        commands[command].add_argument(
+            "-wd",
+            "--win_dom",
+            type=int,
+            default=10000000,
+            help="window to process large input sequences sequentially")
+        commands[command].add_argument(
+            "-od",
+            "--overlap_dom",
+            type=int,
+            default=10000,
+            help="overlap of sequences in two consecutive windows")
+        commands[command].add_argument(
+            "-cs",
+            "--classification",
+            type=str,
+            default=os.path.join(configuration.TOOL_DATA, "protein_domains",
+                                 "Viridiplantae_v3.0_class"),
+            help="protein domains classification file")
+        commands[command].add_argument(
+            "-M",
+            "--scoring_matrix",
+            type=str,
+            default="BL80",
+            choices=['BL80', 'BL62', 'MIQS'],
+            help="scoring matrix of the search")
+    commands["generate"].add_argument("-n",
+                                      "--sequences",
+                                      type=int,
+                                      default=10,
+                                      help="number of sequences")
+    commands["generate"].add_argument("-l",
+                                      "--length",
+                                      type=int,
+                                      default=200000,
+                                      help="length of the sequences")
+    commands["generate"].add_argument("-den",
+                                      "--density",
+                                      type=float,
+                                      default=1.0,
+                                      help="number of hits per kb")
+    commands["generate"].add_argument(
+        "-cl",
+        "--cluster",
+        type=int,
+        default=5,
+        help="average number of overlapping hits of a locus")
+    commands["generate"].add_argument("--seed",
+                                      type=int,
+                                      default=0,
+                                      help="seed of the random generator")
+    commands["record"].add_argument(
+        "-q",
+        "--query",
+        type=str,
+        help="genome to record, copied to the benchmark directory "
+        "(the genome already in the directory is used otherwise)")
+    commands["record"].add_argument("-pdb",
+                                    "--protein_database",
+                                    type=str,
+                                    required=True,
+                                    help="protein domains database file")
+    commands["run"].add_argument(
+        "-thsc",
+        "--threshold_score",
+        type=int,
+        default=80,
+        help="percentage of the best score in the cluster to be tolerated")
+    commands["run"].add_argument("-r",
+                                 "--repeats",
+                                 type=int,
+                                 default=3,
+                                 help="number of repeated runs")
+    commands["run"].add_argument("-o",
+                                 "--output",
+                                 type=str,
+                                 help="output JSON file (default: stdout)")
+    replay_parser = subparsers.add_parser(
+        "replay", help="LASTAL stand-in used by the benchmark")
+    replay_parser.add_argument("recording", help="recorded MAF output")
+    replay_parser.set_defaults(classification=None,
+                               win_dom=None,
+                               overlap_dom=None)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+''' Reading of gzip compressed files without a decompressed copy - random
+access to BGZF (bgzip) files by their block offsets, plain gzip files are
+decompressed as a stream. Writing of BGZF files '''
+import os
+import gzip
+import zlib
+import struct
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+GZI_SUFFIX = ".gzi"
+GZIP_MAGIC = b"\x1f\x8b"
+## decompressed BGZF blocks kept in memory (a block has at most 64 kB)
+BLOCK_CACHE = 64
+## plain gzip: bytes read at once and bytes kept before the last accessed
+## position, reading further back restarts the decompression
+STREAM_CHUNK = 1 << 20
+STREAM_BACKWARD = 1 << 20
+## uncompressed size of the written blocks (as by bgzip) and the empty block
+## marking the end of BGZF file
+BLOCK_SIZE = 0xff00
+EOF_BLOCK = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def is_gzip(path):
+    with open(path, "rb") as gzip_file:
+        return gzip_file.read(2) == GZIP_MAGIC
+
+
+def block_header(header):
+    ''' Return (header length, block size) of BGZF block from the start of
+	the block (at least 18 bytes), block size is None if it is not BGZF '''
+    if len(header) < 18 or header[:2] != GZIP_MAGIC or not header[3] & 4:
+        return None, None
+    extra_len, = struct.unpack("<H", header[10:12])
+    extra = header[12:12 + extra_len]
+    position = 0
+    while position + 4 <= len(extra):
+        subfield_len, = struct.unpack("<H", extra[position + 2:position + 4])
+        if extra[position:position + 2] == b"BC" and subfield_len == 2:
+            return 12 + extra_len, struct.unpack(
+                "<H", extra[position + 4:position + 6])[0] + 1
+        position += 4 + subfield_len
+    return 12 + extra_len, None
+
+
+def is_bgzf(path):
+    with open(path, "rb") as gzip_file:
+        return block_header(gzip_file.read(256))[1] is not None
+
+
+def scan_blocks(fd, offset=0, uncompressed=0):
+    ''' Return list of (offset, uncompressed offset) of the blocks from the
+	given block to the end of the file followed by the file size and
+	the decompressed length. Only headers and sizes (ISIZE) of the blocks are
+	read, nothing is decompressed '''
+    blocks = []
+    file_size = os.fstat(fd).st_size
+    while offset < file_size:
+        _, block_size = block_header(os.pread(fd, 256, offset))
+        if block_size is None:
+            raise ValueError("Not a BGZF block at offset {}".format(offset))
+        blocks.append((offset, uncompressed))
+        uncompressed += struct.unpack(
+            "<I", os.pread(fd, 4, offset + block_size - 4))[0]
+        offset += block_size
+    blocks.append((file_size, uncompressed))
+    return blocks
+
+
+def read_gzi(gzi):
+    ''' Load (offset, uncompressed offset) of the blocks from the index
+	file (bgzip -i format, the first block is not included) '''
+    with open(gzi, "rb") as gzi_file:
+        count, = struct.unpack("<Q", gzi_file.read(8))
+        values = struct.unpack("<{}Q".format(2 * count),
+                               gzi_file.read(16 * count))
+    return [(0, 0)] + list(zip(values[::2], values[1::2]))
+
+
+def write_gzi(gzi, blocks):
+    ''' Save the block offsets, skipped if the directory is not writable '''
+    try:
+        with NamedTemporaryFile("wb", dir=os.path.dirname(os.path.abspath(gzi)),
+                                delete=False) as gzi_file:
+            gzi_file.write(struct.pack("<Q", len(blocks) - 1))
+            for block in blocks[1:]:
+                gzi_file.write(struct.pack("<QQ", *block))
+        os.chmod(gzi_file.name, 0o644)
+        os.replace(gzi_file.name, gzi)
+    except OSError:
+        pass
+
+
+def block_index(path, fd):
+    ''' Return offsets of the blocks with the final (file size, length),
+	the index file is built only once and reused while it is newer than
+	the compressed file '''
+    gzi = "{}{}".format(path, GZI_SUFFIX)
+    if os.path.exists(gzi) and os.path.getmtime(gzi) >= os.path.getmtime(
+            path):
+        try:
+            blocks = read_gzi(gzi)
+            ## the length is given by the blocks after the last indexed one
+            return blocks[:-1] + scan_blocks(fd, *blocks[-1])
+        except (ValueError, struct.error):
+            pass
+    blocks = scan_blocks(fd)
+    write_gzi(gzi, blocks[:-1])
+    return blocks
+
+
+class BgzfReader():
+    '''
+    Decompressed content of BGZF file sliced as bytes, only the blocks of
+    the requested part are read and decompressed
+    '''
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY)
+        blocks = block_index(path, self.fd)
+        self.offsets = [offset for offset, _ in blocks]
+        self.starts = [start for _, start in blocks]
+        self.length = self.starts[-1]
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def block(self, idx):
+        ''' Decompressed block, the recently used blocks are cached '''
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            return self.cache[idx]
+        data = os.pread(self.fd, self.offsets[idx + 1] - self.offsets[idx],
+                        self.offsets[idx])
+        header_len, _ = block_header(data)
+        self.cache[idx] = zlib.decompress(data[header_len:-8], -15)
+        if len(self.cache) > BLOCK_CACHE:
+            self.cache.popitem(last=False)
+        return self.cache[idx]
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(self.length)
+        parts = []
+        idx = bisect_right(self.starts, start) - 1
+        while start < stop:
+            parts.append(self.block(idx)[start - self.starts[idx]:stop -
+                                         self.starts[idx]])
+            idx += 1
+            start = self.starts[idx]
+        return b"".join(parts)
+
+    def position(self, virtual_offset):
+        ''' Position in the decompressed file of the virtual offset (block
+	offset shifted by 16 bits plus the position in the block) '''
+        idx = bisect_left(self.offsets, virtual_offset >> 16)
+        return self.starts[idx] + (virtual_offset & 0xffff)
+
+    def find(self, sub, start=0):
+        ''' Position of the first occurrence of sub from the start, -1 if
+	it is not found '''
+        idx = bisect_right(self.starts, start) - 1
+        carry = b""
+        carry_start = start
+        while start < self.length:
+            data = carry + self.block(idx)[start - self.starts[idx]:]
+            found = data.find(sub)
+            if found != -1:
+                return carry_start + found
+            ## blocks can be shorter than the searched string
+            carry = data[max(0, len(data) - len(sub) + 1):] if len(
+                sub) > 1 else b""
+            carry_start = self.starts[idx + 1] - len(carry)
+            idx += 1
+            start = self.starts[idx]
+        return -1
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class GzipStream():
+    '''
+    Decompressed content of plain gzip file sliced as bytes, suited for
+    reading in one direction. Data before the last accessed position (with
+    STREAM_BACKWARD reserve) are dropped, reading before them decompresses
+    the file again from the start
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = None
+        self.open()
+
+    def open(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = gzip.open(self.path, "rb")
+        self.buffer = bytearray()
+        self.start = 0
+        self.keep = 0
+        self.eof = False
+
+    def __len__(self):
+        self.read_to(None)
+        return self.start + len(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read_to(self, end):
+        ''' Decompress till the end position (the end of the file if None) '''
+        while not self.eof and (end is None or
+                                self.start + len(self.buffer) < end):
+            data = self.stream.read(STREAM_CHUNK)
+            if not data:
+                self.eof = True
+            self.buffer += data
+            self.trim()
+
+    def trim(self):
+        ## dropped in larger parts to avoid moving the buffer too often
+        if self.keep - self.start > STREAM_BACKWARD:
+            drop = min(self.keep - self.start, len(self.buffer))
+            del self.buffer[:drop]
+            self.start += drop
+
+    def seek(self, position):
+        ''' Prepare reading from the position '''
+        if position < self.start:
+            self.open()
+        self.keep = max(0, position - STREAM_BACKWARD)
+        self.trim()
+
+    def __getitem__(self, key):
+        start = key.start or 0
+        self.seek(start)
+        self.read_to(key.stop)
+        return bytes(self.buffer[start - self.start:None if key.stop is None
+                                 else key.stop - self.start])
+
+    def find(self, sub, start=0):
+        ''' Position of the first occurrence of sub from the start, -1 if
+	it is not found '''
+        self.seek(start)
+        position = start
+        while True:
+            found = self.buffer.find(sub, position - self.start)
+            if found != -1:
+                return self.start + found
+            if self.eof:
+                return -1
+            position = max(start,
+                           self.start + len(self.buffer) - len(sub) + 1)
+            self.read_to(self.start + len(self.buffer) + STREAM_CHUNK)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+def open_gzip(path):
+    ''' Random access reader of BGZF file, stream reader of plain gzip '''
+    if is_bgzf(path):
+        return BgzfReader(path)
+    return GzipStream(path)
+
+
+class BgzfWriter():
+    '''
+    BGZF file written by blocks readable by gzip, bgzip and tabix. Position
+    in the file is given by virtual offset - the offset of the block start
+    in the file shifted by 16 bits plus the position in the decompressed block
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tell(self):
+        return self.file.tell() << 16 | len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+        ## full blocks are written at once, so the virtual offset
+        ## always points to a block which will be written
+        while len(self.buffer) >= BLOCK_SIZE:
+            self.write_block(self.buffer[:BLOCK_SIZE])
+            del self.buffer[:BLOCK_SIZE]
+
+    def write_block(self, data):
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                      -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        self.file.write(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00")
+        self.file.write(struct.pack("<H", len(compressed) + 25))
+        self.file.write(compressed)
+        self.file.write(struct.pack("<II", zlib.crc32(data), len(data)))
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.buffer:
+            self.write_block(self.buffer)
+            self.buffer = bytearray()
+        self.file.write(EOF_BLOCK)
+        self.file.close()
+
+    def discard(self):
+        ''' Close and remove the unfinished file '''
+        if not self.file.closed:
+            self.file.close()
+        os.remove(self.path)
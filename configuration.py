@@ -7,8 +7,46 @@ TOOL_DATA = os.path.join(MAIN_GIT_DIR, "tool-data")
 TMP = "tmp"
 SC_MATRIX_SKELETON = os.path.join(TOOL_DATA, "{}.txt.sample")
 AMBIGUOUS_TAG = "Ambiguous_domain"
+## regions with larger score matrix (annotations x positions) are annotated
+## by the sweep over hits boundaries
+MAX_SCORE_MATRIX_SIZE = 2000000
+## search of the query windows, MAF output is read from stdout
+LASTAL_COMMAND = "lastal -F15 {} -L 10 -m 70 -p {} -e 80 -f MAF"
 ## IO
 CLASS_FILE = "ALL.classification-new"
+CLASS_INDEX_SUFFIX = ".index"
+CHECKPOINT_MANIFEST = "manifest.json"
+FRAGMENT_PREFIX = "fragment_"
+DONE_SUFFIX = ".done"
+## size limit of the domains cache in bytes
+CACHE_SIZE = 1024 * 1024 * 1024
+## search metrics and profiles of the stages saved next to the domains gff
+METRICS_SUFFIX = ".metrics.json"
+PROFILE_SUFFIX = ".prof"
+TRACEMALLOC_SUFFIX = ".tracemalloc.txt"
+TRACEMALLOC_TOP = 25
+## columnar table of the domains saved next to the domains gff (directory),
+## its metadata file and format name, rows written to the column files at once
+TABLE_SUFFIX = ".table"
+TABLE_META = "table.json"
+TABLE_FORMAT = "dante_domains_table_1"
+TABLE_CHUNK = 65536
+## pipelined search: hits of at most this number of sequences are waiting
+## for the processing, results are checked in the interval (s)
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_POLL = 0.01
+## temporary files of the spilled hits alignments
+SPILL_PREFIX = "dante_hits_"
+## gap aware windows: bases of the gaps, default minimal gap length and
+## number of bases read at once when searching for the gaps
+GAP_BASES = rb"[NnXx]+"
+GAP_MIN = 100
+GAP_CHUNK = 10000000
+## dante_server.py: line ending requests and responses, requests coming
+## within the delay (ms) are searched together up to the size (bases)
+SERVER_END = "//"
+SERVER_BATCH_DELAY = 10
+SERVER_BATCH_SIZE = 10000000
 LAST_DB_FILE = "ALL_protein-domains_05.fasta"
 DOM_PROT_SEQ = "dom_prot_seq.fa"
 FILT_DOM_GFF = "domains_filtered.gff"
@@ -21,3 +59,6 @@ DOMAINS_FEATURE = "protein_domain"
 PHASE = "."
 HEADER_GFF = "##gff-version 3"
 DOMAINS_GFF = "output_domains.gff"
+## benchmark data
+BENCH_GENOME = "genome.fasta"
+BENCH_RECORDING = "lastal.maf"
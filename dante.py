@@ -10,165 +10,240 @@ from itertools import groupby
 import os
 import re
 import configuration
+import fasta_index
+import gff_index
+import domain_table
 from tempfile import NamedTemporaryFile
+from tempfile import mkdtemp
+from tempfile import mkstemp
 import sys
-import warnings
+import string
+import functools
 import shutil
-from collections import defaultdict
+import glob
+import json
+import hashlib
+import pickle
+import heapq
+from array import array
+import multiprocessing
+import threading
+import queue
+from collections import deque
+import io
+import cProfile
+import tracemalloc
+import resource
+from collections import namedtuple
 
 np.set_printoptions(threshold=sys.maxsize)
 
-def alignment_scoring():
-    ''' Create hash table for alignment similarity counting: for every 
-	combination of aminoacids in alignment assign score from protein 
-	scoring matrix defined in configuration file  '''
-    score_dict = {}
-    with open(configuration.SC_MATRIX) as smatrix:
-        count = 1
-        for line in smatrix:
-            if not line.startswith("#"):
-                if count == 1:
-                    aa_all = line.rstrip().replace(" ", "")
-                else:
-                    count_aa = 1
-                    line = list(filter(None, line.rstrip().split(" ")))
-                    for aa in aa_all:
-                        score_dict["{}{}".format(line[0], aa)] = line[count_aa]
-                        count_aa += 1
-                count += 1
-    return score_dict
-
-
-def characterize_fasta(QUERY, WIN_DOM):
-    ''' Find the sequences, their lengths, starts, ends and if 
-	they exceed the window '''
-    with open(QUERY) as query:
-        headers = []
-        fasta_lengths = []
-        seq_starts = []
-        seq_ends = []
-        fasta_chunk_len = 0
-        count_line = 1
-        for line in query:
-            line = line.rstrip()
-            if line.startswith(">"):
-                headers.append(line.rstrip())
-                fasta_lengths.append(fasta_chunk_len)
-                fasta_chunk_len = 0
-                seq_starts.append(count_line + 1)
-                seq_ends.append(count_line - 1)
-            else:
-                fasta_chunk_len += len(line)
-            count_line += 1
-        seq_ends.append(count_line)
-        seq_ends = seq_ends[1:]
-        fasta_lengths.append(fasta_chunk_len)
-        fasta_lengths = fasta_lengths[1:]
-        # control if there are correct (unique) names for individual seqs:
-        # LASTAL takes seqs IDs till the first space which can then create problems with ambiguous records
-        if len(headers) > len(set([header.split(" ")[0] for header in headers
-                                   ])):
-            raise NameError(
-                '''Sequences in multifasta format are not named correctly:
+## domain found in a window, positions are relative to the window (1-based)
+Domain = namedtuple("Domain", [
+    "start", "end", "score", "strand", "name", "classification",
+    "region_classifications", "best_hit", "best_start", "best_end",
+    "best_hit_percent", "db_start", "db_end", "db_len", "db_seq", "region_seq",
+    "query_seq", "identity", "similarity", "relat_length",
+    "relat_interruptions", "hit_to_db_length"
+])
+## domain on the whole query sequence as yielded by DomainSearch
+SequenceDomain = namedtuple("SequenceDomain", ["seq_id"] + list(Domain._fields))
+## part of a sequence searched at once (whole sequence if it does not exceed
+## the window), name is the sequence id passed to LASTAL, domains of the window
+## are reported between the cuts in the middle of the overlaps with the
+## neighbouring windows (None for sequence ends)
+Window = namedtuple("Window", ["name", "record", "start", "end", "cut_start",
+                               "cut_end"])
+
+
+def characterize_fasta(QUERY):
+    ''' Find the sequences, their lengths, starts (byte offsets) and line
+	lengths using the fasta index, return list of FastaRecords '''
+    records = fasta_index.load_index(QUERY)
+    # control if there are correct (unique) names for individual seqs:
+    # LASTAL takes seqs IDs till the first space which can then create problems with ambiguous records
+    if len(records) > len(set([record.name for record in records])):
+        raise NameError(
+            '''Sequences in multifasta format are not named correctly:
 							seq IDs (before the first space) are the same''')
+    return records
+
+
+def query_windows(records, WIN_DOM, step, gaps=None):
+    ''' Sequences that exceed the window are cut with a set overlap (greater
+	than domain size with a reserve), return list of Windows in the input order.
+	If the gaps (list of (start, end) for every sequence) are given,
+	the sequences are cut in the gaps which are not searched at all, only
+	the parts between the gaps exceeding the window are cut with the overlap '''
+    windows = []
+    overlap = WIN_DOM - step
+    for idx, record in enumerate(records):
+        parts = sequence_parts(record.length, gaps[idx] if gaps else [])
+        if parts == [(0, record.length)] and record.length <= WIN_DOM:
+            windows.append(Window(record.name, idx, 0, record.length, None,
+                                  None))
+            continue
+        ## starting positions of individual parts of a seq with a step given by a window and overlap,
+        ## the end of the last one is the end of the part
+        cuts = []
+        for part_start, part_end in parts:
+            if part_end - part_start <= WIN_DOM:
+                cuts.append((part_start, part_end, None, None))
+                continue
+            windows_starts = list(range(part_start, part_end, step))
+            for count, start_part in enumerate(windows_starts, start=1):
+                cuts.append((start_part, min(start_part + WIN_DOM, part_end),
+                             start_part + overlap / 2 if count > 1 else None,
+                             start_part + WIN_DOM - overlap / 2
+                             if count < len(windows_starts) else None))
+        for count_part, (start_part, end_part, cut_start,
+                         cut_end) in enumerate(cuts, start=1):
+            if count_part == len(cuts):
+                name = "{}_DANTE_PART{}_LAST:{}-{}".format(
+                    record.name, count_part, start_part + 1, end_part)
+            else:
+                name = "{}_DANTE_PART{}:{}-{}".format(
+                    record.name, count_part, start_part + 1, end_part)
+            windows.append(Window(name, idx, start_part, end_part, cut_start,
+                                  cut_end))
+    return windows
+
+
+def sequence_parts(length, gaps):
+    ''' Return (start, end) of the parts of the sequence between the gaps '''
+    if not gaps:
+        return [(0, length)]
+    parts = []
+    position = 0
+    for gap_start, gap_end in gaps:
+        if gap_start > position:
+            parts.append((position, gap_start))
+        position = gap_end
+    if position < length:
+        parts.append((position, length))
+    return parts
+
+
+def query_gaps(QUERY, records, MIN_GAP):
+    ''' Return list of the gaps (start, end) - runs of unknown or masked bases
+	(N, X) at least MIN_GAP long - for every sequence. Sequences are read by
+	chunks from the query file '''
+    gaps = []
+    gap_bases = re.compile(configuration.GAP_BASES)
+    with fasta_index.open_fasta(QUERY) as fasta:
+        for record in records:
+            record_gaps = []
+            chunks = [(start, min(start + configuration.GAP_CHUNK,
+                                  record.length))
+                      for start in range(0, record.length,
+                                         configuration.GAP_CHUNK)]
+            for (chunk_start, _), chunk in zip(
+                    chunks,
+                    fasta_index.record_subsequences(fasta, record, chunks)):
+                for run in gap_bases.finditer(chunk):
+                    start = chunk_start + run.start()
+                    end = chunk_start + run.end()
+                    ## runs continuing in the next chunk are joined
+                    if record_gaps and record_gaps[-1][1] == start:
+                        record_gaps[-1] = (record_gaps[-1][0], end)
+                        continue
+                    if record_gaps and (record_gaps[-1][1] -
+                                        record_gaps[-1][0]) < MIN_GAP:
+                        record_gaps.pop()
+                    record_gaps.append((start, end))
+            if record_gaps and (record_gaps[-1][1] -
+                                record_gaps[-1][0]) < MIN_GAP:
+                record_gaps.pop()
+            gaps.append(record_gaps)
+    return gaps
+
+
+def write_windows(QUERY, records, windows, stream):
+    ''' Write windows of the query sequences in fasta format to the stream,
+	sequences are read from the query file (memory mapped or decompressed)
+	window by window '''
+    try:
+        with fasta_index.open_fasta(QUERY) as fasta:
+            for record_idx, record_windows in groupby(
+                    windows, key=lambda window: window.record):
+                record_windows = list(record_windows)
+                subsequences = fasta_index.record_subsequences(
+                    fasta, records[record_idx],
+                    [(window.start, window.end) for window in record_windows])
+                for window, subsequence in zip(record_windows, subsequences):
+                    stream.write(">{}\n".format(window.name).encode("utf-8"))
+                    stream.write(subsequence)
+                    stream.write(b"\n")
+        stream.close()
+    except BrokenPipeError:
+        ## LASTAL terminated, the error is reported by the reading side
+        pass
 
-    above_win = [idx
-                 for idx, value in enumerate(fasta_lengths) if value > WIN_DOM]
-    below_win = [idx
-                 for idx, value in enumerate(fasta_lengths)
-                 if value <= WIN_DOM]
-    lens_above_win = np.array(fasta_lengths)[above_win]
-    return headers, above_win, below_win, lens_above_win, seq_starts, seq_ends
-
-
-def split_fasta(QUERY, WIN_DOM, step, headers, above_win, below_win,
-                lens_above_win, seq_starts, seq_ends):
-    ''' Create temporary file containing all sequences - the ones that exceed 
-	the window are cut with a set overlap (greater than domain size with a reserve) '''
-    with open(QUERY, "r") as query:
-        count_fasta_divided = 0
-        count_fasta_not_divided = 0
-        ntf = NamedTemporaryFile(delete=False)
-        divided = np.array(headers)[above_win]
-        row_length = configuration.FASTA_LINE
-        for line in query:
-            line = line.rstrip()
-            if line.startswith(">") and line in divided:
-                stop_line = seq_ends[above_win[
-                    count_fasta_divided]] - seq_starts[above_win[
-                        count_fasta_divided]] + 1
-                count_line = 0
-                whole_seq = []
-                for line2 in query:
-                    whole_seq.append(line2.rstrip())
-                    count_line += 1
-                    if count_line == stop_line:
-                        break
-                whole_seq = "".join(whole_seq)
-                ## create list of starting positions for individual parts of a seq with a step given by a window and overlap
-                windows_starts = list(range(0, lens_above_win[
-                    count_fasta_divided], step))
-                ## create list of ending positions (starting pos + window), the last element is the whole seq length
-                windows_ends = [
-                    x + WIN_DOM
-                    if x + WIN_DOM < lens_above_win[count_fasta_divided] else
-                    lens_above_win[count_fasta_divided] for x in windows_starts
-                ]
-                count_part = 1
-                for start_part, end_part in zip(windows_starts, windows_ends):
-                    seq_part = whole_seq[start_part:end_part]
-                    if count_part == len(windows_starts):
-                        ntf.write("{}_DANTE_PART{}_LAST:{}-{}\n{}\n".format(
-                            line.split(" ")[0], count_part, start_part + 1,
-                            end_part, "\n".join([seq_part[i:i + row_length]
-                                                 for i in range(0, len(
-                                                     seq_part), row_length)
-                                                 ])).encode("utf-8"))
-                    else:
-                        ntf.write("{}_DANTE_PART{}:{}-{}\n{}\n".format(
-                            line.split(" ")[0], count_part, start_part + 1,
-                            end_part, "\n".join([seq_part[i:i + row_length]
-                                                 for i in range(0, len(
-                                                     seq_part), row_length)
-                                                 ])).encode("utf-8"))
-                    count_part += 1
-                count_fasta_divided += 1
-            elif line.startswith(">") and line not in divided:
-                length_seq = seq_ends[below_win[
-                    count_fasta_not_divided]] - seq_starts[below_win[
-                        count_fasta_not_divided]] + 1
-                ntf.write("{}\n{}".format(line, "".join([query.readline(
-                ) for x in range(length_seq)])).encode("utf-8"))
-                count_fasta_not_divided += 1
-        query_temp = ntf.name
-        ntf.close()
-    return query_temp
 
+class ClassificationIndex(dict):
+    ''' DB sequence names mapped to annotation strings (domain type followed
+	by the classification of the element), the entries are built from the
+	classification table on the first access of a DB sequence name '''
 
-def domain_annotation(elements, CLASSIFICATION):
-    ''' Assign protein domain to each hit from protein database  '''
-    domains = []
-    annotations = []
+    def __init__(self, classes):
+        super().__init__()
+        self.classes = classes
+
+    def __missing__(self, db_name):
+        element = db_name.split("__")
+        element_name = "__".join(element[1:])
+        if element_name in self.classes:
+            annotation = "|".join([element[0].split("-")[1],
+                                   self.classes[element_name]])
+        else:
+            annotation = "unknown|unknown"
+        self[db_name] = annotation
+        return annotation
+
+
+@functools.lru_cache(maxsize=None)
+def load_classification(CLASSIFICATION):
+    ''' Load the classification table only once per run. The parsed table is
+	cached on disk next to the table file (JSON readable by all users) and
+	reused if it is up to date '''
+    index_file = "{}{}".format(CLASSIFICATION, configuration.CLASS_INDEX_SUFFIX)
+    if (os.path.exists(index_file) and
+            os.path.getmtime(index_file) >= os.path.getmtime(CLASSIFICATION)):
+        try:
+            with open(index_file, "r") as index:
+                return ClassificationIndex(json.load(index))
+        except (OSError, ValueError):
+            pass
+    classes = {}
     with open(CLASSIFICATION, "r") as cl_tbl:
-        annotation = {}
         for line in cl_tbl:
             record = line.rstrip().split("\t")
-            annotation[record[0]] = record[1:]
-    for i in range(len(elements)):
-        domains.append(elements[i].split("__")[0].split("-")[1])
-        element_name = "__".join(elements[i].split("__")[1:])
-        if element_name in annotation.keys():
-            annotations.append("|".join([elements[i].split("__")[0].split("-")[
-                1], ("|".join(annotation[element_name]))]))
-        else:
-            annotations.append("unknown|unknown")
-    return annotations
+            classes[record[0]] = "|".join(record[1:])
+    ## database directory does not have to be writable
+    index = None
+    try:
+        index = NamedTemporaryFile(
+            "w", dir=os.path.dirname(os.path.abspath(index_file)), delete=False)
+        with index:
+            json.dump(classes, index)
+        os.chmod(index.name, 0o644)
+        os.replace(index.name, index_file)
+    except OSError:
+        if index is not None and os.path.exists(index.name):
+            os.remove(index.name)
+    return ClassificationIndex(classes)
+
+
+def domain_annotation(elements, CLASSIFICATION):
+    ''' Assign protein domain to each hit from protein database  '''
+    annotation = load_classification(CLASSIFICATION)
+    return [annotation[element] for element in elements]
 
 
 def hits_processing(seq_len, start, end, strand):
     ''' Gain hits intervals separately for forward and reverse strand '''
     reverse_strand_idx = np.where(strand == "-")[0]
-    if not reverse_strand_idx.any():
+    if reverse_strand_idx.size == 0:
         start_pos_plus = start + 1
         end_pos_plus = end
         regions_plus = list(zip(start_pos_plus, end_pos_plus))
@@ -227,7 +302,7 @@ def annotations_dict(annotations):
     ''' Hash table where annotations of the hits within a clusters are the keys. 
 	Each annotation has serial number assigned which indexes the row in the score_table '''
     classes_dict = {classes: idx
-                    for idx, classes in enumerate(set(annotations))}
+                    for idx, classes in enumerate(sorted(set(annotations)))}
     return classes_dict
 
 
@@ -235,53 +310,51 @@ def score_table(mins, maxs, data, annotations, scores, CLASSIFICATION):
     ''' Score table is created based on the annotations occurance in the cluster.
 	Matrix axis y corresponds to individual annotations (indexed according to classes_dict),
     axis x represents positions of analyzed seq in a given cluster.
-    For every hit within cluster, array of scores on the corresponding position
-    is recorded to the table in case if the score on certain position is so far the highest
-	for the certain position and certain annotation '''
+    For every position and annotation the highest score of the hits covering
+    the position is recorded - all hits of the cluster are reduced at once '''
     classes_dict = annotations_dict(annotations)
     score_matrix = np.zeros((len(classes_dict), maxs - mins + 1), dtype=int)
-    count = 0
-    for item in annotations:
-        saved_scores = score_matrix[classes_dict[item], data[count][0] - mins:
-                                    data[count][1] - mins + 1]
-        new_scores = [scores[count]] * len(saved_scores)
-        score_matrix[classes_dict[item], data[count][0] - mins:data[count][
-            1] - mins + 1] = [max(*pos_score)
-                              for pos_score in zip(saved_scores, new_scores)]
-        count += 1
+    rows = np.array([classes_dict[item] for item in annotations])
+    starts = np.array([hit[0] for hit in data]) - mins
+    lengths = np.array([hit[1] for hit in data]) - mins + 1 - starts
+    ## positions covered by individual hits flattened to one array
+    hit_idx = np.repeat(np.arange(len(data)), lengths)
+    hit_offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths)
+    np.maximum.at(score_matrix, (rows[hit_idx], starts[hit_idx] + hit_offsets),
+                  np.asarray(scores)[hit_idx])
     return score_matrix, classes_dict
 
 
 def score_matrix_evaluation(score_matrix, classes_dict, THRESHOLD_SCORE):
     ''' Score matrix is evaluated based on each position.
-	For every position the list of annotations with a score which reaches 
-	certain percentage of the overal best score of the cluster are stored '''
-    ann_per_reg = []
-    overal_best_score_reg = max((score_matrix.max(axis=1)))
-    for position in score_matrix.T:
-        ## score threshold calculated as a percentage of the OVERALL best score in the cluster
-        threshold = overal_best_score_reg * THRESHOLD_SCORE / 100
-        above_th = [idx
-                    for idx, score in enumerate(position)
-                    if position[idx] >= threshold]
-        ## select unique annotations in one position that are above threshold
-        ann_per_pos = list(set(
-            [key for key, value in classes_dict.items() if value in above_th]))
-        ann_per_reg.append(ann_per_pos)
-    return ann_per_reg
-
-
-def group_annot_regs(ann_per_reg):
+	For every position the annotations with a score which reaches certain
+	percentage of the overal best score of the cluster are marked in the
+	returned boolean matrix (same shape as score matrix) '''
+    overal_best_score_reg = score_matrix.max()
+    ## score threshold calculated as a percentage of the OVERALL best score in the cluster
+    threshold = overal_best_score_reg * THRESHOLD_SCORE / 100
+    return score_matrix >= threshold
+
+
+def group_annot_regs(ann_per_reg, classes_dict):
     ''' Get list of domains, annotations, longest common annotations and 
 	counts of positions with certain annotation per regions '''
-    ## tranform list of lists (potential multiple annotations for every position ) to flat list of all annotations
-    all_annotations = [item for sublist in ann_per_reg for item in sublist]
-    unique_annotations = list(set(all_annotations))
-    ann_pos_counts = [all_annotations.count(x) for x in unique_annotations]
-    unique_annotations = list(set(
-        [item for sublist in ann_per_reg for item in sublist]))
-    domain_type = list(set([annotation.split("|")[0]
-                            for annotation in unique_annotations]))
+    ## count positions of every annotation above the threshold
+    counts = ann_per_reg.sum(axis=1)
+    ## rows of score matrix are indexed by sorted annotations
+    classes = sorted(classes_dict, key=classes_dict.get)
+    unique_annotations = [annotation
+                          for annotation, count in zip(classes, counts)
+                          if count]
+    ann_pos_counts = [int(count) for count in counts if count]
+    return annotation_summary(unique_annotations, ann_pos_counts)
+
+
+def annotation_summary(unique_annotations, ann_pos_counts):
+    ''' Domain type and the common classification of the annotations '''
+    domain_type = sorted(set([annotation.split("|")[0]
+                              for annotation in unique_annotations]))
     classification_list = [annotation.split("|")
                            for annotation in unique_annotations]
     ann_substring = "|".join(os.path.commonprefix(classification_list))
@@ -289,6 +362,59 @@ def group_annot_regs(ann_per_reg):
     return domain_type, ann_substring, unique_annotations, ann_pos_counts
 
 
+def sweep_annotation(mins, maxs, data, annotations, scores, THRESHOLD_SCORE):
+    ''' Annotate the region without the dense score matrix - the same result
+	as group_annot_regs(score_matrix_evaluation(score_table(...))) is
+	obtained from sorted boundaries of the hits. A position is annotated by
+	the class if it is covered by a hit of the class reaching the threshold,
+	so the counts of positions are lengths of union of such hits per class '''
+    classes_dict = annotations_dict(annotations)
+    scores = np.asarray(scores)
+    threshold = scores.max() * THRESHOLD_SCORE / 100
+    if threshold <= 0:
+        ## even positions not covered by a class reach the threshold
+        counts = np.full(len(classes_dict), maxs - mins + 1)
+    else:
+        above = np.where(scores >= threshold)[0]
+        rows = np.array([classes_dict[annotations[idx]] for idx in above])
+        starts = np.array([data[idx][0] for idx in above])
+        ends = np.array([data[idx][1] + 1 for idx in above])
+        ## +1 for start of the hit, -1 after its end, sorted per class
+        event_rows = np.concatenate((rows, rows))
+        event_pos = np.concatenate((starts, ends))
+        event_delta = np.concatenate((np.ones(len(above), dtype=int),
+                                      -np.ones(len(above), dtype=int)))
+        order = np.lexsort((event_pos, event_rows))
+        event_rows = event_rows[order]
+        event_pos = event_pos[order]
+        ## coverage after each event, all events of a class sum to zero
+        coverage = np.cumsum(event_delta[order])
+        segments = np.diff(event_pos, append=event_pos[-1])
+        counts = np.bincount(event_rows,
+                             weights=segments * (coverage > 0),
+                             minlength=len(classes_dict))
+    classes = sorted(classes_dict, key=classes_dict.get)
+    unique_annotations = [annotation
+                          for annotation, count in zip(classes, counts)
+                          if count]
+    ann_pos_counts = [int(count) for count in counts if count]
+    return annotation_summary(unique_annotations, ann_pos_counts)
+
+
+def region_annotation(mins, maxs, data, annotations, scores, THRESHOLD_SCORE):
+    ''' Annotate the region using the score matrix, large regions (with many
+	annotations) are annotated by the sweep over hits boundaries instead '''
+    if ((maxs - mins + 1) * len(set(annotations)) >
+            configuration.MAX_SCORE_MATRIX_SIZE):
+        return sweep_annotation(mins, maxs, data, annotations, scores,
+                                THRESHOLD_SCORE)
+    [score_matrix, classes_dict] = score_table(mins, maxs, data, annotations,
+                                               scores, None)
+    ann_per_reg = score_matrix_evaluation(score_matrix, classes_dict,
+                                          THRESHOLD_SCORE)
+    return group_annot_regs(ann_per_reg, classes_dict)
+
+
 def best_score(scores, region):
     ''' From overlapping intervals take the one with the highest score '''
     ## if more hits have the same best score take only the first one
@@ -297,11 +423,13 @@ def best_score(scores, region):
     return best_idx, best_idx_reg
 
 
-def create_gff3(domain_type, ann_substring, unique_annotations, ann_pos_counts,
-                dom_start, dom_end, step, best_idx, annotation_best,
-                db_name_best, db_starts_best, db_ends_best, strand, score,
-                seq_id, db_seq, query_seq, domain_size, positions, gff, consensus):
-    ''' Record obtained information about domain corresponding to individual cluster to common gff file '''
+def domain_record(domain_type, ann_substring, unique_annotations,
+                  ann_pos_counts, dom_start, dom_end, best_idx, annotation_best,
+                  db_name_best, db_starts_best, db_ends_best, strand, score,
+                  db_seq, query_seq, domain_size, positions, consensus,
+                  quality=None):
+    ''' Record obtained information about domain corresponding to individual cluster.
+	Quality statistics of the best hit alignment can be precomputed for more domains at once '''
     best_start = positions[best_idx][0]
     best_end = positions[best_idx][1]
     best_score = score[best_idx]
@@ -311,109 +439,428 @@ def create_gff3(domain_type, ann_substring, unique_annotations, ann_pos_counts,
     db_seq_best = db_seq[best_idx]
     query_seq_best = query_seq[best_idx]
     domain_size_best = domain_size[best_idx]
+    if quality is None:
+        quality = filter_params(db_seq_best, query_seq_best, domain_size_best)
     [percent_ident, align_similarity, relat_align_len, relat_interrupt,
-     db_len_proportion
-     ] = filter_params(db_seq_best, query_seq_best, domain_size_best)
+     db_len_proportion] = quality
     ann_substring = "|".join(ann_substring.split("|")[1:])
     annotation_best = "|".join([db_name_best] + annotation_best.split("|")[1:])
-    if "DANTE_PART" in seq_id:
-        part = int(seq_id.split("DANTE_PART")[1].split(":")[0].split("_")[0])
-        dom_start = dom_start + (part - 1) * step
-        dom_end = dom_end + (part - 1) * step
-        best_start = best_start + (part - 1) * step
-        best_end = best_end + (part - 1) * step
-    if ann_substring is '':
+    if ann_substring == '':
         ann_substring = "NONE(Annotations from different classes)"
     if len(unique_annotations) > 1:
         unique_annotations = ",".join(["{}[{}bp]".format(
             ann, pos) for ann, pos in zip(unique_annotations, ann_pos_counts)])
     else:
         unique_annotations = unique_annotations[0]
-    if __name__ == '__main__':
-        SOURCE = configuration.SOURCE_DANTE
-    else:
-        SOURCE = configuration.SOURCE_PROFREP
-    if "/" in domain_type:
-        gff.write(
-            "{}\t{}\t{}\t{}\t{}\t.\t{}\t{}\tName={};Final_Classification=Ambiguous_domain;Region_Hits_Classifications_={}\n".format(
-                seq_id, SOURCE, configuration.DOMAINS_FEATURE, dom_start,
-                dom_end, strand, configuration.PHASE, domain_type,
-                unique_annotations))
-    else:
-        gff.write(
-            "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\tName={};Final_Classification={};Region_Hits_Classifications={};Best_Hit={}:{}-{}[{}percent];Best_Hit_DB_Pos={}:{}of{};DB_Seq={};Region_Seq={};Query_Seq={};Identity={};Similarity={};Relat_Length={};Relat_Interruptions={};Hit_to_DB_Length={}\n".format(
-                seq_id, SOURCE, configuration.DOMAINS_FEATURE, dom_start,
-                dom_end, best_score, strand, configuration.PHASE, domain_type,
-                ann_substring, unique_annotations, annotation_best, best_start,
-                best_end, length_proportion, db_starts_best, db_ends_best,
-                domain_size_best, db_seq_best, consensus, query_seq_best, percent_ident,
-                align_similarity, relat_align_len, relat_interrupt,
-                db_len_proportion))
+    return Domain(dom_start, dom_end, best_score, strand, domain_type,
+                  ann_substring, unique_annotations, annotation_best,
+                  best_start, best_end, length_proportion, db_starts_best,
+                  db_ends_best, domain_size_best, db_seq_best, consensus,
+                  query_seq_best, percent_ident, align_similarity,
+                  relat_align_len, relat_interrupt, db_len_proportion)
+
+
+def gff3_line(domain, seq_id, offset=0, SOURCE=None):
+    ''' Format the domain to a line of gff file, positions in a window
+	are shifted by the window offset. SOURCE is derived from the calling
+	program if not given '''
+    if SOURCE is None:
+        ## worker processes of parallel search run the main script as __mp_main__
+        if __name__ in ('__main__', '__mp_main__'):
+            SOURCE = configuration.SOURCE_DANTE
+        else:
+            SOURCE = configuration.SOURCE_PROFREP
+    if "/" in domain.name:
+        return "{}\t{}\t{}\t{}\t{}\t.\t{}\t{}\tName={};Final_Classification=Ambiguous_domain;Region_Hits_Classifications_={}\n".format(
+            seq_id, SOURCE, configuration.DOMAINS_FEATURE,
+            domain.start + offset, domain.end + offset, domain.strand,
+            configuration.PHASE, domain.name, domain.region_classifications)
+    return "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\tName={};Final_Classification={};Region_Hits_Classifications={};Best_Hit={}:{}-{}[{}percent];Best_Hit_DB_Pos={}:{}of{};DB_Seq={};Region_Seq={};Query_Seq={};Identity={};Similarity={};Relat_Length={};Relat_Interruptions={};Hit_to_DB_Length={}\n".format(
+        seq_id, SOURCE, configuration.DOMAINS_FEATURE, domain.start + offset,
+        domain.end + offset, domain.score, domain.strand, configuration.PHASE,
+        domain.name, domain.classification, domain.region_classifications,
+        domain.best_hit, domain.best_start + offset, domain.best_end + offset,
+        domain.best_hit_percent, domain.db_start, domain.db_end,
+        domain.db_len, domain.db_seq, domain.region_seq, domain.query_seq,
+        domain.identity, domain.similarity, domain.relat_length,
+        domain.relat_interruptions, domain.hit_to_db_length)
+
+
+def sequence_domain(domain, seq_id, offset):
+    ''' Shift the Domain found in a window starting at the offset to
+	SequenceDomain of the whole sequence '''
+    return SequenceDomain(seq_id, *domain)._replace(
+        start=domain.start + offset,
+        end=domain.end + offset,
+        best_start=domain.best_start + offset,
+        best_end=domain.best_end + offset)
+
+
+@functools.lru_cache(maxsize=None)
+def alignment_scoring(sc_matrix):
+    ''' Create lookup table for alignment similarity counting: for every 
+	combination of aminoacids in alignment assign score from protein 
+	scoring matrix. The table is indexed by ASCII codes of both aminoacids
+	(lower case letters included) and it is loaded only once per matrix '''
+    score_table = np.zeros((256, 256), dtype=np.int8)
+    with open(sc_matrix) as smatrix:
+        count = 1
+        for line in smatrix:
+            if not line.startswith("#"):
+                if count == 1:
+                    aa_all = line.rstrip().replace(" ", "")
+                else:
+                    line = line.split()
+                    for aa, score in zip(aa_all, line[1:]):
+                        for i in {line[0].upper(), line[0].lower()}:
+                            for j in {aa.upper(), aa.lower()}:
+                                score_table[ord(i), ord(j)] = int(score)
+                count += 1
+    return score_table
+
+
+## ASCII codes converted to upper case and characters classes for the
+## alignment statistics
+UPPER_CODES = np.arange(256, dtype=np.uint8)
+UPPER_CODES[ord("a"):ord("z") + 1] -= ord("a") - ord("A")
+AA_CODES = np.zeros(256, dtype=bool)
+AA_CODES[[ord(c) for c in string.ascii_letters + "*"]] = True
+INTERRUPT_CODES = np.zeros(256, dtype=bool)
+INTERRUPT_CODES[[ord(c) for c in "/\\*"]] = True
+
+
+def alignment_columns(db, query):
+    ''' Column-wise statistics of alignment(s) given as byte arrays:
+	identity, interruption and positive score (similarity) of every column '''
+    score_table = alignment_scoring(configuration.SC_MATRIX)
+    db = UPPER_CODES[db]
+    query = UPPER_CODES[query]
+    identical = (db == query) & (db != ord("X"))
+    interrupt = INTERRUPT_CODES[query]
+    similar = AA_CODES[db] & AA_CODES[query] & (score_table[db, query] > 0)
+    return identical, interrupt, similar
 
 
 def filter_params(db, query, protein_len):
     ''' Calculate basic statistics of the quality of the alignment '''
-    score_dict = alignment_scoring()
-    num_ident = 0
-    count_interrupt = 0
-    count_similarity = 0
-    alignment_len = 0
-    for i, j in zip(db.upper(), query.upper()):
-        if i == j and i != "X":
-            num_ident += 1
-        if j == "/" or j == "\\" or j == "*":
-            count_interrupt += 1
-        if (i.isalpha() or i == "*") and (j.isalpha() or j == "*"):
-            if int(score_dict["{}{}".format(i, j)]) > 0:
-                count_similarity += 1
+    length = min(len(db), len(query))
+    db_codes = np.frombuffer(db.encode("ascii"), dtype=np.uint8)[:length]
+    query_codes = np.frombuffer(query.encode("ascii"),
+                                dtype=np.uint8)[:length]
+    identical, interrupt, similar = alignment_columns(db_codes, query_codes)
+    return quality_params(len(db), db.count("-"), len(query),
+                          int(identical.sum()), int(interrupt.sum()),
+                          int(similar.sum()), protein_len)
+
+
+def filter_params_batch(db_seqs, query_seqs, protein_lens):
+    ''' Calculate basic statistics of the quality of multiple alignments at
+	once, return list of the statistics in the same order '''
+    if not len(db_seqs):
+        return []
+    db_lens = np.array([len(db) for db in db_seqs])
+    query_lens = np.array([len(query) for query in query_seqs])
+    lengths = np.minimum(db_lens, query_lens)
+    db_codes = np.frombuffer("".join(
+        [db[:length] for db, length in zip(db_seqs, lengths)]).encode("ascii"),
+                             dtype=np.uint8)
+    query_codes = np.frombuffer("".join(
+        [query[:length] for query, length in zip(query_seqs, lengths)
+         ]).encode("ascii"),
+                                dtype=np.uint8)
+    identical, interrupt, similar = alignment_columns(db_codes, query_codes)
+    ## sums of individual alignments; cumulative sums allow empty alignments
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    num_ident, count_interrupt, count_similarity = [
+        np.diff(np.concatenate(([0], np.cumsum(column)))[bounds])
+        for column in (identical, interrupt, similar)]
+    db_gaps = [db.count("-") for db in db_seqs]
+    return [quality_params(*[int(value) for value in params]) for params in zip(
+        db_lens, db_gaps, query_lens, num_ident, count_interrupt,
+        count_similarity, protein_lens)]
+
+
+def quality_params(db_len, db_gaps, query_len, num_ident, count_interrupt,
+                   count_similarity, protein_len):
+    ''' Relative quality statistics from the counts of alignment columns,
+	proportions to the protein length are rounded by numpy as the length
+	comes from the LASTAL output columns '''
+    protein_len = np.int64(protein_len)
     ## gapless alignment length proportional to the domain protein length
-    relat_align_len = round((len(db) - db.count("-")) / protein_len, 3)
+    relat_align_len = round((db_len - db_gaps) / protein_len, 3)
     ## proportional identical bases (except of X) to al.length
-    align_identity = round(num_ident / len(db), 2)
+    align_identity = round(num_ident / db_len, 2)
     ## proportional count of positive scores from scoring matrix to al. length
-    align_similarity = round(count_similarity / len(db), 2)
+    align_similarity = round(count_similarity / db_len, 2)
     ## number of interruptions per 100 bp
-    relat_interrupt = round(count_interrupt / math.ceil((len(query) / 100)), 2)
+    relat_interrupt = round(count_interrupt / math.ceil((query_len / 100)), 2)
     ## Proportion of alignment to the original length of protein domain from database (indels included)
-    db_len_proportion = round(len(db) / protein_len, 2)
+    db_len_proportion = round(db_len / protein_len, 2)
     return align_identity, align_similarity, relat_align_len, relat_interrupt, db_len_proportion
 
 
-def line_generator(tab_pipe, maf_pipe, start):
-    ''' Yield individual lines of LASTAL stdout for single sequence '''
-    if hasattr(line_generator, "dom"):
-        seq_id = line_generator.dom.split("\t")[6]
-        yield line_generator.dom.encode("utf-8")
-        del line_generator.dom
-    line_tab = ""
-    for line_tab in tab_pipe:
-        line_tab = line_tab.decode("utf-8")
-        if not line_tab.startswith('#'):
-            if start:
-                if not ('seq_id' in locals() and
-                        seq_id != line_tab.split("\t")[6]):
-                    seq_id = line_tab.split("\t")[6]
-                    start = False
-            line_maf = [maf_pipe.readline() for line_count in range(4)]
-            db_seq = line_maf[1].decode("utf-8").rstrip().split(" ")[-1]
-            alignment_seq = line_maf[2].decode("utf-8").rstrip().split(" ")[-1]
-            line = "{}\t{}\t{}".format(line_tab, db_seq, alignment_seq)
-            line_id = line.split("\t")[6]
-            if seq_id != line_id:
-                line_generator.dom = line
-                return
-            else:
-                yield line.encode("utf-8")
-        else:
-            maf_pipe.readline()
-    if line_tab == "":
-        raise RuntimeError
-    else:
+class StringColumn():
+    '''
+    Strings of one column stored in a single byte buffer with their offsets.
+    Integer index returns a string, list or array of indices a list of strings
+    '''
+    __slots__ = ("buffer", "offsets")
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self.buffer[self.offsets[idx]:self.offsets[idx + 1]].decode(
+                "ascii")
+        return [self[i] for i in idx]
+
+
+class StringBuffer():
+    ''' Growing byte buffer of strings with the offsets of their ends '''
+    __slots__ = ("buffer", "offsets")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = array("q", [0])
+
+    def append(self, item):
+        self.buffer += item
+        self.offsets.append(len(self.buffer))
+
+    def column(self, keep=None):
+        ''' Column of the strings, only the kept ones if the indices are given '''
+        if keep is None:
+            return StringColumn(bytes(self.buffer),
+                                np.frombuffer(self.offsets, dtype=np.int64))
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        lengths = offsets[keep + 1] - offsets[keep]
+        ## runs of consecutive kept strings are copied at once
+        breaks = np.where(np.diff(keep) != 1)[0] + 1
+        run_starts = offsets[keep[np.concatenate(([0], breaks))]].tolist()
+        run_ends = offsets[keep[np.concatenate((breaks - 1, [-1]))] +
+                           1].tolist()
+        buffer = memoryview(self.buffer)
+        return StringColumn(
+            b"".join([buffer[run_start:run_end] for run_start, run_end
+                      in zip(run_starts, run_ends)]),
+            np.concatenate(([0], np.cumsum(lengths))))
+
+
+class SpilledColumn():
+    '''
+    Strings of one column spilled to a file, only their offsets are kept in
+    memory and the strings are read back when indexed (as StringColumn)
+    '''
+    __slots__ = ("path", "starts", "ends", "fd")
+
+    def __init__(self, path, starts, ends):
+        self.path = path
+        self.starts = starts
+        self.ends = ends
+        self.fd = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_RDONLY)
+            return os.pread(self.fd, int(self.ends[idx] - self.starts[idx]),
+                            int(self.starts[idx])).decode("ascii")
+        return [self[i] for i in idx]
+
+    def __getstate__(self):
+        return self.path, self.starts, self.ends
+
+    def __setstate__(self, state):
+        self.path, self.starts, self.ends = state
+        self.fd = None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class SpillBuffer():
+    ''' Strings of one column appended to the shared spill file '''
+    __slots__ = ("spill", "starts", "ends")
+
+    def __init__(self, spill):
+        self.spill = spill
+        self.starts = array("q")
+        self.ends = array("q")
+
+    def append(self, item):
+        self.starts.append(self.spill.size)
+        self.spill.write(item)
+        self.spill.size += len(item)
+        self.ends.append(self.spill.size)
+
+    def column(self, keep=None):
+        starts = np.frombuffer(self.starts, dtype=np.int64)
+        ends = np.frombuffer(self.ends, dtype=np.int64)
+        if keep is not None:
+            starts = starts[keep]
+            ends = ends[keep]
+        return SpilledColumn(self.spill.path, starts, ends)
+
+
+class SpillFile():
+    ''' Temporary file of the string columns of a single sequence '''
+
+    def __init__(self):
+        handle, self.path = mkstemp(prefix=configuration.SPILL_PREFIX)
+        self.spill = os.fdopen(handle, "wb")
+        self.size = 0
+
+    def write(self, data):
+        self.spill.write(data)
+
+    def close(self):
+        self.spill.close()
+
+
+def release_hits(sequence_hits, remove=True):
+    ''' Close the spilled string columns of the hits and remove their file '''
+    if sequence_hits.get('spill') is None:
         return
-
-
+    for column in LASTAL_STR_COLUMNS:
+        sequence_hits[column].close()
+    if remove:
+        os.remove(sequence_hits['spill'])
+
+
+## integer and string columns collected for every lastal hit
+LASTAL_INT_COLUMNS = ("score", "start_db", "al_size_db", "seq_size_db",
+                      "start_q", "al_size_q", "seq_size_q")
+LASTAL_STR_COLUMNS = ("name_db", "db_seq", "q_seq")
+
+
+def dominated_hits(score, start, size, strand, THRESHOLD_SCORE):
+    ''' Boolean mask of the hits which cannot change any domain: hit h contained
+	in hit g of the same strand with h.score * 100 < g.score * THRESHOLD_SCORE
+	is below the threshold of every position and region it belongs to, it does
+	not change the regions (clusters) and cannot be the best hit. Hits of
+	a strand are sorted by their start, every hit is compared with the hit
+	reaching furthest so far and with the best scoring hit of the current
+	locus (overlapping hits). Integers are compared to avoid rounding '''
+    dominated = np.zeros(len(score), dtype=bool)
+    if THRESHOLD_SCORE > 100:
+        return dominated
+    end = start + size
+    for strand_idx in (np.where(strand == b"+")[0],
+                       np.where(strand != b"+")[0]):
+        if len(strand_idx) < 2:
+            continue
+        order = strand_idx[np.lexsort((-score[strand_idx], -end[strand_idx],
+                                       start[strand_idx]))]
+        order_start = start[order]
+        order_end = end[order]
+        order_score = score[order]
+        idx = np.arange(len(order))
+        max_end = np.maximum.accumulate(order_end)
+        end_holder = np.maximum.accumulate(np.where(order_end == max_end, idx,
+                                                    0))
+        locus = np.cumsum(np.concatenate(([0], order_start[1:] >= max_end[:-1])))
+        locus_score = (locus << 32) | order_score
+        max_locus_score = np.maximum.accumulate(locus_score)
+        score_holder = np.maximum.accumulate(np.where(
+            locus_score == max_locus_score, idx, 0))
+        for holder in (end_holder, score_holder):
+            dominated[order] |= ((order_end[holder] >= order_end) &
+                                 (order_score[holder] * THRESHOLD_SCORE >
+                                  order_score * 100) & (size[order] > 1))
+    return dominated
+
+
+def hits_columns(seq_id, int_buffers, str_buffers, strand_buffer,
+                 spill=None, THRESHOLD_SCORE=None):
+    ''' Hand over the buffered hits of a sequence as dictionary of columns,
+	hits dominated by other hits are dropped if the THRESHOLD_SCORE is given '''
+    if spill is not None:
+        spill.close()
+    hits = {column: np.frombuffer(int_buffers[column], dtype=np.int64)
+            for column in LASTAL_INT_COLUMNS}
+    strand = np.frombuffer(bytes(strand_buffer), dtype="S1")
+    keep = None
+    if THRESHOLD_SCORE is not None:
+        dominated = dominated_hits(hits['score'], hits['start_q'],
+                                   hits['al_size_q'], strand, THRESHOLD_SCORE)
+        if dominated.any():
+            keep = np.where(~dominated)[0]
+            hits = {column: values[keep] for column, values in hits.items()}
+            strand = strand[keep]
+    hits.update({column: str_buffers[column].column(keep)
+                 for column in LASTAL_STR_COLUMNS})
+    hits['strand_q'] = strand.astype("U1")
+    hits['name_q'] = seq_id.decode("ascii")
+    hits['spill'] = spill.path if spill is not None else None
+    hits['pruned'] = len(strand_buffer) - len(strand)
+    return hits
+
+
+def read_lastal_hits(maf_pipe, SPILL=False, THRESHOLD_SCORE=None):
+    ''' Parse LASTAL MAF stdout in real time, hits are appended directly to
+	typed column buffers (integers for scores and coordinates, one byte
+	buffer with offsets for each string column). Hits of every query sequence
+	are yielded at once as a dictionary of columns. With SPILL the strings
+	(alignments) are written to a temporary file of the sequence to keep
+	only the coordinates in memory, the file is removed by release_hits.
+	With THRESHOLD_SCORE the hits which cannot affect the domains
+	are dropped (see dominated_hits) '''
+    seq_id = None
+    score = None
+    spill = None
+    s_lines = []
+    for line in maf_pipe:
+        if line.startswith(b"a"):
+            score = int(line.split(b"score=")[1].split()[0])
+            s_lines = []
+        elif line.startswith(b"s"):
+            s_lines.append(line.split())
+            if len(s_lines) < 2:
+                continue
+            ## fields of sequence line: s name start alnSize strand seqSize alignment
+            db_line, q_line = s_lines
+            if q_line[1] != seq_id:
+                if seq_id is not None:
+                    yield hits_columns(seq_id, int_buffers, str_buffers,
+                                       strand_buffer, spill, THRESHOLD_SCORE)
+                seq_id = q_line[1]
+                int_buffers = {column: array("q")
+                               for column in LASTAL_INT_COLUMNS}
+                spill = SpillFile() if SPILL else None
+                str_buffers = {column: SpillBuffer(spill) if SPILL else
+                               StringBuffer()
+                               for column in LASTAL_STR_COLUMNS}
+                strand_buffer = bytearray()
+            int_buffers["score"].append(score)
+            int_buffers["start_db"].append(int(db_line[2]))
+            int_buffers["al_size_db"].append(int(db_line[3]))
+            int_buffers["seq_size_db"].append(int(db_line[5]))
+            int_buffers["start_q"].append(int(q_line[2]))
+            int_buffers["al_size_q"].append(int(q_line[3]))
+            int_buffers["seq_size_q"].append(int(q_line[5]))
+            str_buffers["name_db"].append(db_line[1])
+            str_buffers["db_seq"].append(db_line[6])
+            str_buffers["q_seq"].append(q_line[6])
+            strand_buffer += q_line[4]
+    if seq_id is not None:
+        yield hits_columns(seq_id, int_buffers, str_buffers, strand_buffer,
+                           spill, THRESHOLD_SCORE)
+
+
+@functools.lru_cache(maxsize=None)
 def get_version(path, LAST_DB):
-    '''Return version is run from git repository '''
+    '''Return version is run from git repository, it is found only once per
+	process '''
     version_string = (
         "##-----------------------------------------------\n"
         "##PROTEIN DATABASE VERSION : {PD}\n"
@@ -452,163 +899,907 @@ def write_info(dom_gff_tmp, version_string):
 
 
 def domain_search(QUERY, LAST_DB, CLASSIFICATION, OUTPUT_DOMAIN,
-                  THRESHOLD_SCORE, WIN_DOM, OVERLAP_DOM, SCORING_MATRIX):
-    ''' Search for protein domains using our protein database and external tool LAST,
-	stdout is parsed in real time and hits for a single sequence undergo further processing
-	- tabular format(TAB) to get info about position, score, orientation
-	- MAF format to gain alignment and original sequence
+                  THRESHOLD_SCORE, WIN_DOM, OVERLAP_DOM, SCORING_MATRIX,
+                  WORKERS=1, CHECKPOINT=None, RESUME=False, CACHE=None,
+                  CACHE_SIZE=configuration.CACHE_SIZE, PROFILE=(),
+                  PROFILER="cprofile", PIPELINE=0, SPILL=False, GAPS=0,
+                  TABLE=False):
+    ''' Search for protein domains using our protein database and external tool LAST
+	(see DomainSearch) and write them to the gff file. GFF with .gz suffix
+	is compressed by bgzip with the domains sorted by their position and
+	indexed by coordinates (see gff_index). With TABLE the domains are also
+	saved to columnar table next to the gff (.table, see domain_table).
+	Metrics of the search are saved next to the gff (.metrics.json), the PROFILE
+	stages are profiled by PROFILER (cprofile or tracemalloc)
 	'''
 
-    step = WIN_DOM - OVERLAP_DOM
-    [headers, above_win, below_win, lens_above_win, seq_starts, seq_ends
-     ] = characterize_fasta(QUERY, WIN_DOM)
-    query_temp = split_fasta(QUERY, WIN_DOM, step, headers, above_win,
-                             below_win, lens_above_win, seq_starts, seq_ends)
-
-    ## TAB output contains all the alignment scores, positions, strands...
-    lastal_columns = {
-        "BL80" : ("score, name_db, start_db, al_size_db, strand_db,"
-                   " seq_size_db, name_q, start_q, al_size_q, strand_q, seq_size_q,"
-                   " block1, block2, block3, db_seq, q_seq"),
-        "BL62" : ("score, name_db, start_db, al_size_db, strand_db,"
-                   " seq_size_db, name_q, start_q, al_size_q, strand_q,"
-                   " seq_size_q, block1, block2, block3, db_seq, q_seq"),
-        "MIQS" : ("score, name_db, start_db, al_size_db, strand_db,"
-                  " seq_size_db, name_q, start_q, al_size_q, strand_q,"
-                  " seq_size_q, block1, db_seq, q_seq"),
+    start_time = time.perf_counter()
+    search = DomainSearch(QUERY, LAST_DB, CLASSIFICATION, THRESHOLD_SCORE,
+                          WIN_DOM, OVERLAP_DOM, SCORING_MATRIX, WORKERS,
+                          CHECKPOINT, RESUME, CACHE, CACHE_SIZE,
+                          SearchMetrics(PROFILE, PROFILER, OUTPUT_DOMAIN),
+                          PIPELINE, SPILL, GAPS)
+    metrics = search.metrics
+    table = domain_table.DomainTableWriter(
+        domain_table.table_path(OUTPUT_DOMAIN)) if TABLE else None
+    with gff_index.open_gff(OUTPUT_DOMAIN, "w") as gff:
+        write_info(gff, search.version_string)
+        for domain in search:
+            metrics.start("gff")
+            gff.write(gff3_line(domain, domain.seq_id))
+            if table:
+                table.append(domain)
+            metrics.stop("gff")
+        ## if there are no domains found
+        if not search.merger.windows:
+            gff.write("##NO DOMAINS\n")
+    if table:
+        table.close()
+    metrics.write_profiles()
+    write_metrics("{}{}".format(OUTPUT_DOMAIN, configuration.METRICS_SUFFIX),
+                  metrics, search.records, search.windows,
+                  search.merger.domains, WORKERS,
+                  time.perf_counter() - start_time)
+    if not search.merger.windows:
+        return [], [], [], []
+
+
+class DomainSearch():
+    '''
+    Search for protein domains of the QUERY sequences by LASTAL, iterating
+	the search yields SequenceDomains in the order of the input sequences.
+	The search options are described in the README (library usage)
+    '''
+
+    def __init__(self, QUERY, LAST_DB, CLASSIFICATION, THRESHOLD_SCORE=80,
+                 WIN_DOM=10000000, OVERLAP_DOM=10000, SCORING_MATRIX="BL80",
+                 WORKERS=1, CHECKPOINT=None, RESUME=False, CACHE=None,
+                 CACHE_SIZE=configuration.CACHE_SIZE, metrics=None,
+                 PIPELINE=0, SPILL=False, GAPS=0):
+        self.QUERY = QUERY
+        self.LAST_DB = LAST_DB
+        self.CLASSIFICATION = CLASSIFICATION
+        self.THRESHOLD_SCORE = THRESHOLD_SCORE
+        self.WIN_DOM = WIN_DOM
+        self.OVERLAP_DOM = OVERLAP_DOM
+        self.SCORING_MATRIX = SCORING_MATRIX
+        self.WORKERS = WORKERS
+        self.CHECKPOINT = CHECKPOINT
+        self.RESUME = RESUME
+        self.CACHE = CACHE
+        self.CACHE_SIZE = CACHE_SIZE
+        self.metrics = metrics or SearchMetrics()
+        ## parsing runs in a separate thread while the other stages run
+        if PIPELINE and WORKERS <= 1 and self.metrics.traces_memory():
+            raise ValueError(
+                "Stages of the pipelined search run concurrently, they cannot "
+                "be profiled by tracemalloc")
+        self.PIPELINE = PIPELINE
+        self.SPILL = SPILL
+        self.GAPS = GAPS
+        configuration.SC_MATRIX = configuration.SC_MATRIX_SKELETON.format(
+            SCORING_MATRIX)
+        self.records = characterize_fasta(QUERY)
+        self.windows = query_windows(
+            self.records, WIN_DOM, WIN_DOM - OVERLAP_DOM,
+            query_gaps(QUERY, self.records, GAPS) if GAPS else None)
+        path = os.path.dirname(os.path.realpath(__file__))
+        self.version_string = get_version(path, LAST_DB)
+        self.merger = WindowMerger()
+
+    def __iter__(self):
+        self.merger = WindowMerger()
+        for window, domains in self.window_domains():
+            self.metrics.start("gff")
+            sequence_domains = self.merger.add(
+                window, domains, self.records[window.record].name)
+            self.metrics.stop("gff")
+            for domain in sequence_domains:
+                yield domain
+
+    def window_domains(self):
+        ''' Yield (window, list of its Domains) for the searched windows
+	in the input order '''
+        ## loaded before the search to be shared with the worker processes
+        load_classification(self.CLASSIFICATION)
+        if self.CHECKPOINT or self.CACHE:
+            manifest = search_manifest(self.LAST_DB, self.CLASSIFICATION,
+                                       self.THRESHOLD_SCORE,
+                                       self.SCORING_MATRIX, self.version_string)
+        cache = DomainCache(self.CACHE, manifest,
+                            self.CACHE_SIZE) if self.CACHE else None
+        if self.CHECKPOINT or self.WORKERS > 1:
+            ## windows are searched to fragments read at the end
+            fragments_dir = self.CHECKPOINT or mkdtemp()
+            try:
+                if self.CHECKPOINT:
+                    done = open_checkpoint(
+                        self.CHECKPOINT, checkpoint_manifest(
+                            self.QUERY, self.WIN_DOM, self.OVERLAP_DOM,
+                            manifest, self.GAPS), self.RESUME)
+                else:
+                    done = {}
+                pending = [window for window in self.windows
+                           if window.name not in done]
+                if pending and self.WORKERS > 1:
+                    parallel_search(self.QUERY, self.records, pending,
+                                    self.LAST_DB, self.CLASSIFICATION,
+                                    self.THRESHOLD_SCORE, self.SCORING_MATRIX,
+                                    self.WORKERS, fragments_dir, cache,
+                                    self.metrics, self.SPILL)
+                elif pending:
+                    fragments = FragmentWriter(fragments_dir)
+                    for window, domains in search_sequences(
+                            self.QUERY, self.records, pending, self.LAST_DB,
+                            self.CLASSIFICATION, self.THRESHOLD_SCORE,
+                            self.SCORING_MATRIX, cache, self.metrics,
+                            self.PIPELINE, self.SPILL):
+                        fragments.add(window, domains)
+                    fragments.close()
+                for window_domains in read_fragments(
+                        self.windows, finished_windows(fragments_dir)):
+                    yield window_domains
+            finally:
+                if not self.CHECKPOINT:
+                    shutil.rmtree(fragments_dir)
+        else:
+            for window_domains in search_sequences(
+                    self.QUERY, self.records, self.windows, self.LAST_DB,
+                    self.CLASSIFICATION, self.THRESHOLD_SCORE,
+                    self.SCORING_MATRIX, cache, self.metrics, self.PIPELINE,
+                    self.SPILL):
+                yield window_domains
+        if cache:
+            cache.evict()
+
+
+class WindowMerger():
+    '''
+    Resolve domains of the windows passed in the input order.
+    For consecutive windows of a sequence the overlap is divided to half
+    with the domains of the first half belonging to the first window and the
+    second to the following one. Domains going through the middle of
+    the overlap are reported by both windows and the duplicates are removed,
+    only the domains of the previous window are kept for the comparison
+    '''
+
+    def __init__(self):
+        self.windows = 0
+        self.domains = 0
+        self.record = None
+        self.previous = set()
+        self.current = set()
+
+    def add(self, window, domains, seq_id):
+        ''' Return SequenceDomains of the window kept in the output (positions
+	on the whole sequence). Windows without domains are not counted '''
+        if not domains:
+            return []
+        self.windows += 1
+        domains = [sequence_domain(domain, seq_id, window.start)
+                   for domain in domains]
+        if window.cut_start is None and window.cut_end is None:
+            self.domains += len(domains)
+            return domains
+        if window.record == self.record:
+            self.previous = self.current
+        else:
+            self.previous = set()
+            self.record = window.record
+        self.current = set()
+        kept = []
+        for domain in domains:
+            if (window.cut_start is not None and
+                    domain.start <= window.cut_start <= domain.end) or (
+                        window.cut_end is not None and
+                        domain.start <= window.cut_end <= domain.end):
+                if domain in self.previous or domain in self.current:
+                    continue
+                self.current.add(domain)
+            elif (window.cut_start is not None and
+                  domain.start <= window.cut_start) or (
+                      window.cut_end is not None and
+                      domain.end >= window.cut_end):
+                continue
+            kept.append(domain)
+        self.domains += len(kept)
+        return kept
+
+
+class SearchMetrics():
+    '''
+    Counts and times of the search stages: "lastal_wait" - waiting for
+    LASTAL output, "parsing" - reading of the MAF hits, "regions" - clustering,
+    annotation and quality of the regions, "gff" - merging of the windows,
+    formatting and writing the domains. The PROFILE stages are run under cProfile or tracemalloc (PROFILER),
+    their results are saved to files starting with the prefix.
+    Stages can be timed from more threads, but tracemalloc traces the whole
+    process and it can profile only the stages which do not run concurrently
+    '''
+    STAGES = ["lastal_wait", "parsing", "regions", "gff"]
+    COUNTS = ["windows_searched", "windows_cached", "hits", "hits_pruned",
+              "regions"]
+
+    def __init__(self, PROFILE=(), PROFILER="cprofile", prefix=None):
+        self.times = dict.fromkeys(self.STAGES, 0.0)
+        self.counts = dict.fromkeys(self.COUNTS, 0)
+        self.PROFILE = set(PROFILE)
+        self.PROFILER = PROFILER
+        self.prefix = prefix
+        self.started = {}
+        self.profiles = {}
+        self.peaks = {}
+        self.snapshots = {}
+
+    def start(self, stage):
+        if stage in self.PROFILE:
+            if self.PROFILER == "cprofile":
+                self.profiles.setdefault(stage, cProfile.Profile()).enable()
+            else:
+                tracemalloc.start()
+        self.started[threading.get_ident(), stage] = time.perf_counter()
+
+    def stop(self, stage):
+        self.times[stage] += time.perf_counter() - self.started.pop(
+            (threading.get_ident(), stage))
+        if stage in self.PROFILE:
+            if self.PROFILER == "cprofile":
+                self.profiles[stage].disable()
+            else:
+                ## allocations kept from the call with the highest peak
+                peak = tracemalloc.get_traced_memory()[1]
+                if peak > self.peaks.get(stage, -1):
+                    self.peaks[stage] = peak
+                    self.snapshots[stage] = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+
+    def traces_memory(self):
+        return bool(self.PROFILE) and self.PROFILER == "tracemalloc"
+
+    def timed(self, iterable, stage):
+        ''' Yield items of the iterable, time of getting them counts to the stage '''
+        iterator = iter(iterable)
+        while True:
+            self.start(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stop(stage)
+                return
+            self.stop(stage)
+            yield item
+
+    def update(self, summary):
+        ''' Add times and counts of another (worker's) summary '''
+        for stage, seconds in summary["seconds"].items():
+            self.times[stage] += seconds
+        for name, count in summary["counts"].items():
+            self.counts[name] += count
+        for stage, peak in summary["tracemalloc_peaks"].items():
+            self.peaks[stage] = max(peak, self.peaks.get(stage, 0))
+
+    def summary(self):
+        return {"seconds": dict(self.times),
+                "counts": dict(self.counts),
+                "tracemalloc_peaks": dict(self.peaks)}
+
+    def write_profiles(self):
+        ''' Save cProfile stats (pstats format) and the top allocations
+		traced by tracemalloc of the profiled stages '''
+        for stage, profile in self.profiles.items():
+            profile.dump_stats("{}.{}{}".format(self.prefix, stage,
+                                                configuration.PROFILE_SUFFIX))
+        for stage, snapshot in self.snapshots.items():
+            with open("{}.{}{}".format(self.prefix, stage,
+                                       configuration.TRACEMALLOC_SUFFIX),
+                      "w") as allocations:
+                allocations.write("## peak {} B\n".format(self.peaks[stage]))
+                for statistic in snapshot.statistics("lineno")[:configuration.
+                                                               TRACEMALLOC_TOP]:
+                    allocations.write("{}\n".format(statistic))
+
+
+class TimedReader(io.RawIOBase):
+    '''
+    Raw stream adding time spent waiting for the data to the "lastal_wait"
+    stage of the metrics
+    '''
+
+    def __init__(self, raw, metrics):
+        self.raw = raw
+        self.metrics = metrics
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        size = self.raw.readinto(buffer)
+        self.metrics.times["lastal_wait"] += time.perf_counter() - start
+        return size
+
+
+def write_metrics(OUTPUT_METRICS, metrics, records, windows, domains, WORKERS,
+                  elapsed):
+    ''' Save the search metrics in JSON format. Stage times are summed over
+	all workers, parsing time does not include waiting for LASTAL '''
+    seconds = dict(metrics.times)
+    seconds["parsing"] = max(0.0, seconds["parsing"] - seconds["lastal_wait"])
+    bases = sum(record.length for record in records)
+    hits = metrics.counts["hits"]
+    summary = {
+        "sequences": len(records),
+        "bases": bases,
+        "bases_searched": sum(window.end - window.start for window in windows),
+        "windows": len(windows),
+        "domains": domains,
+        "workers": WORKERS,
+        "elapsed_seconds": elapsed,
+        "stage_seconds": seconds,
+        "python_seconds": sum(seconds.values()) - seconds["lastal_wait"],
+        "hits_per_second": hits / elapsed if elapsed else None,
+        "bases_per_second": bases / elapsed if elapsed else None,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_rss_children_kb":
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
     }
-    tab = subprocess.Popen(
-        "lastal -F15 {} {} -L 10 -m 70 -p {} -e 80 -f TAB".format(LAST_DB,
-                                                                  query_temp,
-                                                                  SCORING_MATRIX),
-        stdout=subprocess.PIPE,
-        shell=True)
-    ## MAF output contains alignment sequences
+    summary.update(metrics.counts)
+    if metrics.peaks:
+        summary["tracemalloc_peak_bytes"] = metrics.peaks
+    with open(OUTPUT_METRICS, "w") as metrics_file:
+        json.dump(summary, metrics_file, indent=2, sort_keys=True)
+        metrics_file.write("\n")
+
+
+def search_sequences(QUERY, records, windows, LAST_DB, CLASSIFICATION,
+                     THRESHOLD_SCORE, SCORING_MATRIX, cache=None,
+                     metrics=None, PIPELINE=0, SPILL=False):
+    ''' Yield (window, list of its Domains) for all windows in the input order.
+	Only windows with sequences not found in the cache are searched by LASTAL,
+	a sequence repeated in the input is searched once '''
+    if metrics is None:
+        metrics = SearchMetrics()
+    if cache is None:
+        for window_domains in lastal_search(QUERY, records, windows, LAST_DB,
+                                            CLASSIFICATION, THRESHOLD_SCORE,
+                                            SCORING_MATRIX, metrics, PIPELINE,
+                                            SPILL):
+            yield window_domains
+        return
+    keys = cache.window_keys(QUERY, records, windows)
+    ## the first window of every sequence missing in the cache is searched
+    search_keys = set()
+    search = set()
+    for window, key in zip(windows, keys):
+        if key not in search_keys and not cache.contains(key):
+            search_keys.add(key)
+            search.add(window.name)
+    searched = lastal_search(QUERY, records,
+                             [window for window in windows
+                              if window.name in search], LAST_DB,
+                             CLASSIFICATION, THRESHOLD_SCORE, SCORING_MATRIX,
+                             metrics, PIPELINE, SPILL)
+    for window, key in zip(windows, keys):
+        if window.name in search:
+            window_domains = next(searched)
+            cache.store(key, window_domains[1])
+        else:
+            domains = cache.load(key)
+            window_domains = (window, domains)
+            ## record removed in the meantime or it could not be stored
+            if domains is None:
+                [window_domains] = lastal_search(
+                    QUERY, records, [window], LAST_DB, CLASSIFICATION,
+                    THRESHOLD_SCORE, SCORING_MATRIX, metrics, 0, SPILL)
+            else:
+                metrics.counts["windows_cached"] += 1
+        yield window_domains
+    ## the search is finished to check the exit status of LASTAL
+    next(searched, None)
+
+
+def lastal_search(QUERY, records, windows, LAST_DB, CLASSIFICATION,
+                  THRESHOLD_SCORE, SCORING_MATRIX, metrics, PIPELINE=0,
+                  SPILL=False):
+    ''' Run LASTAL on the query windows and yield (window, list of its Domains)
+	for all windows in the input order, the list is empty for windows without
+	any hits. If LASTAL fails, RuntimeError is raised after its last output.
+	With PIPELINE workers the output is read by a separate thread and the regions
+	are processed by the pool of worker processes. With SPILL only coordinates
+	of the hits are kept in memory, the alignments are read for one region
+	at a time (see read_lastal_hits).
+	Times of the stages and counts of the hits and regions are added to metrics '''
+    ## pool is started before any other thread of the search
+    pool = multiprocessing.Pool(
+        PIPELINE, initializer=init_pipeline_worker,
+        initargs=(configuration.SC_MATRIX, )) if PIPELINE else None
     maf = subprocess.Popen(
-        "lastal -F15 {} {} -L 10 -m 70 -p {}  -e 80 -f MAF".format(LAST_DB,
-                                                                   query_temp,
-                                                                   SCORING_MATRIX),
+        configuration.LASTAL_COMMAND.format(LAST_DB, SCORING_MATRIX),
+        stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         shell=True)
+    ## sequences are fed by separate thread while the output is processed
+    writer = threading.Thread(target=write_windows,
+                              args=(QUERY, records, windows, maf.stdin))
+    writer.daemon = True
+    writer.start()
+    metrics.counts["windows_searched"] += len(windows)
+    maf_pipe = io.BufferedReader(TimedReader(maf.stdout.raw, metrics))
+    if pool:
+        sequences_domains = pipelined_domains(maf_pipe, CLASSIFICATION,
+                                              THRESHOLD_SCORE, metrics, pool,
+                                              PIPELINE, SPILL)
+    else:
+        sequences_domains = serial_domains(maf_pipe, CLASSIFICATION,
+                                           THRESHOLD_SCORE, metrics, SPILL)
+
+    windows_idx = {window.name: idx for idx, window in enumerate(windows)}
+    next_idx = 0
+    try:
+        for name_q, hits, pruned, domains in sequences_domains:
+            window_idx = windows_idx[name_q]
+            ## LASTAL reports the windows in the input order
+            for window_no_hits in windows[next_idx:window_idx]:
+                yield window_no_hits, []
+            next_idx = window_idx + 1
+            metrics.counts["hits"] += hits + pruned
+            metrics.counts["hits_pruned"] += pruned
+            metrics.counts["regions"] += len(domains)
+            yield windows[window_idx], domains
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    writer.join()
+    maf.stdout.close()
+    returncode = maf.wait()
+    if returncode != 0:
+        raise RuntimeError(
+            "LASTAL failed with return code {}".format(returncode))
+    for window_no_hits in windows[next_idx:]:
+        yield window_no_hits, []
+
+
+def serial_domains(maf_pipe, CLASSIFICATION, THRESHOLD_SCORE, metrics,
+                   SPILL=False):
+    ''' Yield (query name, number of hits, number of pruned hits, list of
+	Domains) for the sequences of the LASTAL output, every sequence
+	is processed right after its hits are read '''
+    for sequence_hits in metrics.timed(
+            read_lastal_hits(maf_pipe, SPILL, THRESHOLD_SCORE), "parsing"):
+        metrics.start("regions")
+        try:
+            domains = hits_domains(sequence_hits, CLASSIFICATION,
+                                   THRESHOLD_SCORE)
+        finally:
+            release_hits(sequence_hits)
+        metrics.stop("regions")
+        yield (sequence_hits['name_q'], len(sequence_hits['score']),
+               sequence_hits['pruned'], domains)
+
+
+def pipelined_domains(maf_pipe, CLASSIFICATION, THRESHOLD_SCORE, metrics,
+                      pool, PIPELINE, SPILL=False):
+    ''' Yield (query name, number of hits, number of pruned hits, list of
+	Domains) for the sequences of the LASTAL output in their order. The output is drained by a reader
+	thread to a bounded queue so LASTAL is not blocked by the processing,
+	at most 2 x PIPELINE sequences are processed by the pool at once.
+	Time of the processing in the pool is added to the "regions" stage,
+	the stage is not profiled in the pool '''
+    hits_queue = queue.Queue(configuration.PIPELINE_QUEUE_SIZE)
+    reader = threading.Thread(target=queue_hits,
+                              args=(maf_pipe, hits_queue, metrics, SPILL,
+                                    THRESHOLD_SCORE))
+    reader.daemon = True
+    reader.start()
+    processing = deque()
+    reading = True
+    while reading or processing:
+        if reading and len(processing) < 2 * PIPELINE:
+            try:
+                sequence_hits = hits_queue.get(
+                    timeout=configuration.PIPELINE_POLL if processing else None)
+            except queue.Empty:
+                sequence_hits = ()
+            if isinstance(sequence_hits, Exception):
+                raise sequence_hits
+            if sequence_hits is None:
+                reading = False
+            elif sequence_hits:
+                processing.append((sequence_hits['name_q'],
+                                   len(sequence_hits['score']),
+                                   sequence_hits['pruned'],
+                                   sequence_hits['spill'],
+                                   pool.apply_async(pipeline_worker, (
+                                       sequence_hits, CLASSIFICATION,
+                                       THRESHOLD_SCORE))))
+        ## results are passed in the order of the sequences
+        while processing and (not reading or len(processing) >= 2 * PIPELINE
+                              or processing[0][4].ready()):
+            name_q, hits, pruned, spill, result = processing.popleft()
+            try:
+                domains, seconds = result.get()
+            finally:
+                if spill is not None:
+                    os.remove(spill)
+            metrics.times["regions"] += seconds
+            yield name_q, hits, pruned, domains
+
+
+def queue_hits(maf_pipe, hits_queue, metrics, SPILL=False,
+               THRESHOLD_SCORE=None):
+    ''' Read hits of the sequences to the queue, the end (or an error of
+	the reading) is marked by None (the exception) '''
+    try:
+        for sequence_hits in metrics.timed(
+                read_lastal_hits(maf_pipe, SPILL, THRESHOLD_SCORE), "parsing"):
+            hits_queue.put(sequence_hits)
+        hits_queue.put(None)
+    except Exception as error:
+        hits_queue.put(error)
+
+
+def init_pipeline_worker(SC_MATRIX):
+    configuration.SC_MATRIX = SC_MATRIX
+
+
+def pipeline_worker(sequence_hits, CLASSIFICATION, THRESHOLD_SCORE):
+    ''' Process hits of a sequence in the pool, return Domains and
+	the processing time '''
+    start = time.perf_counter()
+    try:
+        domains = hits_domains(sequence_hits, CLASSIFICATION, THRESHOLD_SCORE)
+    finally:
+        release_hits(sequence_hits, remove=False)
+    return domains, time.perf_counter() - start
+
+
+def hits_domains(sequence_hits, CLASSIFICATION, THRESHOLD_SCORE):
+    ''' Cluster the hits of a sequence to regions and return list of Domains
+	of the regions '''
+    ############# PARSING LASTAL OUTPUT ############################
+    score = sequence_hits['score']
+    start_hit = sequence_hits['start_q']
+    end_hit = start_hit + sequence_hits['al_size_q']
+    strand = sequence_hits['strand_q']
+    seq_len = sequence_hits['seq_size_q']
+    domain_db = sequence_hits['name_db']
+    db_seq = sequence_hits['db_seq']
+    query_seq = sequence_hits['q_seq']
+    domain_size = sequence_hits['seq_size_db']
+    db_start = sequence_hits['start_db'] + 1
+    db_end = sequence_hits['start_db'] + sequence_hits['al_size_db']
+
+    [reverse_strand_idx, positions_plus, positions_minus
+     ] = hits_processing(seq_len, start_hit, end_hit, strand)
+    strand_gff = "+"
+    [mins_plus, maxs_plus, data_plus, indices_plus
+     ] = overlapping_regions(positions_plus)
+    [mins_minus, maxs_minus, data_minus, indices_minus
+     ] = overlapping_regions(positions_minus)
+    positions = positions_plus + positions_minus
+    indices_overal = indices_plus + [x + reverse_strand_idx
+                                     for x in indices_minus]
+    mins = mins_plus + mins_minus
+    maxs = maxs_plus + maxs_minus
+    data = data_plus + data_minus
+    ## quality of the best hits alignments of all regions computed at once
+    best_hits = [best_score(score[np.array(region)], region)[0]
+                 for region in indices_overal]
+    qualities = filter_params_batch(db_seq[best_hits],
+                                    query_seq[best_hits],
+                                    domain_size[best_hits])
+    ## process every region (cluster) of overlapping hits sequentially
+    count_region = 0
+    domains = []
+    for region in indices_overal:
+        db_names = domain_db[np.array(region)]
+        db_starts = db_start[np.array(region)]
+        db_ends = db_end[np.array(region)]
+        scores = score[np.array(region)]
+        regions_above_threshold = np.array(region)[
+            max(scores) / 100 * THRESHOLD_SCORE < scores]
+        ## sort by score first:
+        consensus = get_full_translation(
+            translation_alignments(
+                query_seq=sortby(query_seq[regions_above_threshold], score[regions_above_threshold], True),
+                start_hit=sortby(start_hit[regions_above_threshold], score[regions_above_threshold], True),
+                end_hit=sortby(end_hit[regions_above_threshold], score[regions_above_threshold], True))
+            )
+
+        annotations = domain_annotation(db_names, CLASSIFICATION)
+        [domain_type, ann_substring, unique_annotations, ann_pos_counts
+         ] = region_annotation(mins[count_region], maxs[count_region],
+                               data[count_region], annotations, scores,
+                               THRESHOLD_SCORE)
+        [best_idx, best_idx_reg] = best_score(scores, region)
+        annotation_best = annotations[best_idx_reg]
+        db_name_best = db_names[best_idx_reg]
+        db_starts_best = db_starts[best_idx_reg]
+        db_ends_best = db_ends[best_idx_reg]
+        if count_region == len(indices_plus):
+            strand_gff = "-"
+        if strand_gff == "+":
+            feature_start = min(start_hit[regions_above_threshold]) + 1
+            feature_end = max(end_hit[regions_above_threshold])
+        else:
+            feature_end = seq_len[region][0] - min(start_hit[regions_above_threshold])
+            feature_start = seq_len[region][0] - max(end_hit[regions_above_threshold]) + 1
+        domains.append(domain_record(
+            domain_type, ann_substring, unique_annotations, ann_pos_counts,
+            feature_start, feature_end, best_idx, annotation_best,
+            db_name_best, db_starts_best, db_ends_best, strand_gff, score,
+            db_seq, query_seq, domain_size, positions, consensus,
+            qualities[count_region]))
+        count_region += 1
+    return domains
+
+
+def search_worker(shard):
+    ''' Search windows of a single shard in a separate process,
+	domains are written to a fragment in the directory.
+	Return summary of the worker's metrics '''
+    [QUERY, records, windows, LAST_DB, CLASSIFICATION, THRESHOLD_SCORE,
+     SCORING_MATRIX, SC_MATRIX, fragments_dir, cache, PROFILE, PROFILER,
+     profile_prefix, SPILL] = shard
+    configuration.SC_MATRIX = SC_MATRIX
+    metrics = SearchMetrics(PROFILE, PROFILER, "{}.{}".format(profile_prefix,
+                                                              os.getpid()))
+    fragments = FragmentWriter(fragments_dir)
+    for window, domains in search_sequences(QUERY, records, windows, LAST_DB,
+                                            CLASSIFICATION, THRESHOLD_SCORE,
+                                            SCORING_MATRIX, cache, metrics, 0,
+                                            SPILL):
+        fragments.add(window, domains)
+    fragments.close()
+    metrics.write_profiles()
+    return metrics.summary()
+
+
+def balance_shards(lengths, WORKERS):
+    ''' Assign sequences to shards with similar total number of bases -
+	the longest sequences go first, always to the least loaded shard.
+	Return index of the shard for every sequence '''
+    loads = [(0, shard) for shard in range(WORKERS)]
+    assignment = [None] * len(lengths)
+    for idx in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        load, shard = heapq.heappop(loads)
+        assignment[idx] = shard
+        heapq.heappush(loads, (load + lengths[idx], shard))
+    return assignment
+
+
+def parallel_search(QUERY, records, windows, LAST_DB, CLASSIFICATION,
+                    THRESHOLD_SCORE, SCORING_MATRIX, WORKERS, fragments_dir,
+                    cache=None, metrics=None, SPILL=False):
+    ''' Distribute the windows to shards and search them in a pool of processes,
+	every process writes its own fragment to the directory.
+	Metrics of the workers are added to metrics, profiled stages are saved
+	separately for every worker (process id added to the prefix) '''
+    if metrics is None:
+        metrics = SearchMetrics()
+    WORKERS = min(WORKERS, len(windows))
+    assignment = balance_shards([window.end - window.start
+                                 for window in windows], WORKERS)
+    shards = [[QUERY, records,
+               [window for window, window_shard in zip(windows, assignment)
+                if window_shard == shard], LAST_DB, CLASSIFICATION,
+               THRESHOLD_SCORE, SCORING_MATRIX, configuration.SC_MATRIX,
+               fragments_dir, cache, metrics.PROFILE, metrics.PROFILER,
+               metrics.prefix, SPILL]
+              for shard in range(WORKERS)]
+    pool = multiprocessing.Pool(WORKERS)
+    try:
+        for summary in pool.map(search_worker, shards):
+            metrics.update(summary)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class FragmentWriter():
+    '''
+    Append Domains of the searched windows to a new fragment in the directory.
+    A window is recorded to the list of finished windows (fragment name with
+    .done suffix) only after its lines are flushed, so the fragment can be
+    used even if the process is killed
+    '''
+
+    def __init__(self, fragments_dir):
+        handle, self.path = mkstemp(dir=fragments_dir,
+                                    prefix=configuration.FRAGMENT_PREFIX,
+                                    suffix=".pkl")
+        self.fragment = os.fdopen(handle, "wb")
+        self.done = open("{}{}".format(self.path, configuration.DONE_SUFFIX),
+                         "w")
+
+    def add(self, window, domains):
+        offset = self.fragment.tell()
+        data = pickle.dumps(domains, protocol=pickle.HIGHEST_PROTOCOL)
+        self.fragment.write(data)
+        self.fragment.flush()
+        self.done.write("{}\t{}\t{}\n".format(window.name, offset, len(data)))
+        self.done.flush()
+
+    def close(self):
+        self.fragment.close()
+        self.done.close()
+
+
+def finished_windows(fragments_dir):
+    ''' Collect the finished windows from all fragments in the directory,
+	return dictionary of window name: (fragment, offset, size in bytes) '''
+    done = {}
+    for file_name in os.listdir(fragments_dir):
+        if not (file_name.startswith(configuration.FRAGMENT_PREFIX) and
+                file_name.endswith(configuration.DONE_SUFFIX)):
+            continue
+        fragment = os.path.join(fragments_dir,
+                                file_name[:-len(configuration.DONE_SUFFIX)])
+        with open(os.path.join(fragments_dir, file_name), "r") as done_file:
+            for line in done_file:
+                ## record interrupted while writing
+                if not line.endswith("\n"):
+                    break
+                window_name, offset, size = line.rstrip("\n").split("\t")
+                done[window_name] = (fragment, int(offset), int(size))
+    return done
+
+
+def read_fragments(windows, done):
+    ''' Yield (window, list of its Domains) of the finished windows from
+	the fragments in the order of the windows '''
+    fragments = {}
+    try:
+        for window in windows:
+            if window.name not in done:
+                continue
+            fragment, offset, size = done[window.name]
+            if fragment not in fragments:
+                fragments[fragment] = open(fragment, "rb")
+            fragments[fragment].seek(offset)
+            yield window, pickle.loads(fragments[fragment].read(size))
+    finally:
+        for fragment in fragments.values():
+            fragment.close()
+
+
+class DomainCache():
+    '''
+    On-disk cache of Domains found in windows (positions relative to the window)
+    keyed by hash of the window sequence and the search manifest. Records are
+    touched when used and the least recently used ones are evicted when
+    the cache exceeds its size
+    '''
+
+    def __init__(self, cache_dir, manifest, max_size):
+        self.cache_dir = cache_dir
+        self.identity = json.dumps(manifest, sort_keys=True).encode("utf-8")
+        self.max_size = max_size
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def window_keys(self, QUERY, records, windows):
+        ''' Keys of the windows, sequences are read from the query file '''
+        keys = []
+        if not windows:
+            return keys
+        with fasta_index.open_fasta(QUERY) as fasta:
+            for record_idx, record_windows in groupby(
+                    windows, key=lambda window: window.record):
+                for subsequence in fasta_index.record_subsequences(
+                        fasta, records[record_idx],
+                    [(window.start, window.end) for window in record_windows]):
+                    key = hashlib.md5(self.identity)
+                    key.update(subsequence)
+                    keys.append(key.hexdigest())
+        return keys
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], "{}.pkl".format(key))
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, key):
+        ''' Return cached Domains or None if the record is not available '''
+        path = self.path(key)
+        try:
+            with open(path, "rb") as record:
+                domains = pickle.load(record)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return [Domain(*domain) for domain in domains]
+
+    def store(self, key, domains):
+        ''' Save Domains of a window, errors of the cache are not fatal '''
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with NamedTemporaryFile("wb", dir=os.path.dirname(path),
+                                    suffix=".tmp", delete=False) as record:
+                pickle.dump([tuple(domain) for domain in domains], record,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(record.name, path)
+        except OSError:
+            pass
 
-    tab_pipe = tab.stdout
-    maf_pipe = maf.stdout
-    maf_pipe.readline()
+    def evict(self):
+        ''' Remove the least recently used records exceeding the cache size '''
+        records = []
+        for directory, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.endswith(".pkl"):
+                    path = os.path.join(directory, file_name)
+                    stat = os.stat(path)
+                    records.append((stat.st_mtime, stat.st_size, path))
+        size = sum(record_size for _, record_size, _ in records)
+        for _, record_size, path in sorted(records):
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            size -= record_size
+
+
+def files_md5(paths):
+    ''' Hash of the content of the files '''
+    md5 = hashlib.md5()
+    for path in paths:
+        with open(path, "rb") as hashed:
+            for chunk in iter(lambda: hashed.read(1 << 20), b""):
+                md5.update(chunk)
+    return md5.hexdigest()
+
+
+def search_manifest(LAST_DB, CLASSIFICATION, THRESHOLD_SCORE, SCORING_MATRIX,
+                    version_string):
+    ''' Hashes of the database, classification, scoring matrix and
+	the parameters which determine domains found in a sequence '''
+    return {
+        "protein_database": files_md5(sorted(glob.glob("{}.*".format(
+            LAST_DB)))),
+        "classification": files_md5([CLASSIFICATION]),
+        "scoring_matrix": files_md5([configuration.SC_MATRIX]),
+        "parameters": [THRESHOLD_SCORE, SCORING_MATRIX],
+        "version": version_string
+    }
+
+
+def checkpoint_manifest(QUERY, WIN_DOM, OVERLAP_DOM, manifest, GAPS=0):
+    ''' Add hash of the query and the windows to the search manifest,
+	the finished windows can be reused only by a run with the same manifest '''
+    manifest = dict(manifest)
+    manifest["query"] = files_md5([QUERY])
+    manifest["windows"] = [WIN_DOM, OVERLAP_DOM] + ([GAPS] if GAPS else [])
+    return manifest
+
+
+def open_checkpoint(CHECKPOINT, manifest, RESUME):
+    ''' Prepare the checkpoint directory. When resuming return the windows
+	finished by the previous run, otherwise fragments of any previous run are
+	removed and the manifest of the current run is saved '''
+    manifest_file = os.path.join(CHECKPOINT, configuration.CHECKPOINT_MANIFEST)
+    if RESUME and os.path.exists(manifest_file):
+        with open(manifest_file, "r") as previous_manifest:
+            if json.load(previous_manifest) != manifest:
+                raise ValueError(
+                    '''Checkpoint {} was created for different input, database or parameters,
+							it can not be resumed'''.format(CHECKPOINT))
+        return finished_windows(CHECKPOINT)
+    if not os.path.exists(CHECKPOINT):
+        os.makedirs(CHECKPOINT)
+    for file_name in os.listdir(CHECKPOINT):
+        if file_name.startswith(configuration.FRAGMENT_PREFIX):
+            os.unlink(os.path.join(CHECKPOINT, file_name))
+    with NamedTemporaryFile("w", dir=CHECKPOINT, delete=False) as new_manifest:
+        json.dump(manifest, new_manifest, indent=1)
+    os.replace(new_manifest.name, manifest_file)
+    return {}
 
-    seq_ids = []
-    dom_tmp = NamedTemporaryFile(delete=False)
-    with open(dom_tmp.name, "w") as dom_gff_tmp:
-        path = os.path.dirname(os.path.realpath(__file__))
-        version_string = get_version(path, LAST_DB)
-        write_info(dom_gff_tmp, version_string)
-    gff = open(dom_tmp.name, "a")
-    start = True
-    while True:
-        try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                sequence_hits = np.genfromtxt(
-                    line_generator(tab_pipe, maf_pipe, start),
-                    names=lastal_columns[SCORING_MATRIX],
-                    usecols=("score, name_q, start_q, al_size_q,"
-                             " strand_q, seq_size_q, name_db, db_seq,"
-                             " q_seq, seq_size_db, start_db, al_size_db"),
-                    dtype=None,
-                    comments=None)
-        except RuntimeError:
-            break
-        ## if there are no domains found
-        if sequence_hits.size is 0:
-            gff.write("##NO DOMAINS")
-            return [], [], [], []
-
-        ############# PARSING LASTAL OUTPUT ############################
-        sequence_hits = np.atleast_1d(sequence_hits)
-        score = sequence_hits['score'].astype("int")
-        seq_id = sequence_hits['name_q'][0].astype("str")
-        start_hit = sequence_hits['start_q'].astype("int")
-        end_hit = start_hit + sequence_hits['al_size_q'].astype("int")
-        strand = sequence_hits['strand_q'].astype("str")
-        seq_len = sequence_hits['seq_size_q'].astype("int")
-        domain_db = sequence_hits['name_db'].astype("str")
-        db_seq = sequence_hits['db_seq'].astype("str")
-        query_seq = sequence_hits['q_seq'].astype("str")
-        domain_size = sequence_hits['seq_size_db'].astype("int")
-        db_start = sequence_hits['start_db'].astype("int") + 1
-        db_end = sequence_hits['start_db'].astype("int") + sequence_hits[
-            'al_size_db'].astype("int")
-
-        [reverse_strand_idx, positions_plus, positions_minus
-         ] = hits_processing(seq_len, start_hit, end_hit, strand)
-        strand_gff = "+"
-        [mins_plus, maxs_plus, data_plus, indices_plus
-         ] = overlapping_regions(positions_plus)
-        [mins_minus, maxs_minus, data_minus, indices_minus
-         ] = overlapping_regions(positions_minus)
-        positions = positions_plus + positions_minus
-        indices_overal = indices_plus + [x + reverse_strand_idx
-                                         for x in indices_minus]
-        mins = mins_plus + mins_minus
-        maxs = maxs_plus + maxs_minus
-        data = data_plus + data_minus
-        ## process every region (cluster) of overlapping hits sequentially
-        count_region = 0
-        for region in indices_overal:
-            db_names = domain_db[np.array(region)]
-            db_starts = db_start[np.array(region)]
-            db_ends = db_end[np.array(region)]
-            scores = score[np.array(region)]
-            regions_above_threshold = [
-                region[i]
-                for i, _ in enumerate(region)
-                if max(scores) / 100 * THRESHOLD_SCORE < scores[i]
-            ]
-            ## sort by score first:
-            consensus = get_full_translation(
-                translation_alignments(
-                    query_seq=sortby(query_seq[regions_above_threshold], score[regions_above_threshold], True),
-                    start_hit=sortby(start_hit[regions_above_threshold], score[regions_above_threshold], True),
-                    end_hit=sortby(end_hit[regions_above_threshold], score[regions_above_threshold], True))
-                )
-
-            annotations = domain_annotation(db_names, CLASSIFICATION)
-            [score_matrix, classes_dict] = score_table(
-                mins[count_region], maxs[count_region], data[count_region],
-                annotations, scores, CLASSIFICATION)
-            ann_per_reg = score_matrix_evaluation(score_matrix, classes_dict,
-                                                  THRESHOLD_SCORE)
-            [domain_type, ann_substring, unique_annotations, ann_pos_counts
-             ] = group_annot_regs(ann_per_reg)
-            [best_idx, best_idx_reg] = best_score(scores, region)
-            annotation_best = annotations[best_idx_reg]
-            db_name_best = db_names[best_idx_reg]
-            db_starts_best = db_starts[best_idx_reg]
-            db_ends_best = db_ends[best_idx_reg]
-            if count_region == len(indices_plus):
-                strand_gff = "-"
-            if strand_gff == "+":
-                feature_start = min(start_hit[regions_above_threshold]) + 1
-                feature_end = max(end_hit[regions_above_threshold])
-            else:
-                feature_end = seq_len[region][0] - min(start_hit[regions_above_threshold])
-                feature_start = seq_len[region][0] - max(end_hit[regions_above_threshold]) + 1
-            create_gff3(domain_type, ann_substring, unique_annotations,
-                        ann_pos_counts, feature_start,feature_end,
-                        step, best_idx, annotation_best, db_name_best,
-                        db_starts_best, db_ends_best, strand_gff, score,
-                        seq_id, db_seq, query_seq, domain_size, positions, gff, consensus)
-            count_region += 1
-        seq_ids.append(seq_id)
-    os.unlink(query_temp)
-    gff.close()
-    dom_tmp.close()
-    ## if any sequence from input data was split into windows, merge and adjust the data from individual windows
-    if any("DANTE_PART" in x for x in seq_ids):
-        adjust_gff(OUTPUT_DOMAIN, dom_tmp.name, WIN_DOM, OVERLAP_DOM, step)
-    ## otherwise use the temporary output as the final domains gff
-    else:
-        shutil.copy2(dom_tmp.name, OUTPUT_DOMAIN)
-    os.unlink(dom_tmp.name)
 
 def  sortby(a, by, reverse=False):
     ''' sort according values in the by list '''
@@ -621,72 +1812,100 @@ def  sortby(a, by, reverse=False):
     return a_sorted
 
 
+## characters kept once when translation is converted to codons and
+## characters matched by \w in the search of joins of translations
+FRAMESHIFT_CODES = np.zeros(256, dtype=bool)
+FRAMESHIFT_CODES[[ord(c) for c in "/\\"]] = True
+WORD_CODES = np.zeros(256, dtype=bool)
+WORD_CODES[[ord(c) for c in string.ascii_letters + string.digits + "_"]] = True
+GAP = ord("-")
+FRAMESHIFT = ord("/")
+
+
 def a2nnn(s):
-    s1 = "".join([c if c in ['/', '\\'] else c + c + c
-                  for c in s.replace("-", "")])
+    codes = np.frombuffer(s.replace("-", "").encode("ascii"), dtype=np.uint8)
+    s1 = np.repeat(codes, np.where(FRAMESHIFT_CODES[codes], 1,
+                                   3)).tobytes().decode("ascii")
     # collapse frameshifts (/)
     s2 = re.sub("[a-zA-Z*]{2}//[a-zA-Z*]{2}", "//", s1)
     s3 = re.sub("[a-zA-Z*]/[a-zA-Z*]", "/", s2)
     return (s3)
 
 
-
 def rle(s):
-    '''run length encoding but max is set to 3 (codon)'''
-    prev = ""
-    count = 1
-    char = []
-    length = []
-    L = 0
-    for n in s:
-        if n == prev and count < (3 - L):
-            count += 1
-        else:
-            char.append(prev)
-            length.append(count)
-            L = 1 if prev == "/" else 0
-            prev = n
-            count = 1
-    char.append(prev)
-    length.append(count)
-    sequence = char[1:]
-    return sequence, length[1:]
+    '''run length encoding but max is set to 3 (codon), runs following
+    a run of "/" are max 2. Runs are computed for blocks of the same character
+    at once, the first run of a block is limited by the preceding block and
+    the following ones by the character of the block'''
+    codes = np.frombuffer(s.encode("ascii"), dtype=np.uint8)
+    if not len(codes):
+        return [], []
+    block_starts = np.flatnonzero(np.concatenate(([True],
+                                                  codes[1:] != codes[:-1])))
+    block_lens = np.diff(np.append(block_starts, len(codes)))
+    block_codes = codes[block_starts]
+    first_max = np.full(len(block_codes), 3)
+    first_max[1:][block_codes[:-1] == FRAMESHIFT] = 2
+    next_max = np.where(block_codes == FRAMESHIFT, 2, 3)
+    first_len = np.minimum(block_lens, first_max)
+    runs_per_block = 1 + -(-(block_lens - first_len) // next_max)
+    ## position of every run in its block
+    run_blocks = np.repeat(np.arange(len(block_codes)), runs_per_block)
+    run_idx = np.arange(len(run_blocks)) - np.repeat(
+        np.cumsum(runs_per_block) - runs_per_block, runs_per_block)
+    length = np.where(
+        run_idx == 0, first_len[run_blocks],
+        np.minimum(next_max[run_blocks], block_lens[run_blocks] -
+                   first_len[run_blocks] - (run_idx - 1) * next_max[run_blocks]))
+    sequence = list(block_codes[run_blocks].tobytes().decode("ascii"))
+    return sequence, length.tolist()
+
 
 def get_full_translation(translations):
     '''get one full length translation  from multiple partial
-    aligned translation '''
+    aligned translation. Coverage of the selected translations is tracked
+    by a mask of filled positions'''
     # find minimal set of alignements
     minimal_set = []
+    filled = None
     not_filled_prev = len(translations[0])
     for s in translations:
-        minimal_set.append(s)
+        codes = np.frombuffer(s.encode("ascii"), dtype=np.uint8)
         # check defined position - is there only '-' character?
-        not_filled = sum([set(i) == {"-"} for i in  zip(*minimal_set)])
+        if filled is None:
+            filled_new = codes != GAP
+        else:
+            length = min(len(filled), len(codes))
+            filled_new = filled[:length] | (codes[:length] != GAP)
+        not_filled = len(filled_new) - int(filled_new.sum())
+        if not_filled != not_filled_prev or not_filled == 0:
+            minimal_set.append(codes)
+            filled = filled_new
         if not_filled == 0:
             break
-        if not_filled == not_filled_prev:
-            # last added sequence did not improve coverage - remove it.
-            minimal_set.pop()
+        # last added sequence did not improve coverage - it is not used
         not_filled_prev = not_filled
     # merge translations
     final_translation = minimal_set[0]
     # record positions of joins to correct frameshifts reportings
     position_of_joins = set()
-    position_of_joins_rle = set()
-    if len(minimal_set) > 1:  # translation must be merged
-        for s in minimal_set[1:]:
-            s1 = re.search(r"-\w", final_translation)
-            s2 = re.search(r"\w-", final_translation)
-            if s1:
-                position_of_joins.add(s1.start())
-            if s2:
-                position_of_joins.add((s2.end() - 1))
-            final_translation = "".join(
-                [b if a == "-" else a for a, b in zip(final_translation, s)])
-    translation_rle = rle(final_translation)
+    for s in minimal_set[1:]:
+        gaps = final_translation == GAP
+        words = WORD_CODES[final_translation]
+        ## first "-\w" and "\w-" in the translation
+        gap_word = gaps[:-1] & words[1:]
+        word_gap = words[:-1] & gaps[1:]
+        if gap_word.any():
+            position_of_joins.add(int(gap_word.argmax()))
+        if word_gap.any():
+            position_of_joins.add(int(word_gap.argmax()) + 1)
+        length = min(len(final_translation), len(s))
+        final_translation = np.where(gaps[:length], s[:length],
+                                     final_translation[:length])
+    translation_rle = rle(final_translation.tobytes().decode("ascii"))
     cumsumed_positions = np.cumsum(translation_rle[1])
-    for p in position_of_joins:
-        position_of_joins_rle.add(sum(cumsumed_positions <= p))
+    position_of_joins_rle = set(np.searchsorted(
+        cumsumed_positions, sorted(position_of_joins), side="right").tolist())
     # insert /\ when necessary
     for p in position_of_joins_rle:
         if translation_rle[0][p] not in ['/',"//","\\", "\\\\"]:
@@ -709,94 +1928,6 @@ def translation_alignments(query_seq, start_hit, end_hit):
 
 
 
-def adjust_gff(OUTPUT_DOMAIN, gff, WIN_DOM, OVERLAP_DOM, step):
-    ''' Original gff file is adjusted in case of containing cut parts 
-	- for consecutive sequences overlap is divided to half with first half 
-	of records(domains) belonging to the first sequence and second to the following one.
-	Duplicate domains going through the middle of the overlap are removed.
-	First and the last part (marked as LAST) of a certain sequence are 
-	handled separately as the are overlapped from one side only '''
-
-    seq_id_all = []
-    class_dict = defaultdict(int)
-    seen = set()
-    with open(OUTPUT_DOMAIN, "w") as adjusted_gff:
-        with open(gff, "r") as primary_gff:
-            start = True
-            for line in primary_gff:
-                if line.startswith("#"):
-                    adjusted_gff.write(line)
-                else:
-                    split_line = line.split("\t")
-                    classification = split_line[-1].split(";")[1].split("=")[1]
-                    if start:
-                        seq_id_all.append(split_line[0].split("_DANTE_PART")[
-                            0])
-                        start = False
-                    seq_id = split_line[0].split("_DANTE_PART")[0]
-                    if "DANTE_PART" in line:
-                        line_without_id = "\t".join(split_line[1:])
-                        part = int(split_line[0].split("_DANTE_PART")[1].split(
-                            ":")[0].split("_")[0])
-                        if seq_id != seq_id_all[-1]:
-                            seq_id_all.append(seq_id)
-
-                            ## first part of the sequence
-                        if part == 1:
-                            cut_end = WIN_DOM - OVERLAP_DOM / 2
-                            if int(split_line[3]) <= cut_end <= int(split_line[
-                                    4]):
-                                if line_without_id not in seen:
-                                    adjusted_gff.write("{}\t{}".format(
-                                        seq_id, line_without_id))
-                                    class_dict[classification] += 1
-                                    seen.add(line_without_id)
-                            elif int(split_line[4]) < cut_end:
-                                adjusted_gff.write("{}\t{}".format(
-                                    seq_id, line_without_id))
-                                class_dict[classification] += 1
-
-                                ## last part of the sequence
-                        elif "LAST" in split_line[0]:
-                            cut_start = OVERLAP_DOM / 2 + (part - 1) * step
-                            if int(split_line[3]) <= cut_start <= int(
-                                    split_line[4]):
-                                if line_without_id not in seen:
-                                    adjusted_gff.write("{}\t{}".format(
-                                        seq_id, line_without_id))
-                                    class_dict[classification] += 1
-                                    seen.add(line_without_id)
-                            elif int(split_line[3]) > cut_start:
-                                adjusted_gff.write("{}\t{}".format(
-                                    seq_id, line_without_id))
-                                class_dict[classification] += 1
-
-                        ## middle part of the sequence
-                        else:
-                            cut_start = OVERLAP_DOM / 2 + (part - 1) * step
-                            cut_end = WIN_DOM - OVERLAP_DOM / 2 + (part -
-                                                                   1) * step
-                            if int(split_line[3]) <= cut_start <= int(
-                                    split_line[4]) or int(split_line[
-                                        3]) <= cut_end <= int(split_line[4]):
-                                if line_without_id not in seen:
-                                    adjusted_gff.write("{}\t{}".format(
-                                        seq_id, line_without_id))
-                                    class_dict[classification] += 1
-                                    seen.add(line_without_id)
-                            elif int(split_line[3]) > cut_start and int(
-                                    split_line[4]) < cut_end:
-                                adjusted_gff.write("{}\t{}".format(
-                                    seq_id, line_without_id))
-                                class_dict[classification] += 1
-                    ## not divived
-                    else:
-                        if seq_id != seq_id_all[-1]:
-                            seq_id_all.append(seq_id)
-                        adjusted_gff.write(line)
-                        class_dict[classification] += 1
-
-
 def main(args):
 
     t = time.time()
@@ -811,6 +1942,17 @@ def main(args):
     WIN_DOM = args.win_dom
     OVERLAP_DOM = args.overlap_dom
     SCORING_MATRIX = args.scoring_matrix
+    WORKERS = args.threads
+    CHECKPOINT = args.checkpoint_dir
+    RESUME = args.resume
+    CACHE = args.cache_dir
+    CACHE_SIZE = args.cache_size * 1024 * 1024
+    PROFILE = args.profile
+    PROFILER = args.profiler
+    PIPELINE = args.pipeline_workers
+    SPILL = args.spill_hits
+    GAPS = args.gap_windows
+    TABLE = args.domains_table
     configuration.SC_MATRIX = configuration.SC_MATRIX_SKELETON.format(SCORING_MATRIX)
 
     if OUTPUT_DOMAIN is None:
@@ -835,7 +1977,9 @@ def main(args):
         OUTPUT_DOMAIN = os.path.join(OUTPUT_DIR,
                                      os.path.basename(OUTPUT_DOMAIN))
     domain_search(QUERY, LAST_DB, CLASSIFICATION, OUTPUT_DOMAIN,
-                  THRESHOLD_SCORE, WIN_DOM, OVERLAP_DOM, SCORING_MATRIX)
+                  THRESHOLD_SCORE, WIN_DOM, OVERLAP_DOM, SCORING_MATRIX,
+                  WORKERS, CHECKPOINT, RESUME, CACHE, CACHE_SIZE, PROFILE,
+                  PROFILER, PIPELINE, SPILL, GAPS, TABLE)
 
     print("ELAPSED_TIME_DOMAINS = {} s".format(time.time() - t))
 
@@ -877,7 +2021,7 @@ if __name__ == "__main__":
         type=str,
         required=True,
         help=
-        'input DNA sequence to search for protein domains in a fasta format. Multifasta format allowed.')
+        'input DNA sequence to search for protein domains in a fasta format. Multifasta format allowed, the file can be compressed by gzip or bgzip.')
     requiredNamed.add_argument('-pdb',
                                "--protein_database",
                                type=str,
@@ -891,7 +2035,12 @@ if __name__ == "__main__":
     parser.add_argument("-oug",
                         "--domain_gff",
                         type=str,
-                        help="output domains gff format")
+                        help="output domains gff format, with .gz suffix compressed by bgzip with the domains sorted by position and indexed by coordinates (.csi)")
+    parser.add_argument(
+        "-tab",
+        "--domains_table",
+        action="store_true",
+        help="save the domains also to columnar binary table next to the output gff (.table directory) readable by memory mapping")
     parser.add_argument(
         "-nld",
         "--new_ldb",
@@ -929,6 +2078,69 @@ if __name__ == "__main__":
                         type=int,
                         default=10000,
                         help="overlap of sequences in two consecutive windows")
+    parser.add_argument(
+        "-thr",
+        "--threads",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of parallel worker processes for the domains search")
+    parser.add_argument(
+        "-pw",
+        "--pipeline_workers",
+        type=int,
+        default=0,
+        help="number of worker processes for the regions processing while a separate thread reads LASTAL output, used without --threads")
+    parser.add_argument(
+        "--spill_hits",
+        action="store_true",
+        help="keep only coordinates of the hits in memory, alignments are written to a temporary file and read back for one region at a time")
+    parser.add_argument(
+        "-gw",
+        "--gap_windows",
+        type=int,
+        nargs="?",
+        const=configuration.GAP_MIN,
+        default=0,
+        help="cut the sequences in the runs of N (or X) of at least this length (default {}) and skip the runs, only the parts between them exceeding the window are cut with the overlap".format(
+            configuration.GAP_MIN))
+    parser.add_argument(
+        "-cp",
+        "--checkpoint_dir",
+        type=str,
+        help="directory to record the finished sequences (windows) of the search")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the sequences finished by the previous run recorded in the checkpoint directory")
+    parser.add_argument(
+        "-cache",
+        "--cache_dir",
+        type=str,
+        help="directory to cache domains of the searched sequences and reuse them for identical sequences")
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=configuration.CACHE_SIZE // (1024 * 1024),
+        help="size limit of the cache in MB, the least recently used sequences are removed")
+    parser.add_argument(
+        "--profile",
+        nargs="+",
+        default=[],
+        choices=SearchMetrics.STAGES[1:],
+        help="stages of the search to profile, results are saved next to the output gff")
+    parser.add_argument(
+        "--profiler",
+        type=str,
+        default="cprofile",
+        choices=["cprofile", "tracemalloc"],
+        help="profiler of the selected stages, cprofile saves pstats files (.prof), tracemalloc the top allocations of the stage (not with --pipeline_workers)")
 
     args = parser.parse_args()
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume requires --checkpoint_dir")
+    if (args.pipeline_workers and args.threads <= 1 and args.profile and
+            args.profiler == "tracemalloc"):
+        parser.error("--profiler tracemalloc cannot be used with "
+                     "--pipeline_workers, the stages run concurrently")
     main(args)
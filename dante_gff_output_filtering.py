@@ -2,11 +2,15 @@
 import sys
 import time
 import configuration
+import gff_index
+import domain_table
 import os
 import textwrap
 import subprocess
-from tempfile import NamedTemporaryFile
+import shutil
+from tempfile import TemporaryFile
 from collections import defaultdict
+import numpy as np
 
 
 class Range():
@@ -28,68 +32,56 @@ class Range():
         return "float range {}..{}".format(self.start, self.end)
 
 
-def check_file_start(gff_file):
-    count_comment = 0
-    with open(gff_file, "r") as gff_all:
-        line = gff_all.readline()
-        while line.startswith("#"):
-            line = gff_all.readline()
-            count_comment += 1
-    return count_comment
-
-
-def write_info(filt_dom_tmp, FILT_DOM_GFF, orig_class_dict, filt_class_dict,
-               dom_dict, version_lines, TH_IDENTITY, TH_SIMILARITY,
-               TH_LENGTH, TH_INTERRUPT, TH_LEN_RATIO, SELECTED_DOM):
+def info_header(version_lines, orig_class_dict, filt_class_dict, dom_dict,
+                TH_IDENTITY, TH_SIMILARITY, TH_LENGTH, TH_INTERRUPT,
+                TH_LEN_RATIO, SELECTED_DOM):
     '''
-	Write domains statistics in beginning of filtered GFF
+	Return domains statistics written in beginning of filtered GFF
 	'''
-    with open(FILT_DOM_GFF, "w") as filt_gff:
-        for line in version_lines:
-            filt_gff.write(line)
-        filt_gff.write(("##Filtering thresholdss: min identity: {}, min similarity: {},"
-                        " min relative alingment length: {}, max interuptions(stop or "
-                        "frameshift): {}, max relative alignment length: {}, selected"
-                        " domains: {} \n").format(TH_IDENTITY,
-                                                  TH_SIMILARITY,
-                                                  TH_LENGTH,
-                                                  TH_INTERRUPT,
-                                                  TH_LEN_RATIO,
-                                                  SELECTED_DOM))
-        filt_gff.write("##CLASSIFICATION\tORIGINAL_COUNTS\tFILTERED_COUNTS\n")
-        if not orig_class_dict:
-            filt_gff.write("##NO DOMAINS CLASSIFICATIONS\n")
-        for classification in sorted(orig_class_dict.keys()):
-            if classification in filt_class_dict.keys():
-                filt_gff.write("##{}\t{}\t{}\n".format(
-                    classification, orig_class_dict[
-                        classification], filt_class_dict[classification]))
-            else:
-                filt_gff.write("##{}\t{}\t{}\n".format(
-                    classification, orig_class_dict[classification], 0))
-        filt_gff.write("##-----------------------------------------------\n"
-                       "##SEQ\tDOMAIN\tCOUNTS\n")
-        if not dom_dict:
-            filt_gff.write("##NO DOMAINS\n")
-        for seq in sorted(dom_dict.keys()):
-            for dom, count in sorted(dom_dict[seq].items()):
-                filt_gff.write("##{}\t{}\t{}\n".format(seq, dom, count))
-        filt_gff.write("##-----------------------------------------------\n")
-        with open(filt_dom_tmp.name, "r") as filt_tmp:
-            for line in filt_tmp:
-                filt_gff.write(line)
-
-
-def get_file_start(gff_file):
-    count_comment = 0
-    lines = []
-    with open(gff_file, "r") as gff_all:
-        line = gff_all.readline()
-        while line.startswith("#"):
-            lines.append(line)
-            line = gff_all.readline()
-            count_comment += 1
-    return count_comment, lines
+    lines = list(version_lines)
+    lines.append(("##Filtering thresholdss: min identity: {}, min similarity: {},"
+                  " min relative alingment length: {}, max interuptions(stop or "
+                  "frameshift): {}, max relative alignment length: {}, selected"
+                  " domains: {} \n").format(TH_IDENTITY,
+                                            TH_SIMILARITY,
+                                            TH_LENGTH,
+                                            TH_INTERRUPT,
+                                            TH_LEN_RATIO,
+                                            SELECTED_DOM))
+    lines.append("##CLASSIFICATION\tORIGINAL_COUNTS\tFILTERED_COUNTS\n")
+    if not orig_class_dict:
+        lines.append("##NO DOMAINS CLASSIFICATIONS\n")
+    for classification in sorted(orig_class_dict.keys()):
+        lines.append("##{}\t{}\t{}\n".format(
+            classification, orig_class_dict[classification],
+            filt_class_dict.get(classification, 0)))
+    lines.append("##-----------------------------------------------\n"
+                 "##SEQ\tDOMAIN\tCOUNTS\n")
+    if not dom_dict:
+        lines.append("##NO DOMAINS\n")
+    for seq in sorted(dom_dict.keys()):
+        for dom, count in sorted(dom_dict[seq].items()):
+            lines.append("##{}\t{}\t{}\n".format(seq, dom, count))
+    lines.append("##-----------------------------------------------\n")
+    return "".join(lines)
+
+
+def write_info(filt_dom_tmp, header, FILT_DOM_GFF):
+    ''' Write the statistics header to the filtered GFF followed by
+	the filtered domains of the temporary file '''
+    filt_dom_tmp.seek(0)
+    try:
+        with open(FILT_DOM_GFF, "w") as filt_gff:
+            filt_gff.write(header)
+            shutil.copyfileobj(filt_dom_tmp, filt_gff)
+    except BaseException:
+        remove_file(FILT_DOM_GFF)
+        raise
+
+
+def remove_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
 
 
 def parse_gff_line(line):
@@ -108,101 +100,164 @@ def parse_gff_line(line):
     gff_line['attributes'] = dict([i.split("=") for i in gff_line['attributes'].split(";")])
     return gff_line
 
+def quality_filtered(lines, orig_class_dict, filt_class_dict, dom_dict,
+                     TH_IDENTITY, TH_SIMILARITY, TH_LENGTH, TH_INTERRUPT,
+                     TH_LEN_RATIO, SELECTED_DOM, ELEMENT):
+    ''' Yield (line, parsed line) of the GFF lines passing the filters,
+	the domains are counted to the statistics dictionaries '''
+    for line in lines:
+        gff_line = parse_gff_line(line)
+        classification = gff_line['attributes']['Final_Classification']
+        orig_class_dict[classification] += 1
+        ## ambiguous domains filtered out automatically
+        if classification != configuration.AMBIGUOUS_TAG:
+            al_identity = float(gff_line['attributes']['Identity'])
+            al_similarity = float(gff_line['attributes']['Similarity'])
+            al_length = float(gff_line['attributes']['Relat_Length'])
+            relat_interrupt = float(gff_line['attributes']['Relat_Interruptions'])
+            db_len_proportion = float(gff_line['attributes']['Hit_to_DB_Length'])
+            dom_type = gff_line['attributes']['Name']
+            seq_id = gff_line['seqid']
+            c1 = al_identity >= TH_IDENTITY
+            c2 = al_similarity >= TH_SIMILARITY
+            if (c1 and c2 and al_length >= TH_LENGTH and relat_interrupt <= TH_INTERRUPT and
+                    db_len_proportion <= TH_LEN_RATIO and
+                    (dom_type == SELECTED_DOM or SELECTED_DOM == "All") and
+                    (ELEMENT in classification)):
+                filt_class_dict[classification] += 1
+                dom_dict[seq_id][dom_type] += 1
+                yield line, gff_line
+
+
+def table_filtered(lines, table, orig_class_dict, filt_class_dict, dom_dict,
+                   TH_IDENTITY, TH_SIMILARITY, TH_LENGTH, TH_INTERRUPT,
+                   TH_LEN_RATIO, SELECTED_DOM, ELEMENT):
+    ''' The same filtering as quality_filtered evaluated on the columns of
+	the domains table of the GFF (see domain_table), only the lines passing
+	the filters are yielded (not parsed) '''
+    classifications = table.dictionary("Final_Classification")
+    names = table.dictionary("Name")
+    seq_ids = table.dictionary("seqid")
+    classification_ok = np.array(
+        [classification != configuration.AMBIGUOUS_TAG and
+         ELEMENT in classification for classification in classifications],
+        dtype=bool)
+    name_ok = np.array([SELECTED_DOM in (name, "All") for name in names],
+                       dtype=bool)
+    classification_codes = table["Final_Classification"]
+    name_codes = table["Name"]
+    selected = (classification_ok[classification_codes] &
+                name_ok[name_codes] &
+                (table["Identity"] >= TH_IDENTITY) &
+                (table["Similarity"] >= TH_SIMILARITY) &
+                (table["Relat_Length"] >= TH_LENGTH) &
+                (table["Relat_Interruptions"] <= TH_INTERRUPT) &
+                (table["Hit_to_DB_Length"] <= TH_LEN_RATIO))
+    for code, count in enumerate(np.bincount(classification_codes,
+                                             minlength=len(classifications))):
+        if count:
+            orig_class_dict[classifications[code]] += int(count)
+    for code, count in enumerate(np.bincount(
+            classification_codes[selected], minlength=len(classifications))):
+        if count:
+            filt_class_dict[classifications[code]] += int(count)
+    pairs, counts = np.unique(np.stack((table["seqid"][selected],
+                                        name_codes[selected])),
+                              axis=1, return_counts=True)
+    for (seq_code, name_code), count in zip(pairs.T, counts):
+        dom_dict[seq_ids[seq_code]][names[name_code]] += int(count)
+    row = 0
+    for row, line in enumerate(lines, start=1):
+        if row > len(table):
+            break
+        if selected[row - 1]:
+            yield line, None
+    if row != len(table):
+        raise ValueError("domains table {} does not match the GFF".format(
+            table.path))
+
+
 def filter_qual_dom(DOM_GFF, FILT_DOM_GFF, TH_IDENTITY, TH_SIMILARITY,
                     TH_LENGTH, TH_INTERRUPT, TH_LEN_RATIO, SELECTED_DOM,
-                    ELEMENT):
-    ''' Filter gff output based on domain and quality of alignment '''
-    [count_comment, version_lines] = get_file_start(DOM_GFF)
-    filt_dom_tmp = NamedTemporaryFile(delete=False)
-    with open(DOM_GFF, "r") as gff_all, open(filt_dom_tmp.name,
-                                             "w") as gff_filtered:
-        for _ in range(count_comment):
-            next(gff_all)
-        dom_dict = defaultdict(lambda: defaultdict(int))
-        orig_class_dict = defaultdict(int)
-        filt_class_dict = defaultdict(int)
-        seq_ids_all = []
-        xminimals = []
-        xmaximals = []
-        domains = []
-        xminimals_all = []
-        xmaximals_all = []
-        domains_all = []
-        start = True
-        for line in gff_all:
-            gff_line = parse_gff_line(line)
-            classification = gff_line['attributes']['Final_Classification']
-            orig_class_dict[classification] += 1
-            ## ambiguous domains filtered out automatically
-            if classification != configuration.AMBIGUOUS_TAG:
-                al_identity = float(gff_line['attributes']['Identity'])
-                al_similarity = float(gff_line['attributes']['Similarity'])
-                al_length = float(gff_line['attributes']['Relat_Length'])
-                relat_interrupt = float(gff_line['attributes']['Relat_Interruptions'])
-                db_len_proportion = float(gff_line['attributes']['Hit_to_DB_Length'])
-                dom_type = gff_line['attributes']['Name']
-                seq_id = gff_line['seqid']
-                xminimal = int(gff_line['start'])
-                xmaximal = int(gff_line['end'])
-                c1 = al_identity >= TH_IDENTITY
-                c2 = al_similarity >= TH_SIMILARITY
-                if (c1 and c2 and al_length >= TH_LENGTH and relat_interrupt <= TH_INTERRUPT and
-                        db_len_proportion <= TH_LEN_RATIO and
-                        (dom_type == SELECTED_DOM or SELECTED_DOM == "All") and
-                        (ELEMENT in classification)):
-                    gff_filtered.writelines(line)
-                    filt_class_dict[classification] += 1
-                    dom_dict[seq_id][dom_type] += 1
-                    if start:
-                        seq_ids_all.append(line.split("\t")[0])
-                        start = False
-                    if seq_id != seq_ids_all[-1]:
-                        seq_ids_all.append(seq_id)
-                        xminimals_all.append(xminimals)
-                        xmaximals_all.append(xmaximals)
-                        domains_all.append(domains)
-                        xminimals = []
-                        xmaximals = []
-                        domains = []
-                    xminimals.append(xminimal)
-                    xmaximals.append(xmaximal)
-                    domains.append(dom_type)
-    path = os.path.dirname(os.path.realpath(__file__))
-    write_info(filt_dom_tmp, FILT_DOM_GFF, orig_class_dict, filt_class_dict,
-               dom_dict, version_lines, TH_IDENTITY, TH_SIMILARITY,
-               TH_LENGTH, TH_INTERRUPT, TH_LEN_RATIO, SELECTED_DOM)
-    os.unlink(filt_dom_tmp.name)
-    xminimals_all.append(xminimals)
-    xmaximals_all.append(xmaximals)
-    domains_all.append(domains)
-    return xminimals_all, xmaximals_all, domains_all, seq_ids_all
+                    ELEMENT, REGION=None, DOMAIN_PROT_SEQ=None):
+    ''' Filter gff output based on domain and quality of alignment,
+	only domains of the REGION (seqid:start-end) are filtered if it is given.
+	The input is read once, the protein sequences of the filtered domains are
+	written to DOMAIN_PROT_SEQ during the filtering if it is given.
+	If the domains table is saved next to the plain input GFF, the filters are
+	evaluated on its columns and only the filtered lines are parsed.
+	The filtered domains are kept in a temporary file (spilled by GffWriter
+	for compressed GFF) until the statistics header is written '''
+    version_lines = gff_index.gff_header(DOM_GFF)
+    dom_dict = defaultdict(lambda: defaultdict(int))
+    orig_class_dict = defaultdict(int)
+    filt_class_dict = defaultdict(int)
+    lines = gff_index.gff_features(DOM_GFF, REGION)
+    filters = (orig_class_dict, filt_class_dict, dom_dict, TH_IDENTITY,
+               TH_SIMILARITY, TH_LENGTH, TH_INTERRUPT, TH_LEN_RATIO,
+               SELECTED_DOM, ELEMENT)
+    table = domain_table.gff_table(DOM_GFF) if REGION is None else None
+    if table is None:
+        filtered = quality_filtered(lines, *filters)
+    else:
+        filtered = table_filtered(lines, table, *filters)
+    compressed = gff_index.is_compressed(FILT_DOM_GFF)
+    if compressed:
+        filt_gff = gff_index.GffWriter(FILT_DOM_GFF)
+    else:
+        filt_gff = TemporaryFile(
+            "w+", dir=os.path.dirname(os.path.abspath(FILT_DOM_GFF)))
+    dom_prot_file = open(DOMAIN_PROT_SEQ, "w") if DOMAIN_PROT_SEQ else None
+    ## partial outputs are removed if the filtering fails
+    try:
+        for line, gff_line in filtered:
+            filt_gff.write(line)
+            if dom_prot_file:
+                dom_prot_file.write(protein_record(
+                    gff_line or parse_gff_line(line)))
+        if dom_prot_file:
+            dom_prot_file.close()
+        header = info_header(version_lines, orig_class_dict, filt_class_dict,
+                             dom_dict, TH_IDENTITY, TH_SIMILARITY, TH_LENGTH,
+                             TH_INTERRUPT, TH_LEN_RATIO, SELECTED_DOM)
+        if compressed:
+            filt_gff.write_header(header)
+            filt_gff.close()
+        else:
+            write_info(filt_gff, header, FILT_DOM_GFF)
+            filt_gff.close()
+    except BaseException:
+        if dom_prot_file:
+            dom_prot_file.close()
+        if compressed:
+            filt_gff.discard()
+        else:
+            filt_gff.close()
+        remove_file(DOMAIN_PROT_SEQ)
+        raise
+
+
+def protein_record(gff_line):
+    ''' Fasta record of the translated protein sequence of original DNA of
+	the domain (parsed gff line). The translated sequence is the consensus of
+	alignments reported by LASTAL (Region_Seq attribute in GFF) '''
+    attributes = gff_line['attributes']
+    positions = attributes['Best_Hit'].split(":")[-1].split("[")[0]
+    prot_seq = attributes['Region_Seq'].translate({ord(i): None
+                                                  for i in '/\\-'})
+    header_prot_seq = ">{}:{} {} {}".format(gff_line['seqid'], positions,
+                                            attributes['Name'],
+                                            attributes['Final_Classification'])
+    return "{}\n{}\n".format(header_prot_seq,
+                              textwrap.fill(prot_seq, configuration.FASTA_LINE))
 
 
 def get_domains_protseq(FILT_DOM_GFF, DOMAIN_PROT_SEQ):
-    ''' Get the translated protein sequence of original DNA seq for all the filtered domains regions 
-		The translated sequences are taken from alignment reported by LASTAL (Query_Seq attribute in GFF)	
-	'''
-    count_comment = check_file_start(FILT_DOM_GFF)
-    with open(FILT_DOM_GFF, "r") as filt_gff:
-        for comment_idx in range(count_comment):
-            next(filt_gff)
-        with open(DOMAIN_PROT_SEQ, "w") as dom_prot_file:
-            for line in filt_gff:
-                attributes = line.rstrip().split("\t")[8]
-                positions = attributes.split(";")[3].split("=")[1].split(":")[
-                    -1].split("[")[0]
-                dom = attributes.split(";")[0].split("=")[1]
-                dom_class = attributes.split(";")[1].split("=")[1]
-                seq_id = line.rstrip().split("\t")[0]
-                prot_seq_align = line.rstrip().split("\t")[8].split(";")[
-                    6].split("=")[1]
-                prot_seq = prot_seq_align.translate({ord(i): None
-                                                     for i in '/\\-'})
-                header_prot_seq = ">{}:{} {} {}".format(seq_id, positions, dom,
-                                                        dom_class)
-                dom_prot_file.write("{}\n{}\n".format(
-                    header_prot_seq, textwrap.fill(prot_seq,
-                                                   configuration.FASTA_LINE)))
+    ''' Get the translated protein sequence of original DNA seq for all the domains
+	regions of already filtered GFF (see protein_record) '''
+    with open(DOMAIN_PROT_SEQ, "w") as dom_prot_file:
+        for line in gff_index.gff_features(FILT_DOM_GFF):
+            dom_prot_file.write(protein_record(parse_gff_line(line)))
 
 
 def main(args):
@@ -221,6 +276,7 @@ def main(args):
     OUTPUT_DIR = args.output_dir
     # DELETE : ELEMENT = args.element_type.replace("_pipe_", "|")
     ELEMENT = args.element_type
+    REGION = args.region
 
     if DOMAIN_PROT_SEQ is None:
         DOMAIN_PROT_SEQ = configuration.DOM_PROT_SEQ
@@ -237,10 +293,9 @@ def main(args):
         DOMAIN_PROT_SEQ = os.path.join(OUTPUT_DIR,
                                        os.path.basename(DOMAIN_PROT_SEQ))
 
-    [xminimals_all, xmaximals_all, domains_all, seq_ids_all] = filter_qual_dom(
-        DOM_GFF, FILT_DOM_GFF, TH_IDENTITY, TH_SIMILARITY, TH_LENGTH,
-        TH_INTERRUPT, TH_LEN_RATIO, SELECTED_DOM, ELEMENT)
-    get_domains_protseq(FILT_DOM_GFF, DOMAIN_PROT_SEQ)
+    filter_qual_dom(DOM_GFF, FILT_DOM_GFF, TH_IDENTITY, TH_SIMILARITY,
+                    TH_LENGTH, TH_INTERRUPT, TH_LEN_RATIO, SELECTED_DOM,
+                    ELEMENT, REGION, DOMAIN_PROT_SEQ)
 
     print("ELAPSED_TIME_DOMAINS = {} s".format(time.time() - t))
 
@@ -298,7 +353,7 @@ if __name__ == "__main__":
     parser.add_argument("-ouf",
                         "--domains_filtered",
                         type=str,
-                        help="output filtered domains gff file")
+                        help="output filtered domains gff file, with .gz suffix compressed by bgzip with the domains sorted by position and indexed by coordinates (.csi)")
     parser.add_argument("-dps",
                         "--domains_prot_seq",
                         type=str,
@@ -351,6 +406,12 @@ if __name__ == "__main__":
         type=str,
         default="",
         help="filter output domains by typing substring from classification")
+    parser.add_argument(
+        "-r",
+        "--region",
+        type=str,
+        default=None,
+        help="filter only domains overlapping the region seqid:start-end (or whole seqid), bgzip compressed gff with .csi index is read only in the blocks of the region")
     parser.add_argument(
         "-dir",
         "--output_dir",
@@ -5,8 +5,10 @@ import time
 import os
 import textwrap
 from collections import defaultdict
-from Bio import SeqIO
+from Bio.Seq import Seq
 import configuration
+import fasta_index
+import gff_index
 from dante_gff_output_filtering import parse_gff_line
 t_nt_seqs_extraction = time.time()
 
@@ -20,94 +22,79 @@ def str2bool(v):
         raise argparse.ArgumentTypeError('Boolean value expected')
 
 
-def check_file_start(gff_file):
-    count_comment = 0
-    with open(gff_file, "r") as gff_all:
-        line = gff_all.readline()
-        while line.startswith("#"):
-            line = gff_all.readline()
-            count_comment += 1
-    return count_comment, line
-
-
-def extract_nt_seqs(DNA_SEQ, DOM_GFF, OUT_DIR, CLASS_TBL, EXTENDED):
+def extract_nt_seqs(DNA_SEQ, DOM_GFF, OUT_DIR, CLASS_TBL, EXTENDED,
+                    REGION=None):
     ''' Extract nucleotide sequences of protein domains found by DANTE from input DNA seq.
 		Sequences are saved in fasta files separately for each transposon lineage.
 		Sequences extraction is based on position of Best_Hit alignment reported by LASTAL.
 		The positions can be extended (optional) based on what part of database domain was aligned
         (Best_Hit_DB_Pos attribute).
-		The strand orientation needs to be considered in extending and extracting the sequence itself
+		The strand orientation needs to be considered in extending and extracting the sequence itself.
+		Only domains overlapping the REGION (seqid:start-end) are extracted if it is given
 	'''
-    [count_comment, first_line] = check_file_start(DOM_GFF)
     unique_classes = get_unique_classes(CLASS_TBL)
     files_dict = defaultdict(str)
     domains_counts_dict = defaultdict(int)
-    allSeqs = SeqIO.to_dict(SeqIO.parse(DNA_SEQ, 'fasta'))
-    with open(DOM_GFF, "r") as domains:
-        for comment_idx in range(count_comment):
-            next(domains)
-        seq_id_stored = first_line.split("\t")[0]
-        allSeqs = SeqIO.to_dict(SeqIO.parse(DNA_SEQ, 'fasta'))
-        seq_nt = allSeqs[seq_id_stored]
-        for line in domains:
-            gff_line = parse_gff_line(line)
-            elem_type = gff_line['attributes']['Final_Classification']
-            if elem_type == configuration.AMBIGUOUS_TAG:
-                continue  # skip ambiguous classification
-            seq_id = gff_line['seqid']
-            dom_type = gff_line['attributes']['Name']
-            strand = gff_line['strand']
-            align_nt_start = int(gff_line['attributes']['Best_Hit'].split(":")[
-                -1].split("-")[0])
-            align_nt_end = int(gff_line['attributes']['Best_Hit'].split(":")[
-                -1].split("-")[1].split("[")[0])
-            if seq_id != seq_id_stored:
-                seq_id_stored = seq_id
-                seq_nt = allSeqs[seq_id_stored]
-            if EXTENDED:
-                ## which part of database sequence was aligned
-                db_part = gff_line['attributes']['Best_Hit_DB_Pos']
-                ## db_part = line.split("\t")[8].split(";")[4].split("=")[1]
-                ## datatabse seq length
-                dom_len = int(db_part.split("of")[1])
-                ## start of alignment on database seq
-                db_start = int(db_part.split("of")[0].split(":")[0])
-                ## end of alignment on database seq
-                db_end = int(db_part.split("of")[0].split(":")[1])
-                ## number of nucleotides missing in the beginning
-                dom_nt_prefix = (db_start - 1) * 3
-                ## number of nucleotides missing in the end
-                dom_nt_suffix = (dom_len - db_end) * 3
-                if strand == "+":
-                    dom_nt_start = align_nt_start - dom_nt_prefix
-                    dom_nt_end = align_nt_end + dom_nt_suffix
-                ## reverse extending for - strand
-                else:
-                    dom_nt_start = align_nt_start - dom_nt_suffix
-                    dom_nt_end = align_nt_end + dom_nt_prefix
-                ## correction for domain after extending having negative starting positon
-                dom_nt_start = max(1, dom_nt_start)
+    ## sequences are not loaded, domains are read directly using the index
+    seqs_index = fasta_index.FastaIndex(DNA_SEQ)
+    for line in gff_index.gff_features(DOM_GFF, REGION):
+        gff_line = parse_gff_line(line)
+        elem_type = gff_line['attributes']['Final_Classification']
+        if elem_type == configuration.AMBIGUOUS_TAG:
+            continue  # skip ambiguous classification
+        seq_id = gff_line['seqid']
+        dom_type = gff_line['attributes']['Name']
+        strand = gff_line['strand']
+        align_nt_start = int(gff_line['attributes']['Best_Hit'].split(":")[
+            -1].split("-")[0])
+        align_nt_end = int(gff_line['attributes']['Best_Hit'].split(":")[
+            -1].split("-")[1].split("[")[0])
+        if EXTENDED:
+            ## which part of database sequence was aligned
+            db_part = gff_line['attributes']['Best_Hit_DB_Pos']
+            ## db_part = line.split("\t")[8].split(";")[4].split("=")[1]
+            ## datatabse seq length
+            dom_len = int(db_part.split("of")[1])
+            ## start of alignment on database seq
+            db_start = int(db_part.split("of")[0].split(":")[0])
+            ## end of alignment on database seq
+            db_end = int(db_part.split("of")[0].split(":")[1])
+            ## number of nucleotides missing in the beginning
+            dom_nt_prefix = (db_start - 1) * 3
+            ## number of nucleotides missing in the end
+            dom_nt_suffix = (dom_len - db_end) * 3
+            if strand == "+":
+                dom_nt_start = align_nt_start - dom_nt_prefix
+                dom_nt_end = align_nt_end + dom_nt_suffix
+            ## reverse extending for - strand
             else:
-                dom_nt_start = align_nt_start
-                dom_nt_end = align_nt_end
-            full_dom_nt = seq_nt.seq[dom_nt_start - 1:dom_nt_end]
-            ## for - strand take reverse complement of the extracted sequence
-            if strand == "-":
-                full_dom_nt = full_dom_nt.reverse_complement()
-            full_dom_nt = str(full_dom_nt)
-            ## report when domain classified to the last level and no Ns in extracted seq
-            if elem_type in unique_classes and "N" not in full_dom_nt:
-                # lineages reported in separate fasta files
-                if not elem_type in files_dict:
-                    files_dict[elem_type] = os.path.join(
-                        OUT_DIR, "{}.fasta".format(elem_type.split("|")[
-                            -1].replace("/", "_")))
-                with open(files_dict[elem_type], "a") as out_nt_seq:
-                    out_nt_seq.write(">{}:{}-{}|{}[{}]\n{}\n".format(
-                        seq_nt.id, dom_nt_start, dom_nt_end, dom_type,
-                        elem_type, textwrap.fill(full_dom_nt,
-                                                 configuration.FASTA_LINE)))
-                domains_counts_dict[elem_type] += 1
+                dom_nt_start = align_nt_start - dom_nt_suffix
+                dom_nt_end = align_nt_end + dom_nt_prefix
+            ## correction for domain after extending having negative starting positon
+            dom_nt_start = max(1, dom_nt_start)
+        else:
+            dom_nt_start = align_nt_start
+            dom_nt_end = align_nt_end
+        full_dom_nt = Seq(seqs_index.fetch(seq_id, dom_nt_start - 1,
+                                           dom_nt_end))
+        ## for - strand take reverse complement of the extracted sequence
+        if strand == "-":
+            full_dom_nt = full_dom_nt.reverse_complement()
+        full_dom_nt = str(full_dom_nt)
+        ## report when domain classified to the last level and no Ns in extracted seq
+        if elem_type in unique_classes and "N" not in full_dom_nt:
+            # lineages reported in separate fasta files
+            if not elem_type in files_dict:
+                files_dict[elem_type] = os.path.join(
+                    OUT_DIR, "{}.fasta".format(elem_type.split("|")[
+                        -1].replace("/", "_")))
+            with open(files_dict[elem_type], "a") as out_nt_seq:
+                out_nt_seq.write(">{}:{}-{}|{}[{}]\n{}\n".format(
+                    seq_id, dom_nt_start, dom_nt_end, dom_type,
+                    elem_type, textwrap.fill(full_dom_nt,
+                                             configuration.FASTA_LINE)))
+            domains_counts_dict[elem_type] += 1
+    seqs_index.close()
     return domains_counts_dict
 
 
@@ -144,12 +131,13 @@ def main(args):
     OUT_DIR = args.out_dir
     CLASS_TBL = args.classification
     EXTENDED = args.extended
+    REGION = args.region
 
     if not os.path.exists(OUT_DIR):
         os.makedirs(OUT_DIR)
 
     domains_counts_dict = extract_nt_seqs(DNA_SEQ, DOM_GFF, OUT_DIR, CLASS_TBL,
-                                          EXTENDED)
+                                          EXTENDED, REGION)
     write_domains_stat(domains_counts_dict, OUT_DIR)
 
     print("ELAPSED_TIME_EXTRACTION = {} s\n".format(time.time() -
@@ -164,12 +152,12 @@ if __name__ == "__main__":
                         '--input_dna',
                         type=str,
                         required=True,
-                        help='path to input DNA sequence')
+                        help='path to input DNA sequence (fasta, can be compressed by gzip or bgzip)')
     parser.add_argument('-d',
                         '--domains_gff',
                         type=str,
                         required=True,
-                        help='GFF file of protein domains')
+                        help='GFF file of protein domains (can be compressed by gzip or bgzip)')
     parser.add_argument('-cs',
                         '--classification',
                         type=str,
@@ -187,5 +175,12 @@ if __name__ == "__main__":
         default=True,
         help=
         'extend the domains edges if not the whole datatabase sequence was aligned')
+    parser.add_argument(
+        '-r',
+        '--region',
+        type=str,
+        default=None,
+        help=
+        'extract only domains overlapping the region seqid:start-end (or whole seqid), bgzip compressed gff with .csi index is read only in the blocks of the region')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+''' DANTE server for many small queries - the classification, scoring matrix
+and version are loaded once and query sequences of concurrent requests are
+searched together by shared LASTAL runs '''
+
+import os
+import sys
+import time
+import queue
+import threading
+import traceback
+import socketserver
+from collections import Counter
+from tempfile import NamedTemporaryFile
+import configuration
+import fasta_index
+import dante
+
+
+def parse_fasta(lines):
+    ''' Return list of (name, sequence) from lines of fasta format, names are
+	the sequence IDs (till the first space) and they must be unique '''
+    sequences = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith(">"):
+            if not line[1:].split():
+                raise ValueError("sequence without ID")
+            sequences.append((line[1:].split()[0], []))
+        elif line:
+            if not sequences:
+                raise ValueError("sequence without fasta header")
+            sequences[-1][1].append(line)
+    if len(sequences) > len(set(name for name, _ in sequences)):
+        raise ValueError("seq IDs (before the first space) are not unique")
+    return [(name, "".join(parts).encode("ascii", "replace"))
+            for name, parts in sequences]
+
+
+def read_requests(stream):
+    ''' Yield lines of the individual requests from the text stream, requests
+	are separated by the end line (or the end of the stream) '''
+    lines = []
+    for line in stream:
+        if line.rstrip("\r\n") == configuration.SERVER_END:
+            yield lines
+            lines = []
+        else:
+            lines.append(line)
+    if any(line.strip() for line in lines):
+        yield lines
+
+
+class Request():
+    '''
+    Query sequences of a single request and the text stream its gff is written
+    to. The gff starts with the usual header, the domains are written as soon
+    as their windows are searched and the response is closed by the end line.
+    Failures are reported by ##ERROR line, the stream is dropped when its
+    reader disconnects
+    '''
+
+    def __init__(self, lines, stream):
+        self.stream = stream
+        self.error = None
+        try:
+            self.sequences = parse_fasta(lines)
+        except ValueError as error:
+            self.sequences = []
+            self.error = "Invalid fasta: {}".format(error)
+        self.merger = None
+        self.done = threading.Event()
+
+    def write(self, text):
+        if self.stream is None:
+            return
+        try:
+            self.stream.write(text)
+        except OSError:
+            self.stream = None
+
+    def writelines(self, lines):
+        self.write("".join(lines))
+
+    def flush(self):
+        if self.stream is None:
+            return
+        try:
+            self.stream.flush()
+        except OSError:
+            self.stream = None
+
+    def start(self, version_string):
+        if self.merger is None:
+            dante.write_info(self, version_string)
+            self.merger = dante.WindowMerger()
+
+    def add(self, window, domains, name, version_string):
+        self.start(version_string)
+        self.writelines([dante.gff3_line(domain, domain.seq_id, 0,
+                                         configuration.SOURCE_DANTE)
+                         for domain in self.merger.add(window, domains, name)])
+        self.flush()
+
+    def finish(self, version_string, error=None):
+        self.start(version_string)
+        error = error or self.error
+        if error:
+            self.write("##ERROR {}\n".format(error))
+        elif not self.merger.windows:
+            self.write("##NO DOMAINS\n")
+        self.write("{}\n".format(configuration.SERVER_END))
+        self.flush()
+        self.done.set()
+
+
+class Annotator():
+    '''
+    Search settings with the classification, scoring matrix and version string
+    loaded only once for all requests
+    '''
+
+    def __init__(self, LAST_DB, CLASSIFICATION, THRESHOLD_SCORE, WIN_DOM,
+                 OVERLAP_DOM, SCORING_MATRIX):
+        self.LAST_DB = LAST_DB
+        self.CLASSIFICATION = CLASSIFICATION
+        self.THRESHOLD_SCORE = THRESHOLD_SCORE
+        self.WIN_DOM = WIN_DOM
+        self.OVERLAP_DOM = OVERLAP_DOM
+        self.SCORING_MATRIX = SCORING_MATRIX
+        configuration.SC_MATRIX = configuration.SC_MATRIX_SKELETON.format(
+            SCORING_MATRIX)
+        dante.load_classification(CLASSIFICATION)
+        dante.alignment_scoring(configuration.SC_MATRIX)
+        self.version_string = dante.get_version(
+            os.path.dirname(os.path.realpath(dante.__file__)), LAST_DB)
+
+    def search(self, batch):
+        ''' Search sequences of all requests of the batch by single LASTAL run,
+	the requests are answered in the batch order '''
+        records = []
+        owners = []
+        with NamedTemporaryFile("wb", suffix=".fasta") as query:
+            ## sequences renamed to avoid collisions of the requests
+            for request in batch:
+                for name, sequence in request.sequences:
+                    header = ">{}\n".format(len(records)).encode("ascii")
+                    records.append(fasta_index.FastaRecord(
+                        str(len(records)), len(sequence),
+                        query.tell() + len(header), len(sequence),
+                        len(sequence) + 1))
+                    owners.append((request, name))
+                    query.write(header + sequence + b"\n")
+            query.flush()
+            windows = dante.query_windows(records, self.WIN_DOM,
+                                          self.WIN_DOM - self.OVERLAP_DOM)
+            pending = Counter(owners[window.record][0] for window in windows)
+            position = 0
+            if windows:
+                searched = dante.search_sequences(
+                    query.name, records, windows, self.LAST_DB,
+                    self.CLASSIFICATION, self.THRESHOLD_SCORE,
+                    self.SCORING_MATRIX)
+            else:
+                searched = []
+            for window, domains in searched:
+                request, name = owners[window.record]
+                ## requests without sequences are finished in their turn
+                while batch[position] is not request:
+                    batch[position].finish(self.version_string)
+                    position += 1
+                request.add(window, domains, name, self.version_string)
+                pending[request] -= 1
+                if not pending[request]:
+                    request.finish(self.version_string)
+                    position += 1
+        ## failure of LASTAL is raised, only requests without
+        ## sequences are left
+        for request in batch[position:]:
+            request.finish(self.version_string)
+
+
+class Dispatcher():
+    '''
+    Queue of the requests searched in batches - the first waiting request
+    is joined by the requests coming within BATCH_DELAY seconds until
+    the batch has BATCH_SIZE bases
+    '''
+
+    def __init__(self, annotator, BATCH_DELAY, BATCH_SIZE):
+        self.annotator = annotator
+        self.BATCH_DELAY = BATCH_DELAY
+        self.BATCH_SIZE = BATCH_SIZE
+        self.requests = queue.Queue()
+
+    def submit(self, request):
+        self.requests.put(request)
+
+    def stop(self):
+        self.requests.put(None)
+
+    def batches(self):
+        ''' Yield the batches until the dispatcher is stopped '''
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            size = sum(len(sequence) for _, sequence in request.sequences)
+            deadline = time.monotonic() + self.BATCH_DELAY
+            while size < self.BATCH_SIZE:
+                try:
+                    request = self.requests.get(
+                        timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    yield batch
+                    return
+                batch.append(request)
+                size += sum(len(sequence) for _, sequence in request.sequences)
+            yield batch
+
+    def run(self):
+        for batch in self.batches():
+            try:
+                self.annotator.search(batch)
+            except Exception as error:
+                traceback.print_exc()
+                for request in batch:
+                    if not request.done.is_set():
+                        request.finish(self.annotator.version_string,
+                                       "Search failed: {}".format(error))
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    ''' Requests of a connection are answered in the order of their arrival '''
+
+    def handle(self):
+        stream = self.connection.makefile("w", encoding="utf-8")
+        requests = []
+        for lines in read_requests(self.connection.makefile(
+                "r", encoding="utf-8", errors="replace")):
+            requests.append(Request(lines, stream))
+            self.server.dispatcher.submit(requests[-1])
+        for request in requests:
+            request.done.wait()
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+class DanteServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_stdin(dispatcher):
+    ''' Requests are read from stdin and answered to stdout '''
+    reader = threading.Thread(target=submit_stdin, args=(dispatcher, ))
+    reader.daemon = True
+    reader.start()
+    dispatcher.run()
+
+
+def submit_stdin(dispatcher):
+    for lines in read_requests(sys.stdin):
+        dispatcher.submit(Request(lines, sys.stdout))
+    dispatcher.stop()
+
+
+def serve_socket(dispatcher, SOCKET):
+    ''' Requests are accepted at the unix socket until the server is interrupted '''
+    if os.path.exists(SOCKET):
+        os.remove(SOCKET)
+    server = DanteServer(SOCKET, RequestHandler)
+    server.dispatcher = dispatcher
+    listener = threading.Thread(target=server.serve_forever)
+    listener.daemon = True
+    listener.start()
+    try:
+        dispatcher.run()
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(SOCKET)
+
+
+def main(args):
+    LAST_DB = args.protein_database
+    CLASSIFICATION = args.classification
+    if os.path.isdir(LAST_DB):
+        LAST_DB = os.path.join(LAST_DB, configuration.LAST_DB_FILE)
+    if os.path.isdir(CLASSIFICATION):
+        CLASSIFICATION = os.path.join(CLASSIFICATION, configuration.CLASS_FILE)
+    annotator = Annotator(LAST_DB, CLASSIFICATION, args.threshold_score,
+                          args.win_dom, args.overlap_dom, args.scoring_matrix)
+    dispatcher = Dispatcher(annotator, args.batch_delay / 1000,
+                            args.batch_size)
+    if args.socket:
+        try:
+            serve_socket(dispatcher, args.socket)
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve_stdin(dispatcher)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=
+        '''Server searching protein domains in many small queries (contigs, reads) with dante.py settings loaded only once. A request is a (multi)fasta followed by a line "//" (or the end of the input), the response is the domains gff followed by the same line. Requests are read from stdin and answered to stdout, or accepted at a unix socket (one or more requests per connection answered in their order). Requests coming within the batch delay are searched by a single LASTAL run.
+
+	LIMITATION: LASTAL is started for every batch - it processes the queries in large batches of its own and its output is complete only at the end of its input, so one LASTAL process cannot answer a sequence of requests. Its start-up is shared by the requests of the batch, the database files stay in the system cache between the runs.
+
+	EXAMPLE OF USAGE:
+
+		./dante_server.py -pdb PATH_TO_PROTEIN_DB -cs PATH_TO_CLASSIFICATION_FILE -s dante.sock
+		socat - UNIX-CONNECT:dante.sock < contig.fasta
+		''',
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    requiredNamed = parser.add_argument_group('required named arguments')
+    requiredNamed.add_argument('-pdb',
+                               "--protein_database",
+                               type=str,
+                               required=True,
+                               help='protein domains database file')
+    requiredNamed.add_argument('-cs',
+                               '--classification',
+                               type=str,
+                               required=True,
+                               help='protein domains classification file')
+    parser.add_argument("-s",
+                        "--socket",
+                        type=str,
+                        help="unix socket to accept the requests at, stdin is read if not set")
+    parser.add_argument(
+        "-M",
+        "--scoring_matrix",
+        type=str,
+        default="BL80",
+        choices=['BL80', 'BL62', 'MIQS'],
+        help="specify scoring matrix to use for similarity search (BL80, BL62, MIQS)")
+    parser.add_argument(
+        "-thsc",
+        "--threshold_score",
+        type=int,
+        default=80,
+        help=
+        "percentage of the best score in the cluster to be tolerated when assigning annotations per base")
+    parser.add_argument(
+        "-wd",
+        "--win_dom",
+        type=int,
+        default=10000000,
+        help="window to process large input sequences sequentially")
+    parser.add_argument("-od",
+                        "--overlap_dom",
+                        type=int,
+                        default=10000,
+                        help="overlap of sequences in two consecutive windows")
+    parser.add_argument(
+        "--batch_delay",
+        type=float,
+        default=configuration.SERVER_BATCH_DELAY,
+        help="time in ms to wait for other requests to be searched together")
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=configuration.SERVER_BATCH_SIZE,
+        help="maximal number of bases of the requests searched together")
+    main(parser.parse_args())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+''' Columnar binary table of the domains written next to the domains GFF -
+raw column files readable by memory mapping (numpy.memmap) described by JSON
+metadata. Names and classifications are dictionary encoded, the alignment
+sequences are kept in string heaps with offsets of the rows '''
+import os
+import json
+from array import array
+import numpy as np
+import configuration
+import bgzf
+
+## numeric columns (GFF attribute names) and the Domain field of their value,
+## quality columns of ambiguous domains are not defined (NaN) as in the GFF
+INT_COLUMNS = [("start", "start"), ("end", "end")]
+FLOAT_COLUMNS = [("score", "score"), ("Identity", "identity"),
+                 ("Similarity", "similarity"), ("Relat_Length", "relat_length"),
+                 ("Relat_Interruptions", "relat_interruptions"),
+                 ("Hit_to_DB_Length", "hit_to_db_length")]
+DICTIONARY_COLUMNS = ["seqid", "strand", "Name", "Final_Classification"]
+STRING_COLUMNS = [("DB_Seq", "db_seq"), ("Region_Seq", "region_seq"),
+                  ("Query_Seq", "query_seq")]
+## array typecodes of the column types and the dtypes saved in metadata
+INT_TYPE = ("q", np.dtype("=i8").str)
+FLOAT_TYPE = ("d", np.dtype("=f8").str)
+CODE_TYPE = ("i", np.dtype("=i4").str)
+OFFSET_TYPE = ("Q", np.dtype("=u8").str)
+
+
+def table_path(gff):
+    ''' Directory of the table saved next to the GFF '''
+    return "{}{}".format(gff, configuration.TABLE_SUFFIX)
+
+
+def gff_table(gff):
+    ''' Table saved next to the plain GFF (its rows follow the features of
+	the GFF), None if there is no complete table as new as the GFF '''
+    meta = os.path.join(table_path(gff), configuration.TABLE_META)
+    if (bgzf.is_gzip(gff) or not os.path.exists(meta) or
+            os.path.getmtime(meta) < os.path.getmtime(gff)):
+        return None
+    try:
+        return DomainTable(table_path(gff))
+    except (OSError, ValueError):
+        return None
+
+
+class DomainTableWriter():
+    '''
+    Domains (SequenceDomain) appended as rows of the table, the columns are
+    written to their files by TABLE_CHUNK rows. Metadata are saved on close,
+    the table without them is not complete
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.rows = 0
+        self.columns = {}
+        self.files = {}
+        self.dictionaries = {name: {} for name in DICTIONARY_COLUMNS}
+        self.heap_sizes = {}
+        for name, _ in INT_COLUMNS:
+            self.add_column(name, INT_TYPE)
+        for name, _ in FLOAT_COLUMNS:
+            self.add_column(name, FLOAT_TYPE)
+        for name in DICTIONARY_COLUMNS:
+            self.add_column(name, CODE_TYPE)
+        for name, _ in STRING_COLUMNS:
+            self.add_column(name, OFFSET_TYPE)
+            self.columns[name].append(0)
+            self.files["{}_heap".format(name)] = open(
+                os.path.join(path, "{}.heap".format(name)), "wb")
+            self.heap_sizes[name] = 0
+
+    def add_column(self, name, column_type):
+        self.columns[name] = array(column_type[0])
+        self.files[name] = open(os.path.join(self.path, "{}.bin".format(name)),
+                                "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, domain):
+        ambiguous = "/" in domain.name
+        for name, field in INT_COLUMNS:
+            self.columns[name].append(int(getattr(domain, field)))
+        for name, field in FLOAT_COLUMNS:
+            self.columns[name].append(
+                np.nan if ambiguous else float(getattr(domain, field)))
+        for name, value in zip(DICTIONARY_COLUMNS, [
+                domain.seq_id, domain.strand, domain.name,
+                configuration.AMBIGUOUS_TAG if ambiguous else
+                domain.classification]):
+            codes = self.dictionaries[name]
+            self.columns[name].append(codes.setdefault(value, len(codes)))
+        for name, field in STRING_COLUMNS:
+            data = b"" if ambiguous else getattr(domain, field).encode("utf-8")
+            self.files["{}_heap".format(name)].write(data)
+            self.heap_sizes[name] += len(data)
+            self.columns[name].append(self.heap_sizes[name])
+        self.rows += 1
+        if self.rows % configuration.TABLE_CHUNK == 0:
+            self.flush()
+
+    def flush(self):
+        for name, column in self.columns.items():
+            column.tofile(self.files[name])
+            del column[:]
+
+    def close(self):
+        if not self.files:
+            return
+        self.flush()
+        for table_file in self.files.values():
+            table_file.close()
+        self.files = {}
+        columns = {}
+        for name, _ in INT_COLUMNS:
+            columns[name] = {"type": "numeric", "dtype": INT_TYPE[1]}
+        for name, _ in FLOAT_COLUMNS:
+            columns[name] = {"type": "numeric", "dtype": FLOAT_TYPE[1]}
+        for name in DICTIONARY_COLUMNS:
+            columns[name] = {"type": "dictionary",
+                             "dtype": CODE_TYPE[1],
+                             "dictionary": list(self.dictionaries[name])}
+        for name, _ in STRING_COLUMNS:
+            columns[name] = {"type": "string", "dtype": OFFSET_TYPE[1],
+                             "heap": "{}.heap".format(name)}
+        for name, column in columns.items():
+            column["file"] = "{}.bin".format(name)
+        with open(os.path.join(self.path, configuration.TABLE_META),
+                  "w") as meta_file:
+            json.dump({"format": configuration.TABLE_FORMAT,
+                       "rows": self.rows,
+                       "columns": columns}, meta_file, indent=2)
+            meta_file.write("\n")
+
+
+class DomainTable():
+    '''
+    Table of domains read by memory mapping of the column files. Numeric
+    columns are numpy arrays, dictionary columns arrays of codes to the
+    dictionary and string columns offsets of the rows in the heap (one
+    more than rows)
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, configuration.TABLE_META)) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("format") != configuration.TABLE_FORMAT:
+            raise ValueError("{} is not a domains table".format(path))
+        self.rows = meta["rows"]
+        self.meta = meta["columns"]
+        self.mapped = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def map_file(self, file_name, dtype, length):
+        if not length:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.path, file_name), dtype=dtype,
+                         mode="r", shape=(length, ))
+
+    def column(self, name):
+        ''' Values of numeric column, codes of dictionary column or offsets
+	of string column '''
+        if name not in self.mapped:
+            column = self.meta[name]
+            length = self.rows + (column["type"] == "string")
+            self.mapped[name] = self.map_file(column["file"], column["dtype"],
+                                              length)
+        return self.mapped[name]
+
+    def dictionary(self, name):
+        return self.meta[name]["dictionary"]
+
+    def code(self, name, value):
+        ''' Code of the value in dictionary column, -1 if it is not present '''
+        dictionary = self.dictionary(name)
+        return dictionary.index(value) if value in dictionary else -1
+
+    def values(self, name):
+        ''' Decoded values of dictionary column '''
+        return np.array(self.dictionary(name), dtype=object)[self.column(name)]
+
+    def heap(self, name):
+        heap_name = "{}_heap".format(name)
+        if heap_name not in self.mapped:
+            offsets = self.column(name)
+            self.mapped[heap_name] = self.map_file(self.meta[name]["heap"],
+                                                   np.uint8, int(offsets[-1]))
+        return self.mapped[heap_name]
+
+    def string(self, name, row):
+        ''' Value of string column in the row '''
+        offsets = self.column(name)
+        return self.heap(name)[offsets[row]:offsets[row + 1]].tobytes().decode(
+            "utf-8")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+''' FASTA index (samtools .fai compatible) for random access to sequences,
+the fasta can be compressed by gzip or bgzip '''
+import io
+import os
+import gzip
+import mmap
+from collections import namedtuple
+from tempfile import NamedTemporaryFile
+import bgzf
+
+FAI_SUFFIX = ".fai"
+
+## FASTA index like description of a sequence: name, length, byte offset of
+## the sequence start, number of bases per line and bytes per line (zeros if
+## the lines of the sequence are not of the same length)
+FastaRecord = namedtuple("FastaRecord", ["name", "length", "offset",
+                                         "line_bases", "line_width"])
+
+
+def scan_fasta(fasta):
+    ''' Read the whole fasta file to find the sequences, their lengths,
+	starts (byte offsets) and line lengths, return list of FastaRecords.
+	Compressed file is decompressed as a stream, the offsets are positions
+	in the decompressed file (as in samtools index of bgzip file) '''
+    records = []
+    with open_stream(fasta) as fasta_file:
+        offset = 0
+        name = None
+        for line in fasta_file:
+            offset += len(line)
+            if line.startswith(b">"):
+                if name is not None:
+                    records.append(fasta_record(name, seq_offset, line_lens))
+                name = line[1:].decode("utf-8").split()[0]
+                seq_offset = offset
+                line_lens = []
+            elif name is not None:
+                line_lens.append((len(line.rstrip()), len(line)))
+        if name is not None:
+            records.append(fasta_record(name, seq_offset, line_lens))
+    return records
+
+
+def open_stream(fasta):
+    ''' Open the fasta file for sequential reading (bytes) '''
+    if bgzf.is_gzip(fasta):
+        return gzip.open(fasta, "rb")
+    return open(fasta, "rb")
+
+
+def open_fasta(fasta):
+    ''' Return content of the fasta file sliced as bytes - memory map of
+	plain file, decompressed blocks of bgzip file or decompressed stream of
+	gzip file (to be read in one direction) '''
+    if bgzf.is_gzip(fasta):
+        return bgzf.open_gzip(fasta)
+    if not os.path.getsize(fasta):
+        ## empty file can not be mapped, there is nothing to read
+        return io.BytesIO()
+    with open(fasta, "rb") as fasta_file:
+        return mmap.mmap(fasta_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def fasta_record(name, offset, line_lens):
+    ''' Create FastaRecord from lengths (bases, bytes) of the sequence lines '''
+    length = sum(line_bases for line_bases, _ in line_lens)
+    if line_lens and len(set(line_lens[:-1])) <= 1 and (
+            line_lens[-1][0] <= line_lens[0][0]):
+        line_bases, line_width = line_lens[0]
+    else:
+        line_bases, line_width = 0, 0
+    return FastaRecord(name, length, offset, line_bases, line_width)
+
+
+def read_fai(fai):
+    ''' Load FastaRecords from the index file '''
+    records = []
+    with open(fai, "r") as fai_file:
+        for line in fai_file:
+            fields = line.rstrip("\n").split("\t")
+            records.append(FastaRecord(fields[0], *[int(value)
+                                                    for value in fields[1:5]]))
+    return records
+
+
+def write_fai(fai, records):
+    ''' Save the index, it is skipped if the directory is not writable or
+	some sequence does not have lines of the same length (not allowed in .fai) '''
+    if any(record.line_bases == 0 and record.length for record in records):
+        return
+    try:
+        with NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(fai)),
+                                delete=False) as fai_file:
+            for record in records:
+                fai_file.write("{}\n".format("\t".join(map(str, record))))
+        os.chmod(fai_file.name, 0o644)
+        os.replace(fai_file.name, fai)
+    except OSError:
+        pass
+
+
+def load_index(fasta):
+    ''' Return FastaRecords of the fasta file, the index file is built only
+	once and reused while it is newer than the fasta file '''
+    fai = "{}{}".format(fasta, FAI_SUFFIX)
+    if os.path.exists(fai) and os.path.getmtime(fai) >= os.path.getmtime(
+            fasta):
+        try:
+            return read_fai(fai)
+        except (ValueError, IndexError):
+            pass
+    records = scan_fasta(fasta)
+    write_fai(fai, records)
+    return records
+
+
+def record_subsequences(fasta, record, spans):
+    ''' Yield subsequences (bytes) of a record for the sorted (start, end)
+	spans. Byte positions are computed directly when all lines have the same
+	length, otherwise the lines are read sequentially keeping at most one
+	span in memory '''
+    if record.line_bases:
+        for start, end in spans:
+            if start == end:
+                yield b""
+                continue
+            first = record.offset + (start // record.line_bases) * \
+                record.line_width + start % record.line_bases
+            last = record.offset + ((end - 1) // record.line_bases) * \
+                record.line_width + (end - 1) % record.line_bases
+            yield fasta[first:last + 1].translate(None, b"\r\n")
+        return
+    spans = iter(spans)
+    span = next(spans, None)
+    buffer = bytearray()
+    buffer_start = 0
+    position = record.offset
+    while span is not None:
+        while span is not None and buffer_start + len(buffer) >= span[1]:
+            yield bytes(buffer[span[0] - buffer_start:span[1] - buffer_start])
+            span = next(spans, None)
+        if span is None:
+            break
+        ## drop the part of sequence before the next span
+        drop = max(0, min(span[0] - buffer_start, len(buffer)))
+        del buffer[:drop]
+        buffer_start += drop
+        line_end = fasta.find(b"\n", position)
+        if line_end == -1:
+            line_end = len(fasta)
+        line = fasta[position:line_end + 1]
+        position = line_end + 1
+        if not line or line.startswith(b">"):
+            break
+        line = line.rstrip()
+        if not buffer:
+            skip = max(0, min(span[0] - buffer_start, len(line)))
+            line = line[skip:]
+            buffer_start += skip
+        buffer += line
+    while span is not None:
+        yield bytes(buffer[span[0] - buffer_start:span[1] - buffer_start])
+        span = next(spans, None)
+
+
+class FastaIndex():
+    '''
+    Random access to the sequences of indexed fasta file, plain gzip file
+    is read efficiently only in the order of the sequences
+    '''
+
+    def __init__(self, fasta):
+        self.records = {record.name: record for record in load_index(fasta)}
+        self.fasta = open_fasta(fasta)
+
+    def fetch(self, name, start=0, end=None):
+        ''' Return subsequence (0-based, end excluded) of the sequence,
+		positions beyond the sequence are clipped as in string slicing '''
+        record = self.records[name]
+        end = record.length if end is None else min(end, record.length)
+        start = min(max(start, 0), end)
+        return next(record_subsequences(self.fasta, record, [(start, end)
+                                                             ])).decode("ascii")
+
+    def close(self):
+        self.fasta.close()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+''' GFF3 compressed by BGZF (bgzip) with coordinate index (tabix compatible
+.csi file) for reading only the features of a region '''
+import os
+import gzip
+import mmap
+import struct
+from array import array
+from tempfile import TemporaryFile
+import bgzf
+
+GZ_SUFFIX = ".gz"
+CSI_SUFFIX = ".csi"
+## size of the smallest bins (2^14 bases) and the number of levels, more
+## levels are used for longer sequences (every level covers 8 times more)
+CSI_MIN_SHIFT = 14
+CSI_DEPTH = 5
+## tabix settings for GFF: generic format, columns of seqid, start and end,
+## comment lines and skipped lines at the start
+TABIX_GFF = (0, 1, 4, 5, ord("#"), 0)
+
+
+def is_compressed(path):
+    return path.endswith(GZ_SUFFIX)
+
+
+def reg2bin(beg, end, min_shift, depth):
+    ''' Bin of the smallest level containing the whole region
+	(0-based, end excluded) '''
+    end -= 1
+    shift = min_shift
+    first = ((1 << depth * 3) - 1) // 7
+    for level in range(depth, 0, -1):
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+        shift += 3
+        first -= 1 << (level - 1) * 3
+    return 0
+
+
+def reg2bins(beg, end, min_shift, depth):
+    ''' All bins which can contain features overlapping the region '''
+    end = min(end, 1 << (min_shift + depth * 3)) - 1
+    bins = []
+    shift = min_shift + depth * 3
+    first = 0
+    for level in range(depth + 1):
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        shift -= 3
+        first += 1 << level * 3
+    return bins
+
+
+def bin_start(bin_id, min_shift, depth):
+    ''' Start position of the region of the bin '''
+    first = 0
+    for level in range(depth + 1):
+        if bin_id < first + (1 << level * 3):
+            return (bin_id - first) << (min_shift + 3 * (depth - level))
+        first += 1 << level * 3
+
+
+class SequenceIndex():
+    ''' Chunks (virtual offsets of the start and end) of the features of
+	a sequence in bins and the first offset in every window of the smallest
+	bin size '''
+
+    def __init__(self):
+        self.bins = {}
+        self.linear = []
+
+    def add(self, beg, end, start_offset, end_offset, min_shift, depth):
+        chunks = self.bins.setdefault(reg2bin(beg, end, min_shift, depth), [])
+        if chunks and chunks[-1][1] == start_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+        last_window = (end - 1) >> min_shift
+        if len(self.linear) <= last_window:
+            self.linear.extend([None] * (last_window + 1 - len(self.linear)))
+        for window in range(beg >> min_shift, last_window + 1):
+            if self.linear[window] is None:
+                self.linear[window] = start_offset
+
+
+class GffWriter():
+    '''
+    GFF3 written to BGZF file with features sorted by the start within
+    every sequence and indexed by coordinates (.csi next to the file).
+    Features can come in any order of the sequences, they are spilled to
+    a temporary file and only their positions are kept in memory until close,
+    the sequences are written in the order of their first feature. Comment
+    lines before the first feature (and lines of write_header) are written
+    as the header, later comment lines at the end of the file. If the writing
+    ends by an exception, the partial output is removed
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = bgzf.BgzfWriter(path)
+        self.spill = TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self.spill_size = 0
+        self.pending = ""
+        ## start, end, offset and length in the spill file of the features
+        ## of every sequence
+        self.features = {}
+        self.header = []
+        self.comments = []
+        self.started = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, text):
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.add_line(line + "\n")
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def write_header(self, text):
+        ''' Add comment lines to the header, also after some features '''
+        self.header.extend(text.splitlines(True))
+
+    def add_line(self, line):
+        if line.startswith("#"):
+            (self.comments if self.started else self.header).append(line)
+            return
+        if not line.strip():
+            return
+        self.started = True
+        fields = line.split("\t", 5)
+        data = line.encode("utf-8")
+        self.features.setdefault(fields[0], array("q")).extend(
+            (int(fields[3]), int(fields[4]), self.spill_size, len(data)))
+        self.spill.write(data)
+        self.spill_size += len(data)
+
+    def write_sequence(self, features, lines):
+        ''' Write the features of a sequence sorted by start, return
+	the index of the sequence and its length '''
+        features = sorted(zip(features[::4], features[1::4], features[2::4],
+                              features[3::4]),
+                          key=lambda feature: feature[0])
+        length = max(end for _, end, _, _ in features)
+        depth = self.depth(length)
+        index = SequenceIndex()
+        for start, end, offset, size in features:
+            start_offset = self.file.tell()
+            self.file.write(lines[offset:offset + size])
+            ## GFF coordinates are 1-based, end included
+            index.add(start - 1, max(end, start), start_offset,
+                      self.file.tell(), CSI_MIN_SHIFT, depth)
+        return index, length
+
+    @staticmethod
+    def depth(end):
+        depth = CSI_DEPTH
+        while end >= 1 << (CSI_MIN_SHIFT + 3 * depth):
+            depth += 1
+        return depth
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.pending:
+            self.add_line(self.pending + "\n")
+        self.spill.flush()
+        for line in self.header:
+            self.file.write(line.encode("utf-8"))
+        indices = []
+        if self.spill_size:
+            with mmap.mmap(self.spill.fileno(), 0,
+                           access=mmap.ACCESS_READ) as lines:
+                for features in self.features.values():
+                    indices.append(self.write_sequence(features, lines))
+        for line in self.comments:
+            self.file.write(line.encode("utf-8"))
+        self.file.close()
+        self.file = None
+        self.spill.close()
+        write_csi("{}{}".format(self.path, CSI_SUFFIX), list(self.features),
+                  indices)
+
+    def discard(self):
+        ''' Remove the partial output, no index is written '''
+        if self.file is None:
+            return
+        self.file.discard()
+        self.file = None
+        self.spill.close()
+        csi = "{}{}".format(self.path, CSI_SUFFIX)
+        if os.path.exists(csi):
+            os.remove(csi)
+
+
+def write_csi(csi, names, indices):
+    ''' Save the coordinate index in CSI format (BGZF compressed), the depth
+	of the binning covers the longest sequence '''
+    depth = max([GffWriter.depth(length) for _, length in indices] +
+                [CSI_DEPTH])
+    ## features are indexed with the depth of their sequence, the bins are
+    ## converted to the common depth
+    names_data = b"".join(name.encode("utf-8") + b"\0" for name in names)
+    aux = struct.pack("<7i", *TABIX_GFF, len(names_data)) + names_data
+    with bgzf.BgzfWriter(csi) as csi_file:
+        csi_file.write(b"CSI\1" + struct.pack("<3i", CSI_MIN_SHIFT, depth,
+                                              len(aux)) + aux)
+        csi_file.write(struct.pack("<i", len(names)))
+        for index, length in indices:
+            bins = convert_bins(index.bins, GffWriter.depth(length), depth)
+            linear = index.linear
+            ## windows without features get the offset of the next feature
+            next_offset = 0
+            for window in range(len(linear) - 1, -1, -1):
+                if linear[window] is None:
+                    linear[window] = next_offset
+                else:
+                    next_offset = linear[window]
+            csi_file.write(struct.pack("<i", len(bins)))
+            for bin_id in sorted(bins):
+                window = bin_start(bin_id, CSI_MIN_SHIFT,
+                                   depth) >> CSI_MIN_SHIFT
+                chunks = bins[bin_id]
+                csi_file.write(struct.pack(
+                    "<IQi", bin_id, linear[window] if window < len(linear)
+                    else chunks[0][0], len(chunks)))
+                for chunk in chunks:
+                    csi_file.write(struct.pack("<QQ", *chunk))
+        csi_file.write(struct.pack("<Q", 0))
+
+
+def convert_bins(bins, depth, new_depth):
+    ''' Bins of the depth numbered as bins of deeper binning (the levels
+	are shifted down, the regions of the bins are the same) '''
+    if depth == new_depth:
+        return bins
+    converted = {}
+    for bin_id, chunks in bins.items():
+        first = 0
+        for level in range(depth + 1):
+            if bin_id < first + (1 << level * 3):
+                break
+            first += 1 << level * 3
+        new_level = level + new_depth - depth
+        new_first = ((1 << new_level * 3) - 1) // 7
+        converted[new_first + bin_id - first] = chunks
+    return converted
+
+
+def read_csi(csi):
+    ''' Load the coordinate index - (min_shift, depth, sequence names,
+	list of bins {bin: (loffset, chunks)} of every sequence) '''
+    with gzip.open(csi, "rb") as csi_file:
+        data = csi_file.read()
+    if data[:4] != b"CSI\1":
+        raise ValueError("{} is not CSI index".format(csi))
+    min_shift, depth, aux_len = struct.unpack("<3i", data[4:16])
+    names_len, = struct.unpack("<i", data[40:44])
+    names = [name.decode("utf-8")
+             for name in data[44:44 + names_len].split(b"\0")[:-1]]
+    position = 16 + aux_len
+    count, = struct.unpack("<i", data[position:position + 4])
+    position += 4
+    sequences = []
+    for _ in range(count):
+        bins = {}
+        bins_count, = struct.unpack("<i", data[position:position + 4])
+        position += 4
+        for _ in range(bins_count):
+            bin_id, loffset, chunks_count = struct.unpack(
+                "<IQi", data[position:position + 16])
+            position += 16
+            chunks = struct.unpack("<{}Q".format(2 * chunks_count),
+                                   data[position:position + 16 * chunks_count])
+            position += 16 * chunks_count
+            bins[bin_id] = (loffset, list(zip(chunks[::2], chunks[1::2])))
+        sequences.append(bins)
+    return min_shift, depth, names, sequences
+
+
+def parse_region(region):
+    ''' Return (seqid, start, end) of region given as seqid:start-end
+	(1-based, end included) or seqid only (end is None) '''
+    seq_id, _, span = region.rpartition(":")
+    if seq_id and "-" in span:
+        start, end = span.replace(",", "").split("-")
+        return seq_id, max(1, int(start)), int(end)
+    return region, 1, None
+
+
+def open_gff(path, mode="r"):
+    ''' Open the GFF for writing (BGZF with index if the path ends with .gz)
+	or reading as text '''
+    if mode == "w":
+        return GffWriter(path) if is_compressed(path) else open(path, "w")
+    if bgzf.is_gzip(path):
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+
+def gff_header(path):
+    ''' Return the comment lines at the start of the GFF '''
+    lines = []
+    with open_gff(path) as gff:
+        for line in gff:
+            if not line.startswith("#"):
+                break
+            lines.append(line)
+    return lines
+
+
+def gff_features(path, region=None):
+    ''' Yield the feature lines of the GFF, only features overlapping the
+	region if given. Indexed BGZF file is read only in the blocks of
+	the region, other files are read whole '''
+    if region is None:
+        with open_gff(path) as gff:
+            for line in gff:
+                if line.strip() and not line.startswith("#"):
+                    yield line
+        return
+    seq_id, start, end = parse_region(region)
+    csi = "{}{}".format(path, CSI_SUFFIX)
+    if os.path.exists(csi) and bgzf.is_bgzf(path):
+        lines = indexed_lines(path, csi, seq_id, start, end)
+    else:
+        lines = gff_features(path)
+    for line in lines:
+        fields = line.split("\t", 5)
+        if fields[0] == seq_id and int(fields[4]) >= start and (
+                end is None or int(fields[3]) <= end):
+            yield line
+
+
+def indexed_lines(path, csi, seq_id, start, end):
+    ''' Yield lines of the chunks of the bins overlapping the region '''
+    min_shift, depth, names, sequences = read_csi(csi)
+    if seq_id not in names:
+        return
+    bins = sequences[names.index(seq_id)]
+    beg = start - 1
+    if end is None:
+        end = 1 << (min_shift + 3 * depth)
+    ## chunks ending before the first feature overlapping the region start
+    ## are skipped (the offset is given by the smallest bin found)
+    min_offset = 0
+    for bin_id in reversed(reg2bins(beg, beg + 1, min_shift, depth)):
+        if bin_id in bins:
+            min_offset = bins[bin_id][0]
+            break
+    chunks = sorted(chunk for bin_id in reg2bins(beg, end, min_shift, depth)
+                    if bin_id in bins for chunk in bins[bin_id][1]
+                    if chunk[1] > min_offset)
+    merged = []
+    for chunk_start, chunk_end in chunks:
+        if merged and chunk_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], chunk_end)
+        else:
+            merged.append([chunk_start, chunk_end])
+    with bgzf.BgzfReader(path) as gff:
+        for chunk_start, chunk_end in merged:
+            data = gff[gff.position(chunk_start):gff.position(chunk_end)]
+            for line in data.decode("utf-8").splitlines(True):
+                yield line
@@ -23,3 +23,13 @@ $DIR/dante.py -q ${TEXT_DATA}/vyber-Ty1_01.fasta -pdb $pdb -cs $classification_t
 $DIR/dante_gff_output_filtering.py --dom_gff $PWD/tmp/single_fasta.gff3 \
                                    --domains_filtered $PWD/tmp/single_fasta_filtered.gff3 \
 
+# compressed and indexed filtered output, filtering of a region of it
+$DIR/dante_gff_output_filtering.py --dom_gff $PWD/tmp/multifasta.gff3 \
+                                   --domains_filtered $PWD/tmp/multifasta_filtered.gff3.gz
+gzip -t $PWD/tmp/multifasta_filtered.gff3.gz
+$DIR/dante_gff_output_filtering.py --dom_gff $PWD/tmp/multifasta_filtered.gff3.gz \
+                                   --domains_filtered $PWD/tmp/multifasta_region.gff3 \
+                                   --region Acoerulea195_58_rc:1-3000
+
+# unit tests of the modules
+python3 -m pytest -q $DIR/tests
@@ -0,0 +1,40 @@
+import os
+import sys
+import pytest
+
+## the modules of the tools are in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import configuration
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+WIN_DOM = 5000
+OVERLAP_DOM = 1200
+
+
+@pytest.fixture(scope="session")
+def recorded_genome(tmp_path_factory):
+    ''' Synthetic genome and LASTAL output of its windows for the replay '''
+    bench_dir = tmp_path_factory.mktemp("recorded")
+    genome = str(bench_dir / configuration.BENCH_GENOME)
+    recording = str(bench_dir / configuration.BENCH_RECORDING)
+    benchmark.generate_genome(genome, 3, 16000, 0)
+    benchmark.generate_hits(genome, recording, 2, 4, 0, WIN_DOM, OVERLAP_DOM,
+                            CLASSIFICATION)
+    return genome, recording
+
+
+@pytest.fixture
+def replay_lastal(recorded_genome, monkeypatch):
+    ''' LASTAL replaced by the replay of the recorded output of the windows
+	sent to it, return the genome '''
+    genome, recording = recorded_genome
+    monkeypatch.setattr(
+        configuration, "LASTAL_COMMAND",
+        '"{}" "{}" replay "{}" # {{}} {{}}'.format(
+            sys.executable, os.path.abspath(benchmark.__file__), recording))
+    ## the search sets the scoring matrix of the process
+    monkeypatch.setattr(configuration, "SC_MATRIX", None, raising=False)
+    return genome
@@ -0,0 +1,131 @@
+''' Slicing and searching of decompressed BGZF and plain gzip files must
+match the uncompressed data, also over the boundaries of the blocks '''
+import gzip
+import random
+import pytest
+import bgzf
+import fasta_index
+
+## sizes of the blocks of the test file, the last ones are full blocks
+BLOCK_SIZES = [1, 2, 100, 7000, 1, 30000, bgzf.BLOCK_SIZE, bgzf.BLOCK_SIZE]
+
+
+@pytest.fixture(scope="module")
+def data():
+    rnd = random.Random(0)
+    return "".join(rnd.choice("ACGTN\n") for _ in range(sum(BLOCK_SIZES) +
+                                                         5000)).encode("ascii")
+
+
+@pytest.fixture(scope="module")
+def bgzf_path(tmp_path_factory, data):
+    path = str(tmp_path_factory.mktemp("bgzf") / "data.bgz")
+    with bgzf.BgzfWriter(path) as writer:
+        position = 0
+        for size in BLOCK_SIZES:
+            writer.write_block(data[position:position + size])
+            position += size
+        writer.write(data[position:])
+    return path
+
+
+@pytest.fixture(scope="module")
+def gzip_path(tmp_path_factory, data):
+    path = str(tmp_path_factory.mktemp("gzip") / "data.gz")
+    with gzip.open(path, "wb") as gzip_file:
+        gzip_file.write(data)
+    return path
+
+
+def boundaries():
+    ''' Uncompressed positions of the block starts '''
+    positions = [0]
+    for size in BLOCK_SIZES:
+        positions.append(positions[-1] + size)
+    return positions
+
+
+def slices(data):
+    rnd = random.Random(1)
+    keys = [(0, None), (0, len(data)), (len(data) - 1, None), (5, 5),
+            (len(data) + 10, None), (-100, None)]
+    for boundary in boundaries():
+        for shift in (-2, -1, 0, 1):
+            keys.append((max(0, boundary + shift),
+                         boundary + shift + rnd.randint(1, 70000)))
+    for _ in range(200):
+        start = rnd.randint(0, len(data))
+        keys.append((start, start + rnd.randint(0, 100000)))
+    return keys
+
+
+def substrings(data):
+    ''' Substrings over the block boundaries and one not present '''
+    found = [data[max(0, boundary - 3):boundary + 4]
+             for boundary in boundaries()[1:-1]]
+    return found + [b"ACGTX"]
+
+
+def test_bgzf_slices(bgzf_path, data):
+    assert bgzf.is_bgzf(bgzf_path)
+    with bgzf.BgzfReader(bgzf_path) as reader:
+        assert len(reader) == len(data)
+        for start, stop in slices(data):
+            assert reader[start:stop] == data[start:stop], (start, stop)
+
+
+def test_bgzf_find(bgzf_path, data):
+    with bgzf.BgzfReader(bgzf_path) as reader:
+        for sub in substrings(data):
+            for start in (0, 3, bgzf.BLOCK_SIZE):
+                assert reader.find(sub, start) == data.find(sub, start)
+
+
+def test_bgzf_block_index_reused(bgzf_path, data):
+    ## the first reader saved the .gzi index, the second one loads it
+    with bgzf.BgzfReader(bgzf_path) as first:
+        with bgzf.BgzfReader(bgzf_path) as second:
+            assert second.offsets == first.offsets
+            assert second[100:50000] == data[100:50000]
+
+
+def test_gzip_stream(gzip_path, data, monkeypatch):
+    ## small buffers to drop data and restart the decompression
+    monkeypatch.setattr(bgzf, "STREAM_CHUNK", 1000)
+    monkeypatch.setattr(bgzf, "STREAM_BACKWARD", 3000)
+    with bgzf.open_gzip(gzip_path) as stream:
+        assert isinstance(stream, bgzf.GzipStream)
+        for start, stop in slices(data):
+            if start < 0:
+                continue
+            assert stream[start:stop] == data[start:stop], (start, stop)
+        for sub in substrings(data):
+            for start in (0, 5000, 100):
+                assert stream.find(sub, start) == data.find(sub, start)
+        assert len(stream) == len(data)
+
+
+def test_compressed_fasta(tmp_path):
+    rnd = random.Random(2)
+    sequences = {"seq{}".format(idx): "".join(
+        rnd.choice("ACGTN") for _ in range(rnd.randint(1, 90000)))
+                 for idx in range(5)}
+    text = "".join(">{} description\n{}\n".format(name, "\n".join(
+        seq[start:start + 60] for start in range(0, len(seq), 60)))
+                   for name, seq in sequences.items()).encode("ascii")
+    plain = str(tmp_path / "query.fa")
+    with open(plain, "wb") as fasta:
+        fasta.write(text)
+    with gzip.open(str(tmp_path / "query.fa.gz"), "wb") as fasta:
+        fasta.write(text)
+    with bgzf.BgzfWriter(str(tmp_path / "query.fa.bgz")) as fasta:
+        fasta.write(text)
+    for path in (plain, str(tmp_path / "query.fa.gz"),
+                 str(tmp_path / "query.fa.bgz")):
+        index = fasta_index.FastaIndex(path)
+        try:
+            for name, seq in sequences.items():
+                assert index.fetch(name) == seq
+                assert index.fetch(name, 7, 61000) == seq[7:61000]
+        finally:
+            index.close()
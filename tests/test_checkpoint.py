@@ -0,0 +1,94 @@
+''' Search recorded to the checkpoint directory and resumed after it was
+interrupted gives the same domains as the search without the checkpoint '''
+import os
+import json
+import pytest
+import configuration
+import dante
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+## windows of the recorded LASTAL output (see conftest)
+WIN_DOM = 5000
+OVERLAP_DOM = 1200
+
+
+class Interrupted(Exception):
+    pass
+
+
+def search_lines(genome, THRESHOLD_SCORE=80, **options):
+    search = dante.DomainSearch(genome, "db", CLASSIFICATION, THRESHOLD_SCORE,
+                                WIN_DOM, OVERLAP_DOM, **options)
+    lines = [dante.gff3_line(domain, domain.seq_id, SOURCE="dante")
+             for domain in search]
+    return lines, search
+
+
+def interrupt_after(monkeypatch, windows):
+    ''' Search is interrupted after the windows are written to fragments '''
+    add = dante.FragmentWriter.add
+    added = []
+
+    def interrupted_add(fragments, window, domains):
+        if len(added) == windows:
+            raise Interrupted()
+        add(fragments, window, domains)
+        added.append(window)
+
+    monkeypatch.setattr(dante.FragmentWriter, "add", interrupted_add)
+    return added
+
+
+def done_files(checkpoint):
+    return [os.path.join(checkpoint, file_name)
+            for file_name in os.listdir(checkpoint)
+            if file_name.endswith(configuration.DONE_SUFFIX)]
+
+
+@pytest.mark.parametrize("WORKERS", [1, 2])
+def test_resume(replay_lastal, tmp_path, monkeypatch, WORKERS):
+    expected, search = search_lines(replay_lastal)
+    windows = search.windows
+    assert expected and len(windows) > 3
+    checkpoint = str(tmp_path / "checkpoint")
+    with monkeypatch.context() as interrupted:
+        added = interrupt_after(interrupted, 2)
+        with pytest.raises(Interrupted):
+            search_lines(replay_lastal, CHECKPOINT=checkpoint)
+    assert len(added) == 2
+    ## record of the next window interrupted while it was written
+    [done_file] = done_files(checkpoint)
+    with open(done_file, "a") as done:
+        done.write("{}\t0".format(windows[2].name))
+    assert sorted(dante.finished_windows(checkpoint)) == sorted(
+        window.name for window in added)
+    lines, search = search_lines(replay_lastal, CHECKPOINT=checkpoint,
+                                 RESUME=True, WORKERS=WORKERS)
+    assert lines == expected
+    assert search.metrics.counts["windows_searched"] == len(windows) - 2
+    ## all windows are finished, nothing is searched again
+    lines, search = search_lines(replay_lastal, CHECKPOINT=checkpoint,
+                                 RESUME=True)
+    assert lines == expected
+    assert search.metrics.counts["windows_searched"] == 0
+
+
+def test_resume_different_search(replay_lastal, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    search_lines(replay_lastal, CHECKPOINT=checkpoint)
+    with open(os.path.join(checkpoint,
+                           configuration.CHECKPOINT_MANIFEST)) as manifest:
+        assert json.load(manifest)["parameters"] == [80, "BL80"]
+    with pytest.raises(ValueError, match="can not be resumed"):
+        search_lines(replay_lastal, 60, CHECKPOINT=checkpoint, RESUME=True)
+
+
+def test_checkpoint_without_resume(replay_lastal, tmp_path):
+    ''' New search removes the fragments of the previous one '''
+    checkpoint = str(tmp_path / "checkpoint")
+    expected, _ = search_lines(replay_lastal, CHECKPOINT=checkpoint)
+    lines, search = search_lines(replay_lastal, CHECKPOINT=checkpoint)
+    assert lines == expected
+    assert search.metrics.counts["windows_searched"] == len(search.windows)
+    assert len(done_files(checkpoint)) == 1
@@ -0,0 +1,131 @@
+''' Requests answered by the server over the stream and the unix socket,
+the responses contain the domains of dante.py search of the sequences '''
+import io
+import os
+import socket
+import sys
+import threading
+import pytest
+import benchmark
+import configuration
+import dante
+import dante_server
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+WIN_DOM = 10000000
+OVERLAP_DOM = 10000
+## sequences of the requests, the server searches them named by their order
+REQUESTS = [["chrA", "chrB"], ["chrC"]]
+
+
+@pytest.fixture(scope="module")
+def server_genome(tmp_path_factory):
+    ''' Sequences named as renamed by the server with the recorded LASTAL
+	output, return path of the genome, the recording and the sequences '''
+    bench_dir = tmp_path_factory.mktemp("server")
+    genome = str(bench_dir / configuration.BENCH_GENOME)
+    recording = str(bench_dir / configuration.BENCH_RECORDING)
+    benchmark.generate_genome(genome, 3, 8000, 0)
+    sequences = []
+    with open(genome) as fasta:
+        for line in fasta:
+            if line.startswith(">"):
+                sequences.append([])
+            else:
+                sequences[-1].append(line.strip())
+    sequences = ["".join(sequence) for sequence in sequences]
+    with open(genome, "w") as fasta:
+        for idx, sequence in enumerate(sequences):
+            fasta.write(">{}\n{}\n".format(idx, sequence))
+    benchmark.generate_hits(genome, recording, 2, 4, 0, WIN_DOM, OVERLAP_DOM,
+                            CLASSIFICATION)
+    return genome, recording, sequences
+
+
+@pytest.fixture
+def annotator(server_genome, monkeypatch):
+    ''' Annotator of the server with LASTAL replaced by the recording '''
+    recording = server_genome[1]
+    monkeypatch.setattr(
+        configuration, "LASTAL_COMMAND",
+        '"{}" "{}" replay "{}" # {{}} {{}}'.format(
+            sys.executable, os.path.abspath(benchmark.__file__), recording))
+    monkeypatch.setattr(configuration, "SC_MATRIX", None, raising=False)
+    return dante_server.Annotator("db", CLASSIFICATION, 80, WIN_DOM,
+                                  OVERLAP_DOM, "BL80")
+
+
+def request_text(sequences):
+    names = [name for request in REQUESTS for name in request]
+    return "".join(
+        "".join(">{} request sequence\n{}\n".format(name, sequences[
+            names.index(name)]) for name in request) + "{}\n".format(
+                configuration.SERVER_END) for request in REQUESTS)
+
+
+def expected_responses(server_genome, annotator):
+    ''' Domains found by dante.py search renamed to the request sequences '''
+    genome, _, _ = server_genome
+    names = [name for request in REQUESTS for name in request]
+    lines = {name: [] for name in names}
+    for domain in dante.DomainSearch(genome, "db", CLASSIFICATION, 80,
+                                     WIN_DOM, OVERLAP_DOM):
+        name = names[int(domain.seq_id)]
+        lines[name].append(dante.gff3_line(domain, name, 0,
+                                           configuration.SOURCE_DANTE))
+    header = "{}\n{}".format(configuration.HEADER_GFF,
+                             annotator.version_string)
+    responses = []
+    for request in REQUESTS:
+        domains = [line for name in request for line in lines[name]]
+        assert domains
+        responses.append("{}{}{}\n".format(header, "".join(domains),
+                                           configuration.SERVER_END))
+    return responses
+
+
+def test_stream_requests(server_genome, annotator):
+    output = io.StringIO()
+    dispatcher = dante_server.Dispatcher(annotator, 0.05,
+                                         configuration.SERVER_BATCH_SIZE)
+    text = request_text(server_genome[2]) + "ACGT\n{}\n\n".format(
+        configuration.SERVER_END)
+    for lines in dante_server.read_requests(io.StringIO(text)):
+        dispatcher.submit(dante_server.Request(lines, output))
+    dispatcher.stop()
+    dispatcher.run()
+    responses = expected_responses(server_genome, annotator)
+    responses.append(
+        "{}\n{}##ERROR Invalid fasta: sequence without fasta header\n"
+        "{}\n".format(configuration.HEADER_GFF, annotator.version_string,
+                      configuration.SERVER_END))
+    assert output.getvalue() == "".join(responses)
+
+
+def test_socket_requests(server_genome, annotator, tmp_path):
+    ''' Requests of a connection answered in their order, each connection
+	gets its own responses '''
+    path = str(tmp_path / "dante.sock")
+    dispatcher = dante_server.Dispatcher(annotator, 0.05,
+                                         configuration.SERVER_BATCH_SIZE)
+    server = threading.Thread(target=dante_server.serve_socket,
+                              args=(dispatcher, path))
+    server.start()
+    responses = []
+    try:
+        for _ in range(2):
+            while not os.path.exists(path):
+                server.join(0.01)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(path)
+                client.sendall(request_text(server_genome[2]).encode("utf-8"))
+                client.shutdown(socket.SHUT_WR)
+                with client.makefile("r", encoding="utf-8") as response:
+                    responses.append(response.read())
+    finally:
+        dispatcher.stop()
+        server.join()
+    assert responses == ["".join(expected_responses(server_genome,
+                                                    annotator))] * 2
+    assert not os.path.exists(path)
@@ -0,0 +1,95 @@
+''' Domains of the windows reused from the cache and the least recently used
+records evicted when the cache exceeds its size '''
+import os
+import pytest
+import configuration
+import dante
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+## windows of the recorded LASTAL output (see conftest)
+WIN_DOM = 5000
+OVERLAP_DOM = 1200
+
+
+def search_lines(genome, **options):
+    search = dante.DomainSearch(genome, "db", CLASSIFICATION, 80, WIN_DOM,
+                                OVERLAP_DOM, **options)
+    lines = [dante.gff3_line(domain, domain.seq_id, SOURCE="dante")
+             for domain in search]
+    return lines, search.metrics.counts
+
+
+def cache_records(cache_dir):
+    return sorted(os.path.join(directory, file_name)
+                  for directory, _, file_names in os.walk(cache_dir)
+                  for file_name in file_names if file_name.endswith(".pkl"))
+
+
+def test_cached_search(replay_lastal, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    expected, counts = search_lines(replay_lastal)
+    windows = counts["windows_searched"]
+    lines, counts = search_lines(replay_lastal, CACHE=cache_dir)
+    assert lines == expected
+    assert counts["windows_searched"] == windows
+    assert len(cache_records(cache_dir)) == windows
+    lines, counts = search_lines(replay_lastal, CACHE=cache_dir)
+    assert lines == expected
+    assert counts["windows_searched"] == 0
+    assert counts["windows_cached"] == windows
+    ## record which cannot be read is searched again
+    with open(cache_records(cache_dir)[0], "wb"):
+        pass
+    lines, counts = search_lines(replay_lastal, CACHE=cache_dir)
+    assert lines == expected
+    assert counts["windows_searched"] == 1
+    assert counts["windows_cached"] == windows - 1
+
+
+def test_search_evicts(replay_lastal, tmp_path):
+    ''' Records exceeding the size are evicted at the end of the search '''
+    cache_dir = str(tmp_path / "cache")
+    search_lines(replay_lastal, CACHE=cache_dir)
+    records = cache_records(cache_dir)
+    size = sum(os.path.getsize(record) for record in records)
+    search_lines(replay_lastal, CACHE=cache_dir, CACHE_SIZE=size)
+    assert cache_records(cache_dir) == records
+    search_lines(replay_lastal, CACHE=cache_dir, CACHE_SIZE=size // 2)
+    kept = cache_records(cache_dir)
+    assert 0 < len(kept) < len(records)
+    assert sum(os.path.getsize(record) for record in kept) <= size // 2
+
+
+@pytest.fixture
+def cache(tmp_path):
+    ''' Cache of 6 records used one after another '''
+    cache = dante.DomainCache(str(tmp_path), {"search": 1}, 0)
+    domain = dante.Domain(*range(len(dante.Domain._fields)))
+    keys = ["{:02x}{}".format(idx, "0" * 30) for idx in range(6)]
+    for idx, key in enumerate(keys):
+        cache.store(key, [domain] * (idx + 1))
+        os.utime(cache.path(key), (1000 + idx, 1000 + idx))
+    return cache, keys
+
+
+def test_eviction(cache):
+    cache, keys = cache
+    sizes = [os.path.getsize(cache.path(key)) for key in keys]
+    ## the loaded record becomes the most recently used one
+    assert len(cache.load(keys[0])) == 1
+    cache.max_size = sizes[0] + sum(sizes[-2:])
+    cache.evict()
+    assert [cache.contains(key) for key in keys] == [True, False, False,
+                                                    False, True, True]
+    assert cache.load(keys[1]) is None
+
+
+def test_no_eviction_below_size(cache):
+    cache, keys = cache
+    cache.max_size = sum(os.path.getsize(cache.path(key)) for key in keys)
+    cache.evict()
+    assert all(cache.contains(key) for key in keys)
+    cache.max_size -= 1
+    cache.evict()
+    assert [cache.contains(key) for key in keys] == [False] + [True] * 5
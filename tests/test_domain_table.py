@@ -0,0 +1,135 @@
+''' Domains table read back by memory mapping compared with the fields of
+the GFF lines written for the same domains, filtering by the table '''
+import os
+import math
+import shutil
+import pytest
+import benchmark
+import configuration
+import dante
+import domain_table
+import dante_gff_output_filtering as filtering
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+FLOAT_ATTRIBUTES = ["Identity", "Similarity", "Relat_Length",
+                    "Relat_Interruptions", "Hit_to_DB_Length"]
+
+
+@pytest.fixture(scope="module")
+def gff(tmp_path_factory):
+    ''' GFF of the domains of synthetic LASTAL output with the table '''
+    SC_MATRIX = getattr(configuration, "SC_MATRIX", None)
+    configuration.SC_MATRIX = configuration.SC_MATRIX_SKELETON.format("BL80")
+    out_dir = tmp_path_factory.mktemp("table")
+    genome = str(out_dir / configuration.BENCH_GENOME)
+    maf = str(out_dir / configuration.BENCH_RECORDING)
+    benchmark.generate_genome(genome, 3, 30000, 0)
+    benchmark.generate_hits(genome, maf, 3, 6, 0, 10000000, 10000,
+                            CLASSIFICATION)
+    path = str(out_dir / "domains.gff")
+    with open(maf, "rb") as maf_pipe, open(path, "w") as gff_file:
+        dante.write_info(gff_file, "")
+        with domain_table.DomainTableWriter(
+                domain_table.table_path(path)) as table:
+            for sequence_hits in dante.read_lastal_hits(maf_pipe):
+                for domain in dante.hits_domains(sequence_hits, CLASSIFICATION,
+                                                 80):
+                    domain = dante.sequence_domain(
+                        domain, sequence_hits['name_q'], 0)
+                    gff_file.write(dante.gff3_line(domain, domain.seq_id,
+                                                   SOURCE="dante"))
+                    table.append(domain)
+    if SC_MATRIX is None:
+        del configuration.SC_MATRIX
+    else:
+        configuration.SC_MATRIX = SC_MATRIX
+    return path
+
+
+def gff_lines(path):
+    with open(path) as gff_file:
+        return [filtering.parse_gff_line(line) for line in gff_file
+                if not line.startswith("#")]
+
+
+def test_table_matches_gff(gff):
+    lines = gff_lines(gff)
+    table = domain_table.DomainTable(domain_table.table_path(gff))
+    assert len(table) == len(lines) > 0
+    seq_ids = table.values("seqid")
+    strands = table.values("strand")
+    names = table.values("Name")
+    classifications = table.values("Final_Classification")
+    ambiguous = 0
+    for row, gff_line in enumerate(lines):
+        attributes = gff_line['attributes']
+        assert seq_ids[row] == gff_line['seqid']
+        assert strands[row] == gff_line['strand']
+        assert table["start"][row] == int(gff_line['start'])
+        assert table["end"][row] == int(gff_line['end'])
+        assert names[row] == attributes['Name']
+        assert classifications[row] == attributes['Final_Classification']
+        if attributes['Final_Classification'] == configuration.AMBIGUOUS_TAG:
+            ambiguous += 1
+            assert math.isnan(table["score"][row])
+            assert all(math.isnan(table[name][row])
+                       for name in FLOAT_ATTRIBUTES)
+            assert table.string("Region_Seq", row) == ""
+            continue
+        assert table["score"][row] == float(gff_line['score'])
+        for name in FLOAT_ATTRIBUTES:
+            assert table[name][row] == float(attributes[name]), name
+        for name in ["DB_Seq", "Region_Seq", "Query_Seq"]:
+            assert table.string(name, row) == attributes[name], name
+    assert 0 < ambiguous < len(lines)
+
+
+def filter_outputs(dom_gff, out_dir, SELECTED_DOM, ELEMENT):
+    filt_gff = os.path.join(out_dir, "filtered.gff")
+    prot_seq = os.path.join(out_dir, "prot.fa")
+    filtering.filter_qual_dom(dom_gff, filt_gff, 0.35, 0.45, 0.8, 3, 1.2,
+                              SELECTED_DOM, ELEMENT, None, prot_seq)
+    outputs = []
+    for path in (filt_gff, prot_seq):
+        with open(path) as output:
+            outputs.append(output.read())
+    return outputs
+
+
+@pytest.mark.parametrize("SELECTED_DOM, ELEMENT", [
+    ("All", ""), ("RT", ""), ("All", "Ty3/gypsy"), ("INT", "Ty1/copia")])
+def test_filter_by_table(gff, tmp_path, monkeypatch, SELECTED_DOM, ELEMENT):
+    without_table = str(tmp_path / "domains.gff")
+    shutil.copy(gff, without_table)
+    expected = filter_outputs(without_table, str(tmp_path), SELECTED_DOM,
+                              ELEMENT)
+    ## only the filtered lines are parsed
+    parsed = []
+    parse_gff_line = filtering.parse_gff_line
+    monkeypatch.setattr(filtering, "parse_gff_line",
+                        lambda line: parsed.append(line) or
+                        parse_gff_line(line))
+    assert filter_outputs(gff, str(tmp_path), SELECTED_DOM,
+                          ELEMENT) == expected
+    assert len(parsed) == len([line for line in expected[0].splitlines()
+                               if not line.startswith("#")])
+
+
+def test_table_not_matching(gff, tmp_path):
+    dom_gff = str(tmp_path / "domains.gff")
+    shutil.copy(gff, dom_gff)
+    shutil.copytree(domain_table.table_path(gff),
+                    domain_table.table_path(dom_gff))
+    with open(gff) as gff_file:
+        last_line = gff_file.readlines()[-1]
+    with open(dom_gff, "a") as gff_file:
+        gff_file.write(last_line)
+    ## older table is not used
+    os.utime(dom_gff, (os.path.getmtime(dom_gff) + 10, ) * 2)
+    assert domain_table.gff_table(dom_gff) is None
+    os.utime(dom_gff, (os.path.getmtime(dom_gff) - 20, ) * 2)
+    with pytest.raises(ValueError, match="does not match"):
+        filter_outputs(dom_gff, str(tmp_path), "All", "")
+    assert sorted(os.listdir(str(tmp_path))) == ["domains.gff",
+                                                 "domains.gff.table"]
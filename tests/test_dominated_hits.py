@@ -0,0 +1,70 @@
+''' Hits dropped by dominated_hits while reading the LASTAL output must not
+change the domains '''
+import os
+import pytest
+import benchmark
+import configuration
+import dante
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+
+
+@pytest.fixture(scope="module")
+def recording(tmp_path_factory):
+    ''' Synthetic LASTAL output with dense loci of overlapping hits '''
+    bench_dir = tmp_path_factory.mktemp("hits")
+    genome = str(bench_dir / configuration.BENCH_GENOME)
+    maf = str(bench_dir / configuration.BENCH_RECORDING)
+    benchmark.generate_genome(genome, 3, 30000, 0)
+    benchmark.generate_hits(genome, maf, 5, 8, 0, 10000000, 10000,
+                            CLASSIFICATION)
+    return maf
+
+
+def search_domains(maf, THRESHOLD_SCORE, pruning):
+    lines = []
+    pruned = 0
+    with open(maf, "rb") as maf_pipe:
+        for sequence_hits in dante.read_lastal_hits(
+                maf_pipe, THRESHOLD_SCORE=THRESHOLD_SCORE if pruning else None):
+            pruned += sequence_hits['pruned']
+            for domain in dante.hits_domains(sequence_hits, CLASSIFICATION,
+                                             THRESHOLD_SCORE):
+                lines.append(dante.gff3_line(domain, sequence_hits['name_q'],
+                                             SOURCE="dante"))
+    return lines, pruned
+
+
+@pytest.mark.parametrize("THRESHOLD_SCORE", [50, 80, 95])
+def test_pruning_keeps_domains(recording, monkeypatch, THRESHOLD_SCORE):
+    monkeypatch.setattr(configuration, "SC_MATRIX",
+                        configuration.SC_MATRIX_SKELETON.format("BL80"),
+                        raising=False)
+    domains, pruned = search_domains(recording, THRESHOLD_SCORE, True)
+    expected, _ = search_domains(recording, THRESHOLD_SCORE, False)
+    assert pruned > 0
+    assert domains == expected
+
+
+def test_single_minus_strand_hit(tmp_path, monkeypatch):
+    ''' Pruning leaves a single hit of the minus strand only window, it is
+	the first hit and the domain must stay on the minus strand '''
+    monkeypatch.setattr(configuration, "SC_MATRIX",
+                        configuration.SC_MATRIX_SKELETON.format("BL80"),
+                        raising=False)
+    maf = tmp_path / "minus.maf"
+    with open(str(maf), "w") as maf_file:
+        for score, start, protein in [(500, 141, "MKVLAWRTE" * 11),
+                                      (372, 256, "MKVLAWRTE" * 4 + "M")]:
+            maf_file.write(
+                "a score={0}\ns Ty1-RT__REXdb_ID1 0 {1} + 300 {2}\n"
+                "s window {3} {4} - 5000 {2}\n\n".format(
+                    score, len(protein), protein, start, 3 * len(protein)))
+    for pruning in (True, False):
+        with open(str(maf), "rb") as maf_pipe:
+            [sequence_hits] = dante.read_lastal_hits(
+                maf_pipe, THRESHOLD_SCORE=80 if pruning else None)
+        assert sequence_hits['pruned'] == (1 if pruning else 0)
+        [domain] = dante.hits_domains(sequence_hits, CLASSIFICATION, 80)
+        assert (domain.strand, domain.start, domain.end) == ("-", 4563, 4859)
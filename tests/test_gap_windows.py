@@ -0,0 +1,106 @@
+''' Sequences cut to windows in the runs of unknown bases, the runs are
+not searched and the parts between them are covered by the windows '''
+import io
+import re
+import random
+import pytest
+import configuration
+import dante
+
+WIN_DOM = 5000
+OVERLAP_DOM = 1200
+MIN_GAP = 100
+## parts of the sequences - number of known bases or a run of unknown bases
+SEQUENCES = {
+    "seqA": [3000, "N" * 500, 12000, "N" * 50, 4000, "n" * 200],
+    "seqB": ["X" * 300, 2000, "N" * 150, 6000, "N" * 99, 300],
+    "seqC": [7000],
+    "seqD": [4000],
+}
+
+
+@pytest.fixture(scope="module")
+def genome(tmp_path_factory):
+    rnd = random.Random(0)
+    sequences = {}
+    path = str(tmp_path_factory.mktemp("gaps") / "genome.fasta")
+    with open(path, "w") as fasta:
+        for name, parts in SEQUENCES.items():
+            sequence = "".join(
+                part if isinstance(part, str) else "".join(
+                    rnd.choice("ACGT") for _ in range(part))
+                for part in parts)
+            sequences[name] = sequence
+            fasta.write(">{}\n".format(name))
+            for start in range(0, len(sequence), configuration.FASTA_LINE):
+                fasta.write("{}\n".format(
+                    sequence[start:start + configuration.FASTA_LINE]))
+    return path, sequences
+
+
+def expected_gaps(sequence):
+    return [(run.start(), run.end())
+            for run in re.finditer("[NnXx]+", sequence)
+            if run.end() - run.start() >= MIN_GAP]
+
+
+@pytest.mark.parametrize("GAP_CHUNK", [configuration.GAP_CHUNK, 1000, 77])
+def test_query_gaps(genome, monkeypatch, GAP_CHUNK):
+    ''' Runs continuing over the chunks the sequence is read by are joined '''
+    path, sequences = genome
+    monkeypatch.setattr(configuration, "GAP_CHUNK", GAP_CHUNK)
+    records = dante.characterize_fasta(path)
+    assert dante.query_gaps(path, records, MIN_GAP) == [
+        expected_gaps(sequences[record.name]) for record in records]
+
+
+def test_windows_in_gaps(genome):
+    path, sequences = genome
+    records = dante.characterize_fasta(path)
+    gaps = dante.query_gaps(path, records, MIN_GAP)
+    windows = dante.query_windows(records, WIN_DOM, WIN_DOM - OVERLAP_DOM,
+                                  gaps)
+    assert len(set(window.name for window in windows)) == len(windows)
+    for idx, record in enumerate(records):
+        record_windows = [window for window in windows if window.record == idx]
+        covered = set()
+        for window in record_windows:
+            assert window.end - window.start <= WIN_DOM
+            assert not any(window.start < gap_end and gap_start < window.end
+                           for gap_start, gap_end in gaps[idx])
+            covered.update(range(window.start, window.end))
+        gap_bases = set()
+        for gap_start, gap_end in gaps[idx]:
+            gap_bases.update(range(gap_start, gap_end))
+        assert covered == set(range(record.length)) - gap_bases
+        if not gaps[idx] and record.length <= WIN_DOM:
+            assert [window.name for window in record_windows] == [record.name]
+            continue
+        assert record_windows[-1].name.startswith(
+            "{}_DANTE_PART{}_LAST:".format(record.name, len(record_windows)))
+        ## overlapping windows of a part are cut in the middle of the overlap
+        for previous, window in zip(record_windows, record_windows[1:]):
+            if window.start < previous.end:
+                assert previous.cut_end == window.cut_start == (
+                    window.start + OVERLAP_DOM / 2)
+            else:
+                assert previous.cut_end is None and window.cut_start is None
+
+
+def test_gaps_not_searched(genome):
+    ''' Windows sent to LASTAL do not contain the gaps '''
+    path, sequences = genome
+    records = dante.characterize_fasta(path)
+    windows = dante.query_windows(records, WIN_DOM, WIN_DOM - OVERLAP_DOM,
+                                  dante.query_gaps(path, records, MIN_GAP))
+    stream = io.BytesIO()
+    stream.close = lambda: None
+    dante.write_windows(path, records, windows, stream)
+    written = stream.getvalue().decode("ascii").split("\n")
+    assert written[0::2][:-1] == [">{}".format(window.name)
+                                  for window in windows]
+    for window, sequence in zip(windows, written[1::2]):
+        assert sequence == sequences[records[window.record].name][
+            window.start:window.end]
+        assert not expected_gaps(sequence)
+    assert "N" * 50 in "".join(written[1::2])
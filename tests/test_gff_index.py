@@ -0,0 +1,93 @@
+''' Compressed GFF written by GffWriter: BGZF round trip and region queries
+through the CSI index compared with a full scan '''
+import os
+import gzip
+import random
+import shutil
+import subprocess
+import pytest
+import bgzf
+import gff_index
+
+## lengths of the sequences, the longest needs deeper CSI binning
+SEQUENCES = {"chr1": 900000000, "chr2": 5000000, "ctg3": 20000}
+
+
+def feature_line(seq_id, start, end, idx):
+    return "{}\tdante\tprotein_domain\t{}\t{}\t.\t+\t.\tName=F{}\n".format(
+        seq_id, start, end, idx)
+
+
+@pytest.fixture(scope="module")
+def features():
+    rnd = random.Random(0)
+    lines = []
+    for idx in range(3000):
+        seq_id = rnd.choice(list(SEQUENCES))
+        length = rnd.choice([50, 500, 5000, 50000, 2000000])
+        start = rnd.randint(1, SEQUENCES[seq_id])
+        end = min(start + rnd.randint(0, length), SEQUENCES[seq_id])
+        lines.append((seq_id, start, end, feature_line(seq_id, start, end,
+                                                       idx)))
+    ## features of the sequences are interleaved
+    rnd.shuffle(lines)
+    return lines
+
+
+@pytest.fixture(scope="module")
+def gff(tmp_path_factory, features):
+    path = str(tmp_path_factory.mktemp("gff") / "domains.gff.gz")
+    with gff_index.open_gff(path, "w") as gff_file:
+        gff_file.write("##gff-version 3\n")
+        for _, _, _, line in features:
+            gff_file.write(line)
+        gff_file.write("##NOTE after features\n")
+    return path
+
+
+def test_round_trip(gff, features):
+    order = []
+    for seq_id, _, _, _ in features:
+        if seq_id not in order:
+            order.append(seq_id)
+    expected = ["##gff-version 3\n"]
+    for seq_id in order:
+        expected.extend(line for _, _, _, line in sorted(
+            [feature for feature in features if feature[0] == seq_id],
+            key=lambda feature: feature[1]))
+    expected.append("##NOTE after features\n")
+    with gzip.open(gff, "rt") as gff_file:
+        assert gff_file.read() == "".join(expected)
+    assert bgzf.is_bgzf(gff)
+    assert os.path.exists("{}{}".format(gff, gff_index.CSI_SUFFIX))
+    if shutil.which("gzip"):
+        subprocess.check_call(["gzip", "-t", gff])
+
+
+def test_region_queries(gff, features):
+    rnd = random.Random(1)
+    for _ in range(400):
+        seq_id = rnd.choice(list(SEQUENCES))
+        if rnd.random() < 0.05:
+            region, start, end = seq_id, 1, SEQUENCES[seq_id]
+        else:
+            start = rnd.randint(1, SEQUENCES[seq_id])
+            end = start + rnd.choice([0, 100, 10000, 1000000, 50000000])
+            region = "{}:{}-{}".format(seq_id, start, end)
+        expected = sorted(line for feature_seq, feature_start, feature_end,
+                          line in features if feature_seq == seq_id and
+                          feature_end >= start and feature_start <= end)
+        assert sorted(gff_index.gff_features(gff, region)) == expected, region
+
+
+def test_unknown_sequence(gff):
+    assert list(gff_index.gff_features(gff, "chrX:1-1000")) == []
+
+
+def test_discard_on_error(tmp_path):
+    path = str(tmp_path / "partial.gff.gz")
+    with pytest.raises(RuntimeError):
+        with gff_index.open_gff(path, "w") as gff_file:
+            gff_file.write(feature_line("chr2", 1, 100, 0))
+            raise RuntimeError("interrupted")
+    assert list(tmp_path.iterdir()) == []
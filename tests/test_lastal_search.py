@@ -0,0 +1,145 @@
+''' Windows searched by LASTAL - a failure of LASTAL must not shorten
+the output silently, the pipelined processing matches the serial one '''
+import os
+import multiprocessing
+import pytest
+import benchmark
+import configuration
+import dante
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+WIN_DOM = 5000
+OVERLAP_DOM = 1200
+
+
+@pytest.fixture(scope="module")
+def search_input(tmp_path_factory):
+    ''' Genome, its windows and synthetic LASTAL output of the windows '''
+    bench_dir = tmp_path_factory.mktemp("search")
+    genome = str(bench_dir / configuration.BENCH_GENOME)
+    maf = str(bench_dir / configuration.BENCH_RECORDING)
+    benchmark.generate_genome(genome, 3, 12000, 0)
+    benchmark.generate_hits(genome, maf, 2, 4, 0, WIN_DOM, OVERLAP_DOM,
+                            CLASSIFICATION)
+    records = dante.characterize_fasta(genome)
+    windows = dante.query_windows(records, WIN_DOM, WIN_DOM - OVERLAP_DOM)
+    return genome, records, windows, maf
+
+
+@pytest.fixture(autouse=True)
+def scoring_matrix(monkeypatch):
+    monkeypatch.setattr(configuration, "SC_MATRIX",
+                        configuration.SC_MATRIX_SKELETON.format("BL80"),
+                        raising=False)
+
+
+def fake_lastal(monkeypatch, maf, returncode):
+    ''' LASTAL replaced by a command printing the recorded output '''
+    monkeypatch.setattr(
+        configuration, "LASTAL_COMMAND",
+        "cat > /dev/null; cat {}; exit {} # {{}} {{}}".format(maf, returncode))
+
+
+def search(search_input, returncode, monkeypatch, reported, output=True):
+    genome, records, windows, maf = search_input
+    fake_lastal(monkeypatch, maf if output else os.devnull, returncode)
+    for window, _ in dante.search_sequences(genome, records, windows, "db",
+                                            CLASSIFICATION, 80, "BL80"):
+        reported.append(window)
+
+
+def test_all_windows_reported(search_input, monkeypatch):
+    reported = []
+    search(search_input, 0, monkeypatch, reported)
+    assert reported == search_input[2]
+
+
+def test_lastal_failure(search_input, monkeypatch):
+    reported = []
+    with pytest.raises(RuntimeError, match="return code 3"):
+        search(search_input, 3, monkeypatch, reported)
+    assert reported == search_input[2][:len(reported)]
+
+
+def test_lastal_failure_without_output(search_input, monkeypatch):
+    reported = []
+    with pytest.raises(RuntimeError, match="return code 1"):
+        search(search_input, 1, monkeypatch, reported, False)
+    assert reported == []
+
+
+def test_lastal_failure_cached(search_input, monkeypatch, tmp_path):
+    ''' Windows of the cached search are not reported after the failure '''
+    genome, records, windows, maf = search_input
+    fake_lastal(monkeypatch, maf, 2)
+    cache = dante.DomainCache(str(tmp_path), {}, 1000000)
+    reported = []
+    with pytest.raises(RuntimeError, match="return code 2"):
+        for window, _ in dante.search_sequences(genome, records, windows, "db",
+                                                CLASSIFICATION, 80, "BL80",
+                                                cache):
+            reported.append(window)
+    assert reported == windows[:len(reported)]
+
+
+class CountingPool():
+    ''' Pool counting the sequences submitted to the processing '''
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.submitted = 0
+
+    def apply_async(self, *args):
+        self.submitted += 1
+        return self.pool.apply_async(*args)
+
+
+@pytest.mark.parametrize("PIPELINE", [1, 2])
+def test_pipelined_domains(search_input, PIPELINE):
+    ''' Pipelined processing returns the sequences in the order of serial
+	processing with at most 2 x PIPELINE sequences in the pool at once '''
+    maf = search_input[3]
+    with open(maf, "rb") as maf_pipe:
+        expected = list(dante.serial_domains(
+            maf_pipe, CLASSIFICATION, 80, dante.SearchMetrics(), True))
+    pool = multiprocessing.Pool(PIPELINE,
+                                initializer=dante.init_pipeline_worker,
+                                initargs=(configuration.SC_MATRIX, ))
+    counting_pool = CountingPool(pool)
+    sequences = []
+    in_pool = []
+    try:
+        with open(maf, "rb") as maf_pipe:
+            for sequence_domains in dante.pipelined_domains(
+                    maf_pipe, CLASSIFICATION, 80, dante.SearchMetrics(),
+                    counting_pool, PIPELINE, True):
+                in_pool.append(counting_pool.submitted - len(sequences))
+                sequences.append(sequence_domains)
+    finally:
+        pool.terminate()
+        pool.join()
+    assert len(expected) > 2 * PIPELINE
+    assert sequences == expected
+    assert max(in_pool) <= 2 * PIPELINE
+
+
+def test_pipelined_search(search_input, monkeypatch):
+    ''' The search by the pool matches the serial search, the pool is shut
+	down also if the search is not finished '''
+    genome, records, windows, maf = search_input
+    fake_lastal(monkeypatch, maf, 0)
+    expected = list(dante.lastal_search(genome, records, windows, "db",
+                                        CLASSIFICATION, 80, "BL80",
+                                        dante.SearchMetrics()))
+    assert list(dante.lastal_search(genome, records, windows, "db",
+                                    CLASSIFICATION, 80, "BL80",
+                                    dante.SearchMetrics(), 2)) == expected
+    assert multiprocessing.active_children() == []
+    search = dante.lastal_search(genome, records, windows, "db",
+                                 CLASSIFICATION, 80, "BL80",
+                                 dante.SearchMetrics(), 2)
+    assert next(search) == expected[0]
+    assert multiprocessing.active_children() != []
+    search.close()
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,60 @@
+''' Filtered GFF with the statistics header written after the single pass
+over the input, plain and compressed outputs have the same content '''
+import os
+import gzip
+import pytest
+import dante_gff_output_filtering as filtering
+
+DOM_GFF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), "test-data", "GEPY_test_long_1_output_unfiltered.gff3")
+
+
+def run_filter(dom_gff, filt_gff, prot_seq, SELECTED_DOM="All"):
+    filtering.filter_qual_dom(dom_gff, filt_gff, 0.35, 0.45, 0.8, 3, 1.2,
+                              SELECTED_DOM, "", None, prot_seq)
+
+
+def split_gff(lines):
+    header = [line for line in lines if line.startswith("#")]
+    features = [line for line in lines if not line.startswith("#")]
+    return header, features
+
+
+@pytest.mark.parametrize("SELECTED_DOM", ["All", "RH", "GAG"])
+def test_plain_and_compressed(tmp_path, SELECTED_DOM):
+    plain = str(tmp_path / "filtered.gff")
+    compressed = str(tmp_path / "filtered.gff.gz")
+    run_filter(DOM_GFF, plain, str(tmp_path / "plain.fa"), SELECTED_DOM)
+    run_filter(DOM_GFF, compressed, str(tmp_path / "compressed.fa"),
+               SELECTED_DOM)
+    with open(plain) as plain_gff:
+        plain_lines = plain_gff.readlines()
+    with gzip.open(compressed, "rt") as compressed_gff:
+        compressed_lines = compressed_gff.readlines()
+    header, features = split_gff(plain_lines)
+    ## statistics follow the input header, features follow the statistics
+    with open(DOM_GFF) as dom_gff:
+        assert plain_lines[:5] == dom_gff.readlines()[:5]
+    assert plain_lines[:len(header)] == header
+    assert all(line.startswith("##") for line in header)
+    assert split_gff(compressed_lines) == (header, sorted(
+        features, key=lambda line: int(line.split("\t")[3])))
+    with open(str(tmp_path / "plain.fa")) as plain_fa, open(
+            str(tmp_path / "compressed.fa")) as compressed_fa:
+        assert plain_fa.read() == compressed_fa.read()
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "compressed.fa", "filtered.gff", "filtered.gff.gz",
+        "filtered.gff.gz.csi", "plain.fa"]
+
+
+@pytest.mark.parametrize("output", ["filtered.gff", "filtered.gff.gz"])
+def test_failure_removes_outputs(tmp_path, output):
+    dom_gff = str(tmp_path / "broken.gff")
+    with open(DOM_GFF) as source, open(dom_gff, "w") as broken:
+        lines = source.readlines()
+        broken.writelines(lines[:10])
+        broken.write("seq\tdante\tprotein_domain\t1\t10\t.\t+\t.\tName\n")
+    with pytest.raises(ValueError):
+        run_filter(dom_gff, str(tmp_path / output),
+                   str(tmp_path / "prot.fa"))
+    assert os.listdir(str(tmp_path)) == ["broken.gff"]
@@ -0,0 +1,79 @@
+''' Hits with the alignments spilled to a temporary file are the same as
+the hits kept in memory, the spill files are removed after use '''
+import os
+import pickle
+import tempfile
+import numpy as np
+import pytest
+import configuration
+import dante
+
+CLASSIFICATION = os.path.join(configuration.TOOL_DATA, "protein_domains",
+                              "Viridiplantae_v3.0_class")
+## windows of the recorded LASTAL output (see conftest)
+WIN_DOM = 5000
+OVERLAP_DOM = 1200
+
+
+@pytest.fixture(autouse=True)
+def spill_dir(tmp_path, monkeypatch):
+    ''' Spill files are created in the temporary directory of the test '''
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(configuration, "SC_MATRIX",
+                        configuration.SC_MATRIX_SKELETON.format("BL80"),
+                        raising=False)
+    return tmp_path
+
+
+def spill_files(spill_dir):
+    return [file_name for file_name in os.listdir(str(spill_dir))
+            if file_name.startswith(configuration.SPILL_PREFIX)]
+
+
+def read_hits(recording, SPILL, THRESHOLD_SCORE):
+    with open(recording, "rb") as maf_pipe:
+        return list(dante.read_lastal_hits(maf_pipe, SPILL, THRESHOLD_SCORE))
+
+
+@pytest.mark.parametrize("THRESHOLD_SCORE", [None, 80])
+def test_spilled_columns(recorded_genome, spill_dir, THRESHOLD_SCORE):
+    recording = recorded_genome[1]
+    in_memory = read_hits(recording, False, THRESHOLD_SCORE)
+    spilled = read_hits(recording, True, THRESHOLD_SCORE)
+    assert len(spill_files(spill_dir)) == len(spilled) > 1
+    for memory_hits, spilled_hits in zip(in_memory, spilled):
+        assert memory_hits['spill'] is None
+        assert os.path.exists(spilled_hits['spill'])
+        for column in dante.LASTAL_INT_COLUMNS:
+            assert np.array_equal(memory_hits[column], spilled_hits[column])
+        for column in ("strand_q", "name_q", "pruned"):
+            assert np.array_equal(memory_hits[column], spilled_hits[column])
+        hits = len(memory_hits['score'])
+        region = np.array([hits - 1, 0, hits // 2])
+        for column in dante.LASTAL_STR_COLUMNS:
+            memory_column = memory_hits[column]
+            spilled_column = spilled_hits[column]
+            assert isinstance(spilled_column, dante.SpilledColumn)
+            assert len(spilled_column) == len(memory_column) == hits
+            assert spilled_column[range(hits)] == memory_column[range(hits)]
+            assert spilled_column[region] == memory_column[region]
+            ## column passed to the pipeline worker
+            assert pickle.loads(pickle.dumps(spilled_column))[
+                region] == memory_column[region]
+        assert dante.hits_domains(spilled_hits, CLASSIFICATION,
+                                  80) == dante.hits_domains(
+                                      memory_hits, CLASSIFICATION, 80)
+        dante.release_hits(spilled_hits)
+        assert not os.path.exists(spilled_hits['spill'])
+    assert spill_files(spill_dir) == []
+
+
+@pytest.mark.parametrize("PIPELINE", [0, 2])
+def test_spilled_search(replay_lastal, spill_dir, PIPELINE):
+    expected = list(dante.DomainSearch(replay_lastal, "db", CLASSIFICATION, 80,
+                                       WIN_DOM, OVERLAP_DOM))
+    assert expected
+    assert list(dante.DomainSearch(replay_lastal, "db", CLASSIFICATION, 80,
+                                   WIN_DOM, OVERLAP_DOM, PIPELINE=PIPELINE,
+                                   SPILL=True)) == expected
+    assert spill_files(spill_dir) == []
@@ -0,0 +1,146 @@
+''' Domains of overlapping windows resolved by WindowMerger must be the same
+as by adjust_gff, the post-pass over the GFF of the windows used before '''
+import random
+from collections import defaultdict
+import dante
+
+WIN_DOM = 10000
+OVERLAP_DOM = 3000
+LENGTHS = {"seq_a": 45000, "seq_b": 8000, "seq_c": 23000}
+
+
+def adjust_gff(OUTPUT_DOMAIN, gff, WIN_DOM, OVERLAP_DOM, step):
+    ''' Reference: adjust_gff of the original dante.py '''
+    seq_id_all = []
+    class_dict = defaultdict(int)
+    seen = set()
+    with open(OUTPUT_DOMAIN, "w") as adjusted_gff:
+        with open(gff, "r") as primary_gff:
+            start = True
+            for line in primary_gff:
+                if line.startswith("#"):
+                    adjusted_gff.write(line)
+                else:
+                    split_line = line.split("\t")
+                    classification = split_line[-1].split(";")[1].split("=")[1]
+                    if start:
+                        seq_id_all.append(split_line[0].split("_DANTE_PART")[
+                            0])
+                        start = False
+                    seq_id = split_line[0].split("_DANTE_PART")[0]
+                    if "DANTE_PART" in line:
+                        line_without_id = "\t".join(split_line[1:])
+                        part = int(split_line[0].split("_DANTE_PART")[1].split(
+                            ":")[0].split("_")[0])
+                        if seq_id != seq_id_all[-1]:
+                            seq_id_all.append(seq_id)
+                        if part == 1:
+                            cut_end = WIN_DOM - OVERLAP_DOM / 2
+                            if int(split_line[3]) <= cut_end <= int(split_line[
+                                    4]):
+                                if line_without_id not in seen:
+                                    adjusted_gff.write("{}\t{}".format(
+                                        seq_id, line_without_id))
+                                    class_dict[classification] += 1
+                                    seen.add(line_without_id)
+                            elif int(split_line[4]) < cut_end:
+                                adjusted_gff.write("{}\t{}".format(
+                                    seq_id, line_without_id))
+                                class_dict[classification] += 1
+                        elif "LAST" in split_line[0]:
+                            cut_start = OVERLAP_DOM / 2 + (part - 1) * step
+                            if int(split_line[3]) <= cut_start <= int(
+                                    split_line[4]):
+                                if line_without_id not in seen:
+                                    adjusted_gff.write("{}\t{}".format(
+                                        seq_id, line_without_id))
+                                    class_dict[classification] += 1
+                                    seen.add(line_without_id)
+                            elif int(split_line[3]) > cut_start:
+                                adjusted_gff.write("{}\t{}".format(
+                                    seq_id, line_without_id))
+                                class_dict[classification] += 1
+                        else:
+                            cut_start = OVERLAP_DOM / 2 + (part - 1) * step
+                            cut_end = WIN_DOM - OVERLAP_DOM / 2 + (part -
+                                                                   1) * step
+                            if int(split_line[3]) <= cut_start <= int(
+                                    split_line[4]) or int(split_line[
+                                        3]) <= cut_end <= int(split_line[4]):
+                                if line_without_id not in seen:
+                                    adjusted_gff.write("{}\t{}".format(
+                                        seq_id, line_without_id))
+                                    class_dict[classification] += 1
+                                    seen.add(line_without_id)
+                            elif int(split_line[3]) > cut_start and int(
+                                    split_line[4]) < cut_end:
+                                adjusted_gff.write("{}\t{}".format(
+                                    seq_id, line_without_id))
+                                class_dict[classification] += 1
+                    else:
+                        if seq_id != seq_id_all[-1]:
+                            seq_id_all.append(seq_id)
+                        adjusted_gff.write(line)
+                        class_dict[classification] += 1
+
+
+def sequence_domains(rnd, length, windows):
+    ''' Random domains of the sequence, every fourth goes over a cut '''
+    cuts = [cut for window in windows
+            for cut in (window.cut_start, window.cut_end) if cut is not None]
+    domains = []
+    for idx in range(length // 400):
+        size = rnd.randint(300, 2500)
+        if cuts and idx % 4 == 0:
+            start = int(rnd.choice(cuts)) - rnd.randint(0, size)
+        else:
+            start = rnd.randint(1, length)
+        start = max(1, start)
+        domains.append((start, min(length, start + size), idx))
+    return sorted(domains)
+
+
+def window_domain(start, end, idx, window):
+    ''' Domain found in the window (positions relative to the window) '''
+    return dante.Domain(
+        start - window.start, end - window.start, 100 + idx, "+",
+        "RT", "Class_I|LTR", "hits_{}".format(idx), "Ty1-RT__REXdb_ID1",
+        start - window.start, end - window.start, 100, 1, 200, 250, "MKV",
+        "MKV", "MKL", 0.5, 0.6, 0.9, 0, 1.1)
+
+
+def test_merger_matches_adjust_gff(tmp_path):
+    rnd = random.Random(0)
+    fasta = tmp_path / "query.fa"
+    with open(str(fasta), "w") as query:
+        for name, length in LENGTHS.items():
+            query.write(">{}\n{}\n".format(name, "ACGT" * (length // 4)))
+    records = dante.characterize_fasta(str(fasta))
+    step = WIN_DOM - OVERLAP_DOM
+    windows = dante.query_windows(records, WIN_DOM, step)
+    primary = tmp_path / "primary.gff"
+    merger = dante.WindowMerger()
+    merged = []
+    with open(str(primary), "w") as primary_gff:
+        for record_idx, record in enumerate(records):
+            record_windows = [window for window in windows
+                              if window.record == record_idx]
+            domains = sequence_domains(rnd, record.length, record_windows)
+            for window in record_windows:
+                found = [window_domain(start, end, idx, window)
+                         for start, end, idx in domains
+                         if start > window.start and end <= window.end]
+                for domain in found:
+                    primary_gff.write(dante.gff3_line(
+                        domain, window.name, window.start, SOURCE="dante"))
+                merged.extend(
+                    dante.gff3_line(domain, domain.seq_id, SOURCE="dante")
+                    for domain in merger.add(window, found, record.name))
+    adjusted = tmp_path / "adjusted.gff"
+    adjust_gff(str(adjusted), str(primary), WIN_DOM, OVERLAP_DOM, step)
+    with open(str(adjusted)) as adjusted_gff:
+        expected = adjusted_gff.readlines()
+    with open(str(primary)) as primary_gff:
+        ## duplicates of the overlaps are removed
+        assert len(primary_gff.readlines()) > len(expected)
+    assert merged == expected